@@ -1,6 +1,14 @@
 import socket
 import threading
 import json
+import time
+from monitor import LoopMonitor
+from profiling import Profiler
+from timer_wheel import TimerWheel
+from ttl import ExpiryIndex
+
+EXPIRY_INTERVAL = 1.0  # Seconds between background passes that reclaim expired messages
+MAX_WAIT_MS = 60000    # Longest a long-poll PULL may wait for messages
 
 class MessageBroker:
     def __init__(self, host='localhost', port=8080):
@@ -13,6 +21,16 @@ class MessageBroker:
         self.subscribers = {}
         self.subscriber_views = {}
         self.lock = threading.Lock()
+        # Signalled whenever messages are stored or a topic is deleted, for long-poll PULLs
+        self.arrived = threading.Condition(self.lock)
+        # Delayed messages wait in a timer wheel until they are due
+        self.timers = TimerWheel(time.time())
+        # Expiry of messages published with a TTL
+        self.expiry = ExpiryIndex()
+        # On-demand profiling of command handlers (PROFILE admin command)
+        self.profiler = Profiler("broker")
+        # Scheduling lag of the broker's threads, and commands that held a thread for too long
+        self.monitor = LoopMonitor()
 
     def handle_client(self, client_socket):
         # Handle incoming client messages
@@ -22,35 +40,65 @@ class MessageBroker:
                 if not message:
                     break
                 data = json.loads(message)
-                command = data.get('command')
-                topic = data.get('topic')
-                msg = data.get('message')
-                sid = data.get('sid')
-
-                # Handle different client commands
-                if command == 'CREATE' and topic:
-                    self.create_topic(topic)
-                elif command == 'PUBLISH' and topic and msg:
-                    self.publish(topic, msg)
-                elif command == 'SUBSCRIBE' and topic and sid:
-                    self.subscribe(sid, topic)
-                elif command == 'PULL' and topic and sid:
-                    self.pull_messages(client_socket, sid, topic)
+                started = time.perf_counter()
+                if self.profiler.active:
+                    with self.profiler.command(data.get('command')):
+                        response = self.dispatch(client_socket, data)
                 else:
-                    print(f"Invalid command: {message}")
-
-                client_socket.send(json.dumps({"status": "ok"}).encode('utf-8') + b'\n')
+                    response = self.dispatch(client_socket, data)
+                elapsed = time.perf_counter() - started
+                # A long-poll PULL is slow on purpose
+                blocked = 0.0 if self.wait_of(data) else elapsed
+                if self.monitor.handled(data.get('command'), data.get('topic'), blocked, elapsed):
+                    print(f"Slow handler: {data.get('command')} of topic '{data.get('topic')}' took {elapsed * 1000:.1f}ms")
+                client_socket.send(json.dumps(response).encode('utf-8') + b'\n')
         except Exception as e:
             print(f"Error handling client: {e}")
         finally:
             client_socket.close()
 
-    def create_topic(self, topic):
-        # Create a new topic
+    def dispatch(self, client_socket, data):
+        # Run one client command and return the reply
+        command = data.get('command')
+        topic = data.get('topic')
+        msg = data.get('message')
+        sid = data.get('sid')
+
+        # Handle different client commands
+        if command == 'PROFILE':
+            return self.profiler.handle(data)
+        elif command == 'STATS':
+            return self.get_stats()
+        elif command == 'CREATE' and topic:
+            self.create_topic(topic, self.ttl_of(data))
+        elif command == 'PUBLISH' and topic and msg:
+            self.publish(topic, msg, self.delivery_time(data), self.ttl_of(data))
+        elif command == 'SUBSCRIBE' and topic and sid:
+            self.subscribe(sid, topic)
+        elif command == 'PULL' and topic and sid:
+            return self.pull_messages(sid, topic, self.wait_of(data), data.get('min_messages', 1))
+        else:
+            print(f"Invalid command: {json.dumps(data)}")
+        return {"status": "ok"}
+
+    def get_stats(self):
+        # Counters and thread scheduling health of the broker
+        with self.lock:
+            stats = {
+                "topics": len(self.topics),
+                "messages": sum(len(messages) for messages in self.topics.values()),
+                "subscribers": len(self.subscribers),
+                "expired_messages": self.expiry.expired,
+            }
+        return {**stats, **self.monitor.report()}
+
+    def create_topic(self, topic, ttl=None):
+        # Create a new topic, whose messages expire after ttl seconds if given
         with self.lock:
             if topic not in self.topics:
                 self.topics[topic] = []
                 self.subscriber_views[topic] = 0
+                self.expiry.set_ttl(topic, ttl)
                 print(f"Topic '{topic}' created.")
                 
     def delete_topic(self, topic):
@@ -58,14 +106,68 @@ class MessageBroker:
         with self.lock:
             if topic in self.topics:
                 del self.topics[topic]
+                self.expiry.drop(topic)
+                self.arrived.notify_all()
                 print(f"Topic '{topic}' deleted.")
 
-    def publish(self, topic, message):
-        # Publish a message to a topic
+    def publish(self, topic, message, deliver_at=None, ttl=None):
+        # Publish a message to a topic, or hold it until deliver_at
         with self.lock:
             if topic in self.topics:
-                self.topics[topic].append(message)
-                print(f"Message published to topic '{topic}': {message}")
+                if deliver_at is not None and deliver_at > time.time():
+                    self.timers.schedule(deliver_at, (topic, message, ttl))
+                    print(f"Message scheduled on topic '{topic}' for {deliver_at:.3f}: {message}")
+                else:
+                    self.append_message(topic, message, ttl)
+                    print(f"Message published to topic '{topic}': {message}")
+
+    def append_message(self, topic, message, ttl):
+        # Store a message and track its expiry; called with the lock held
+        self.topics[topic].append(message)
+        expires_at = self.expiry.expires_at(topic, ttl, time.time())
+        if expires_at is not None:
+            self.expiry.track(topic, self.expiry.base(topic) + len(self.topics[topic]) - 1, expires_at)
+        self.arrived.notify_all()
+
+    def wait_of(self, data):
+        # How long a PULL may wait for messages, in seconds, from wait_ms
+        return min(data['wait_ms'], MAX_WAIT_MS) / 1000 if data.get('command') == 'PULL' and data.get('wait_ms') else None
+
+    def ttl_of(self, data):
+        # TTL of a CREATE or PUBLISH in seconds, from ttl_ms
+        return data['ttl_ms'] / 1000 if data.get('ttl_ms') is not None else None
+
+    def expire_due(self):
+        # Drop expired messages; called with the lock held
+        for topic, count in self.expiry.reap(time.time(), stored=self.topics).items():
+            if topic in self.topics:
+                del self.topics[topic][:count]
+                print(f"Expired {count} messages from topic '{topic}'")
+
+    def reclaim_expired(self):
+        # Reclaim expired messages in the background, including from topics nobody pulls
+        while True:
+            time.sleep(EXPIRY_INTERVAL)
+            with self.lock:
+                self.expire_due()
+
+    def delivery_time(self, data):
+        # When a PUBLISH should become visible: deliver_at (Unix time) or delay_ms from now
+        if data.get('deliver_at') is not None:
+            return data['deliver_at']
+        if data.get('delay_ms'):
+            return time.time() + data['delay_ms'] / 1000
+        return None
+
+    def deliver_delayed(self):
+        # Publish delayed messages as they fall due, one wheel tick at a time
+        while True:
+            time.sleep(self.timers.tick)
+            with self.lock:
+                for topic, message, ttl in self.timers.advance(time.time()):
+                    if topic in self.topics:
+                        self.append_message(topic, message, ttl)
+                        print(f"Delayed message published to topic '{topic}': {message}")
 
     def subscribe(self, sid, topic):
         # Subscribe a client to a topic
@@ -78,24 +180,36 @@ class MessageBroker:
                 self.subscribers[sid]['subscriptions'].append(topic)
             print(f"Client {sid} subscribed to topic '{topic}'.")
 
-    def pull_messages(self, client_socket, sid, topic):
-        # Send pulled messages to a subscriber
+    def pull_messages(self, sid, topic, wait=None, min_messages=1):
+        # Pull messages for a subscriber, waiting up to wait seconds for at least min_messages
         with self.lock:
-            if topic in self.subscribers[sid]['subscriptions']:
-                messages = self.topics.get(topic, []).copy()
+            if sid in self.subscribers and topic in self.subscribers[sid]['subscriptions']:
+                if wait:
+                    # Waiting releases the lock, so publishers can get in
+                    self.arrived.wait_for(lambda: topic not in self.topics or len(self.visible_messages(topic)) >= min_messages, wait)
+                if topic not in self.topics:
+                    return {"messages": []}
+                messages = self.visible_messages(topic)
                 self.subscriber_views[topic] += 1
                 # Reset topic if all subscribers have pulled messages
                 if self.subscriber_views[topic] >= len([s for s in self.subscribers if topic in self.subscribers[s]['subscriptions']]):
+                    self.expiry.clear(topic, len(self.topics[topic]))
                     self.topics[topic] = []
                     self.subscriber_views[topic] = 0
-                response = json.dumps({"messages": messages})
-            else:
-                response = json.dumps({"messages": []})
-            client_socket.send(response.encode('utf-8') + b'\n')
+                return {"messages": messages}
+            return {"messages": []}
+
+    def visible_messages(self, topic):
+        # Unexpired messages of a topic; called with the lock held
+        self.expire_due()
+        return self.expiry.visible(topic, self.topics.get(topic, []))
 
     def start(self):
         # Start the message broker server
         print("Message Broker started...")
+        threading.Thread(target=self.deliver_delayed, daemon=True).start()
+        threading.Thread(target=self.reclaim_expired, daemon=True).start()
+        threading.Thread(target=self.monitor.run_thread, daemon=True).start()
         while True:
             client_socket, addr = self.server.accept()
             print(f"Accepted connection from {addr}")
@@ -34,10 +34,12 @@ class ClientAPI:
         print(f"Publisher registered with ID: {pid}")
         return pid
 
-    def create_topic(self, pid, topic):
-        # Send request to create a new topic
+    def create_topic(self, pid, topic, ttl_ms=None):
+        # Send request to create a new topic, whose messages expire after ttl_ms if given
         print(f"Publisher {pid} requested to create topic: {topic}")
         message = {'command': 'CREATE', 'topic': topic}
+        if ttl_ms is not None:
+            message['ttl_ms'] = ttl_ms
         return self.send_and_receive(message)
         
     def delete_topic(self, pid, topic):
@@ -46,12 +48,28 @@ class ClientAPI:
         message = {'command': 'DELETE', 'topic': topic}
         return self.send_and_receive(message)
     
-    def send_message(self, pid, topic, message):
-        # Send a message to a specific topic
+    def send_message(self, pid, topic, message, delay_ms=None, deliver_at=None, ttl_ms=None):
+        # Send a message to a specific topic, optionally delayed or scheduled for a Unix time,
+        # and expiring ttl_ms after it is published
         print(f"Publisher {pid} sent message to topic '{topic}': {message}")
         msg = {'command': 'PUBLISH', 'topic': topic, 'message': message}
+        if delay_ms is not None:
+            msg['delay_ms'] = delay_ms
+        if deliver_at is not None:
+            msg['deliver_at'] = deliver_at
+        if ttl_ms is not None:
+            msg['ttl_ms'] = ttl_ms
         return self.send_and_receive(msg)
 
+    def get_stats(self):
+        # Counters, thread scheduling lag and slow commands of the broker
+        return self.send_and_receive({'command': 'STATS'})
+
+    def profile(self, op, **options):
+        # Control the broker's profiler: op is start, stop, dump, status, memory_start, memory_diff or memory_stop
+        message = {'command': 'PROFILE', 'op': op, **options}
+        return self.send_and_receive(message)
+
     def register_subscriber(self):
         # Generate and return a unique Subscriber ID
         sid = str(uuid.uuid4())
@@ -64,9 +82,13 @@ class ClientAPI:
         message = {'command': 'SUBSCRIBE', 'topic': topic, 'sid': sid}
         return self.send_and_receive(message)
 
-    def pull_messages(self, sid, topic):
-        # Request to pull new messages from a topic
+    def pull_messages(self, sid, topic, wait_ms=None, min_messages=1):
+        # Request to pull new messages from a topic; with wait_ms the broker holds the request
+        # until at least min_messages are available or wait_ms has passed
         print(f"Subscriber {sid} pulling messages from topic: {topic}")
         message = {'command': 'PULL', 'topic': topic, 'sid': sid}
+        if wait_ms is not None:
+            message['wait_ms'] = wait_ms
+            message['min_messages'] = min_messages
         response = self.send_and_receive(message)
         return response.get('messages', [])
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+LAG_INTERVAL = 0.1        # Seconds between loop lag samples
+SLOW_HANDLER = 0.05       # Seconds a handler may block before it is reported as slow
+RECENT_SLOW = 32          # Slow handlers kept for the report
+LAG_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)  # Upper bounds of the lag histogram
+
+class LoopMonitor:
+    """Measures how long the server's event loop (or threads) stall, and who stalls them.
+
+    The lag sampler sleeps for a fixed interval and records how late it wakes
+    up. Any lateness is time in which the loop could not run a ready callback,
+    i.e. it was blocked by synchronous work. Lags are kept in a histogram.
+
+    Handlers report how long they blocked: for a coroutine, its longest step
+    between two awaits (see TimedSteps); for a threaded handler, its duration.
+    Those above the threshold are kept with their command and topic.
+    """
+
+    def __init__(self, interval=LAG_INTERVAL, slow_threshold=SLOW_HANDLER):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.lock = threading.Lock()
+        self.lag_counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.lag_samples = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.slow = deque(maxlen=RECENT_SLOW)
+        self.slow_by_command = {}  # command -> {"count", "max_blocked_ms"}
+
+    def record_lag(self, lag):
+        ms = lag * 1000
+        bucket = next((i for i, bound in enumerate(LAG_BUCKETS_MS) if ms <= bound), len(LAG_BUCKETS_MS))
+        with self.lock:
+            self.lag_counts[bucket] += 1
+            self.lag_samples += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+
+    async def run(self):
+        """Sample the lag of the running event loop until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record_lag(max(0.0, loop.time() - expected))
+
+    def run_thread(self):
+        """Sample how late a sleeping thread is woken, for servers built on threads."""
+        while True:
+            expected = time.perf_counter() + self.interval
+            time.sleep(self.interval)
+            self.record_lag(max(0.0, time.perf_counter() - expected))
+
+    def handled(self, command, topic, blocked, wall):
+        """Note a finished handler. Returns True if it blocked for longer than the threshold."""
+        if blocked < self.slow_threshold:
+            return False
+        with self.lock:
+            self.slow.append({"command": command, "topic": topic, "blocked_ms": round(blocked * 1000, 3),
+                              "wall_ms": round(wall * 1000, 3), "at": round(time.time(), 3)})
+            entry = self.slow_by_command.setdefault(command, {"count": 0, "max_blocked_ms": 0.0})
+            entry["count"] += 1
+            entry["max_blocked_ms"] = max(entry["max_blocked_ms"], round(blocked * 1000, 3))
+        return True
+
+    def lag_quantile(self, q):
+        # Upper bound of the bucket holding the q-quantile; None past the last bound
+        rank = q * self.lag_samples
+        seen = 0
+        for bound, count in zip(LAG_BUCKETS_MS, self.lag_counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def report(self):
+        with self.lock:
+            histogram = {f"<={bound}ms": count for bound, count in zip(LAG_BUCKETS_MS, self.lag_counts)}
+            histogram[f">{LAG_BUCKETS_MS[-1]}ms"] = self.lag_counts[-1]
+            return {
+                "loop_lag": {
+                    "samples": self.lag_samples,
+                    "interval_ms": self.interval * 1000,
+                    "mean_ms": round(self.lag_total / self.lag_samples * 1000, 3) if self.lag_samples else 0.0,
+                    "max_ms": round(self.lag_max * 1000, 3),
+                    "p50_ms": self.lag_quantile(0.5) if self.lag_samples else 0,
+                    "p99_ms": self.lag_quantile(0.99) if self.lag_samples else 0,
+                    "histogram": histogram,
+                },
+                "slow_handlers": {
+                    "threshold_ms": self.slow_threshold * 1000,
+                    "by_command": {command: dict(entry) for command, entry in self.slow_by_command.items()},
+                    "recent": list(self.slow),
+                },
+            }
+
+class TimedSteps:
+    """Awaitable that drives a coroutine one step at a time and times each step.
+
+    A step runs from one await to the next without yielding to the event loop,
+    so `longest` is the longest the coroutine blocked the loop and `busy` its
+    total running time. Optional `enter`/`exit` hooks run around every step;
+    `exit` receives what `enter` returned.
+    """
+
+    def __init__(self, coro, enter=None, exit=None):
+        self.coro = coro
+        self.enter = enter
+        self.exit = exit
+        self.busy = 0.0
+        self.longest = 0.0
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            started = time.perf_counter()
+            token = self.enter() if self.enter else None
+            try:
+                if error is not None:
+                    yielded = self.coro.throw(error)
+                else:
+                    yielded = self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                if self.exit:
+                    self.exit(token)
+                step = time.perf_counter() - started
+                self.busy += step
+                self.longest = max(self.longest, step)
+            try:
+                value, error = (yield yielded), None
+            except BaseException as exc:
+                value, error = None, exc
@@ -1,5 +1,7 @@
 from client_api import ClientAPI
 
+WAIT_MS = 5000  # How long each pull waits for messages to arrive
+
 def main():
     # Create API instance and register as a subscriber
     api = ClientAPI()
@@ -15,7 +17,7 @@ def main():
     # Pull and display messages from subscribed topics
     for topic in topics:
         print(f"Pulling messages from topic: {topic}")
-        messages = api.pull_messages(sid, topic)
+        messages = api.pull_messages(sid, topic, wait_ms=WAIT_MS)
         if messages:
             print(f"Messages from {topic}:")
             for msg in messages:
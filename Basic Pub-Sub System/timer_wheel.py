@@ -0,0 +1,70 @@
+TICK = 0.01      # Seconds per tick of the innermost wheel
+SLOT_BITS = 8    # 256 slots per wheel
+LEVELS = 4       # 256^4 ticks of 10 ms: about 497 days before the overflow list is used
+
+class TimerWheel:
+    """Hierarchical timing wheel for a large number of timers at tick resolution.
+
+    Level L has 2^SLOT_BITS slots of 2^(SLOT_BITS*L) ticks each. A timer goes
+    into the lowest level whose current rotation contains its expiry tick, so
+    inserting is O(1). Each tick fires the current slot of level 0. When a
+    level wraps around, the next slot of the level above is emptied into the
+    levels below it. Every timer is moved at most LEVELS times, so advancing
+    is O(1) amortised per tick and per timer, however many timers are pending.
+    """
+
+    def __init__(self, now, tick=TICK, slot_bits=SLOT_BITS, levels=LEVELS):
+        self.tick = tick
+        self.bits = slot_bits
+        self.mask = (1 << slot_bits) - 1
+        self.levels = levels
+        self.wheels = [[[] for _ in range(1 << slot_bits)] for _ in range(levels)]
+        self.overflow = []  # Timers beyond the outermost wheel's current rotation
+        self.current = int(now / tick)
+        self.pending = 0
+
+    def schedule(self, deadline, item):
+        """Fire `item` at the first tick at or after `deadline` (seconds, same clock as advance)."""
+        self.insert(max(self.current + 1, -int(-deadline // self.tick)), item)
+        self.pending += 1
+
+    def insert(self, expiry, item):
+        for level in range(self.levels):
+            shift = self.bits * (level + 1)
+            if expiry >> shift == self.current >> shift:
+                self.wheels[level][(expiry >> (self.bits * level)) & self.mask].append((expiry, item))
+                return
+        self.overflow.append((expiry, item))
+
+    def advance(self, now):
+        """Move the wheel up to time `now` and return the items of every timer that expired."""
+        target = int(now / self.tick)
+        if not self.pending:
+            self.current = max(self.current, target)
+            return []
+        due = []
+        while self.current < target:
+            self.current += 1
+            self.cascade()
+            slot = self.wheels[0][self.current & self.mask]
+            if slot:
+                due.extend(item for _, item in slot)
+                slot.clear()
+        self.pending -= len(due)
+        return due
+
+    def cascade(self):
+        """Empty the slots of outer wheels whose turn begins at the current tick, outermost first."""
+        levels = 0
+        while levels < self.levels and self.current & ((1 << (self.bits * (levels + 1))) - 1) == 0:
+            levels += 1
+        if levels == self.levels:
+            timers, self.overflow = self.overflow, []
+            for expiry, item in timers:
+                self.insert(expiry, item)
+        for level in range(min(levels, self.levels - 1), 0, -1):
+            slot = self.wheels[level][(self.current >> (self.bits * level)) & self.mask]
+            timers = slot[:]
+            slot.clear()
+            for expiry, item in timers:
+                self.insert(expiry, item)
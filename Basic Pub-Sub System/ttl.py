@@ -0,0 +1,148 @@
+import heapq
+
+TRIM_FRACTION = 0.25  # Share of a topic's stored messages its expired head may reach before it is cut off
+
+class ExpiryIndex:
+    """Expiry times of messages, so that expired ones are reclaimed without scanning topics.
+
+    Messages are addressed by absolute offset. A topic's base is the offset of
+    its first stored message and grows as expired messages are trimmed off the
+    head. Each topic keeps a min-heap of (expires_at, offset) for its messages
+    that have a TTL, and a global heap holds the earliest expiry of every topic,
+    so reaping only touches messages that are due: O(log n) per expired message.
+
+    An expired message that is not at the head cannot be cut out of the log
+    cheaply. It becomes a tombstone, hidden from reads, until everything before
+    it has expired too. Cutting off the head moves every message behind it, so
+    expired heads are also left as tombstones until they make up TRIM_FRACTION
+    of the topic, which keeps trimming O(1) amortised per expired message.
+    """
+
+    def __init__(self):
+        self.bases = {}       # topic -> absolute offset of the first stored message
+        self.ttls = {}        # topic -> default TTL of its messages, in seconds
+        self.heaps = {}       # topic -> [(expires_at, offset)]
+        self.queue = []       # [(expires_at, topic)], the minimum of each heap (plus stale entries)
+        self.tombstones = {}  # topic -> offsets of expired messages not trimmed yet
+        self.heads = {}       # topic -> offset past the expired messages at its head, if any
+        self.expired = 0
+
+    def base(self, topic):
+        return self.bases.get(topic, 0)
+
+    def set_ttl(self, topic, ttl):
+        if ttl is not None:
+            self.ttls[topic] = ttl
+
+    def expires_at(self, topic, ttl, now):
+        """Expiry of a new message: its own TTL in seconds, else the topic's, else None."""
+        if ttl is None:
+            ttl = self.ttls.get(topic)
+        return None if ttl is None else now + ttl
+
+    def track(self, topic, offset, expires_at):
+        heap = self.heaps.setdefault(topic, [])
+        heapq.heappush(heap, (expires_at, offset))
+        if heap[0] == (expires_at, offset):
+            heapq.heappush(self.queue, (expires_at, topic))
+
+    def reap(self, now, pinned=(), stored=None):
+        """Expire every message that is due. Returns {topic: messages to trim from its head}.
+
+        Topics in `pinned` get tombstones only, so that their offsets stay put.
+        With `stored`, the stored messages of each topic, a head is trimmed only
+        once it is at least TRIM_FRACTION of them; without, it is always trimmed.
+        """
+        reaped = set()
+        while self.queue and self.queue[0][0] <= now:
+            _, topic = heapq.heappop(self.queue)
+            heap = self.heaps.get(topic)
+            if not heap or heap[0][0] > now:
+                continue  # Stale: the topic was dropped, or this minimum was already reaped
+            dead = self.tombstones.setdefault(topic, set())
+            base = self.base(topic)
+            while heap and heap[0][0] <= now:
+                offset = heapq.heappop(heap)[1]
+                if offset >= base:
+                    dead.add(offset)
+                    self.expired += 1
+            if heap:
+                heapq.heappush(self.queue, (heap[0][0], topic))
+            else:
+                del self.heaps[topic]
+            reaped.add(topic)
+        trims = {}
+        for topic in reaped - set(pinned):
+            count = self.trim(topic, None if stored is None else len(stored.get(topic, ())))
+            if count:
+                trims[topic] = count
+        return trims
+
+    def trim(self, topic, length=None):
+        """Advance the base past the expired messages at the head of a topic and return how many.
+
+        Returns 0 without trimming while they are fewer than TRIM_FRACTION of `length` stored messages.
+        """
+        dead = self.tombstones.get(topic, set())
+        base = self.base(topic)
+        head = self.heads.get(topic, base)
+        while head in dead:
+            head += 1
+        if head == base:
+            return 0
+        self.heads[topic] = head
+        count = head - base
+        if length is not None and count < length and count < TRIM_FRACTION * length:
+            return 0
+        for offset in range(base, head):
+            dead.discard(offset)
+        if not dead:
+            self.tombstones.pop(topic, None)
+        del self.heads[topic]
+        self.bases[topic] = head
+        return count
+
+    def visible(self, topic, messages, start=None, stop=None):
+        """Stored messages in the absolute range [start, stop), without tombstones."""
+        base = self.base(topic)
+        first = max(0 if start is None else start - base, self.heads.get(topic, base) - base)
+        last = len(messages) if stop is None else max(stop - base, 0)
+        chunk = messages[first:last]
+        dead = self.tombstones.get(topic)
+        if not dead:
+            return chunk
+        return [message for offset, message in enumerate(chunk, base + first) if offset not in dead]
+
+    def clear(self, topic, count):
+        """The first `count` stored messages of a topic were removed by other means."""
+        self.bases[topic] = self.base(topic) + count
+        self.heaps.pop(topic, None)
+        self.tombstones.pop(topic, None)
+        self.heads.pop(topic, None)
+
+    def drop(self, topic):
+        self.bases.pop(topic, None)
+        self.ttls.pop(topic, None)
+        self.heaps.pop(topic, None)
+        self.tombstones.pop(topic, None)
+        self.heads.pop(topic, None)
+
+    def export(self, topic):
+        """JSON-friendly state of one topic, for snapshots and topic handoff."""
+        return {"base": self.base(topic), "ttl": self.ttls.get(topic),
+                "heap": list(self.heaps.get(topic, ())), "tombstones": sorted(self.tombstones.get(topic, ()))}
+
+    def restore(self, topic, state):
+        self.drop(topic)
+        if state["base"]:
+            self.bases[topic] = state["base"]
+        self.set_ttl(topic, state["ttl"])
+        if state["tombstones"]:
+            self.tombstones[topic] = set(state["tombstones"])
+        if state["heap"]:
+            heap = self.heaps[topic] = [tuple(entry) for entry in state["heap"]]
+            heapq.heapify(heap)
+            heapq.heappush(self.queue, (heap[0][0], topic))
+
+    def topics(self):
+        return set(self.bases) | set(self.ttls) | set(self.heaps) | set(self.tombstones)
@@ -1,82 +1,125 @@
 import asyncio
 import json
 import time
+from monitor import LoopMonitor, TimedSteps
+from profiling import Profiler
+
+MAX_REQUEST_SIZE = 64 * 1024 * 1024  # Largest request accepted, in bytes
 
 class IndexingServer:
     def __init__(self, host='127.0.0.1', port=9090):
         self.host = host
         self.port = port
         self.topics = {}  # Storing topics and the peers that host them
+        # On-demand profiling of request handlers ('profile' admin action)
+        self.profiler = Profiler("indexing-server")
+        # Event loop lag, and requests that blocked the loop for too long
+        self.monitor = LoopMonitor()
 
     async def handle_client(self, reader, writer):
         try:
-            data = await reader.read(1024)
-            message = data.decode().strip()
-            
             try:
-                message = json.loads(message)
-            except json.JSONDecodeError as e:
-                print(f"JSON Decode Error: {e}")
+                message = await self.read_request(reader)
+            except ValueError as e:  # Not JSON, or too large
+                print(f"Invalid request: {e}")
                 writer.write(json.dumps({'error': 'Invalid message format'}).encode())
                 await writer.drain()
                 writer.close()
                 return
 
             action = message.get('action')
-            peer_ip = message.get('peer_ip')
-            peer_port = message.get('peer_port')
-
-            if action == 'register':
-                self.log_event(f"Peer registered from {peer_ip}, {peer_port}")
-            elif action == 'topic_update':
-                topics = message.get('topics', [])
-                for topic in topics:
-                    if topic not in self.topics:
-                        self.topics[topic] = []
-                    if (peer_ip, peer_port) not in self.topics[topic]:
-                        self.topics[topic].append((peer_ip, peer_port))
-                self.log_event(f"Publisher hosted topics {topics} from {peer_ip}, {peer_port}")
-            elif action == 'topic_delete':
-                topics = message.get('topics', [])
-                for topic in topics:
-                    if topic in self.topics:
-                        self.topics[topic] = [
-                            peer for peer in self.topics[topic] if peer != (peer_ip, peer_port)
-                        ]
-                        if not self.topics[topic]:
-                            del self.topics[topic]
-                self.log_event(f"Publisher deleted topics {topics} from {peer_ip}, {peer_port}")
-            elif action == 'unregister':
-                topics = message.get('topics', [])
-                for topic in topics:
-                    if topic in self.topics:
-                        self.topics[topic] = [
-                            peer for peer in self.topics[topic] if peer != (peer_ip, peer_port)
-                        ]
-                        if not self.topics[topic]:
-                            del self.topics[topic]
-                self.log_event(f"Peer from {peer_ip}, {peer_port} is shutting down! Topics: {topics} deleted.")
-            elif action == 'query':
-                topic = message.get('topic')
-                self.log_event(f"Subscriber querying for Topic: {topic}")
-                peers = self.topics.get(topic, [])
-                
-                if peers:
-                    response = json.dumps({'peers': peers}).encode()
-                    self.log_event(f"Topic: {topic} found at {peers}")
-                else:
-                    response = json.dumps({'error': 'Topic not found'}).encode()
-                writer.write(response)
-                await writer.drain()
+            started = time.perf_counter()
+            if self.profiler.active:
+                steps = TimedSteps(self.profiler.run(action, self.process(action, message, writer)))
+            else:
+                steps = TimedSteps(self.process(action, message, writer))
+            await steps
+            topic = message.get('topic')
+            if self.monitor.handled(action, topic, steps.longest, time.perf_counter() - started):
+                self.log_event(f"Slow handler: {action} of topic '{topic}' blocked the event loop for {steps.longest * 1000:.1f}ms")
 
         except Exception as e:
             print(f"Error: {str(e)}")
 
         writer.close()
 
+    async def process(self, action, message, writer):
+        peer_ip = message.get('peer_ip')
+        peer_port = message.get('peer_port')
+
+        if action == 'profile':
+            writer.write(json.dumps(self.profiler.handle(message)).encode())
+            await writer.drain()
+        elif action == 'stats':
+            stats = {'topics': len(self.topics), **self.monitor.report()}
+            writer.write(json.dumps(stats).encode())
+            await writer.drain()
+        elif action == 'register':
+            self.log_event(f"Peer registered from {peer_ip}, {peer_port}")
+        elif action == 'topic_update':
+            topics = message.get('topics', [])
+            for topic in topics:
+                if topic not in self.topics:
+                    self.topics[topic] = []
+                if (peer_ip, peer_port) not in self.topics[topic]:
+                    self.topics[topic].append((peer_ip, peer_port))
+            self.log_event(f"Publisher hosted topics {topics} from {peer_ip}, {peer_port}")
+        elif action == 'topic_delete':
+            topics = message.get('topics', [])
+            for topic in topics:
+                if topic in self.topics:
+                    self.topics[topic] = [
+                        peer for peer in self.topics[topic] if peer != (peer_ip, peer_port)
+                    ]
+                    if not self.topics[topic]:
+                        del self.topics[topic]
+            self.log_event(f"Publisher deleted topics {topics} from {peer_ip}, {peer_port}")
+        elif action == 'unregister':
+            topics = message.get('topics', [])
+            for topic in topics:
+                if topic in self.topics:
+                    self.topics[topic] = [
+                        peer for peer in self.topics[topic] if peer != (peer_ip, peer_port)
+                    ]
+                    if not self.topics[topic]:
+                        del self.topics[topic]
+            self.log_event(f"Peer from {peer_ip}, {peer_port} is shutting down! Topics: {topics} deleted.")
+        elif action == 'query':
+            topic = message.get('topic')
+            self.log_event(f"Subscriber querying for Topic: {topic}")
+            peers = self.topics.get(topic, [])
+                
+            if peers:
+                response = json.dumps({'peers': peers}).encode()
+                self.log_event(f"Topic: {topic} found at {peers}")
+            else:
+                response = json.dumps({'error': 'Topic not found'}).encode()
+            writer.write(response)
+            await writer.drain()
+        elif action == 'query_many':
+            topics = message.get('topics', [])
+            self.log_event(f"Subscriber querying for {len(topics)} Topics")
+            found = {topic: self.topics[topic] for topic in topics if topic in self.topics}
+            writer.write(json.dumps({'peers': found}).encode())
+            await writer.drain()
+
+    async def read_request(self, reader):
+        # Clients half-close after sending, so a request is everything up to EOF, parsed once
+        chunks, size = [], 0
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_REQUEST_SIZE:
+                raise ValueError(f"Request exceeds the {MAX_REQUEST_SIZE} byte limit")
+            chunks.append(chunk)
+        return json.loads(b''.join(chunks))
+
     async def start(self):
         server = await asyncio.start_server(self.handle_client, self.host, self.port)
         self.log_event(f"Indexing server started on {self.host}, {self.port}")
+        self.monitor_task = asyncio.create_task(self.monitor.run())
         print("Waiting for peers to host topics and publish messages...")
         async with server:
             await server.serve_forever()
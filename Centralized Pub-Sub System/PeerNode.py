@@ -8,12 +8,12 @@ from client_api import ClientAPI
 from PeerServer import PeerServer
 
 class PeerNode:
-    def __init__(self, peer_ip, peer_port, indexing_host="127.0.0.1", indexing_port=9090):
+    def __init__(self, peer_ip, peer_port, indexing_host="127.0.0.1", indexing_port=9090, rate_limits=None):
         self.peer_ip = peer_ip
         self.peer_port = peer_port
         self.indexing_host = indexing_host
         self.indexing_port = indexing_port
-        self.peer_server = PeerServer(peer_ip, peer_port)
+        self.peer_server = PeerServer(peer_ip, peer_port, **(rate_limits or {}))
         self.api = ClientAPI(self.indexing_host, self.indexing_port)
 
     async def register_with_indexing_server(self):
@@ -70,9 +70,15 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="PeerNode Configuration")
     parser.add_argument("--peer-ip", type=str, default="127.0.0.1", help="IP address of the Peer Node")
     parser.add_argument("--peer-port", type=int, default=8081, help="Port of the Peer Node")
+    parser.add_argument("--client-rate", type=float, default=0.0, help="PUBLISHes per second allowed per client address (0 disables)")
+    parser.add_argument("--client-burst", type=float, default=None, help="PUBLISHes a client address may send at once (defaults to the rate)")
+    parser.add_argument("--topic-rate", type=float, default=0.0, help="PUBLISHes per second allowed per topic (0 disables)")
+    parser.add_argument("--topic-burst", type=float, default=None, help="PUBLISHes a topic may receive at once (defaults to the rate)")
     args = parser.parse_args()
 
-    peer_node = PeerNode(args.peer_ip, args.peer_port)
+    rate_limits = {"client_rate": args.client_rate, "client_burst": args.client_burst,
+                   "topic_rate": args.topic_rate, "topic_burst": args.topic_burst}
+    peer_node = PeerNode(args.peer_ip, args.peer_port, rate_limits=rate_limits)
 
     # Register signal handlers for graceful shutdown
     signal.signal(signal.SIGINT, peer_node.handle_shutdown)  # Ctrl+C
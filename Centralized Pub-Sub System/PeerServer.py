@@ -2,58 +2,159 @@ import asyncio
 import json
 import time
 import socket
+from monitor import LoopMonitor, TimedSteps
+from profiling import Profiler
+from ratelimit import RateLimiter, acquire
+from ttl import ExpiryIndex
+
+EXPIRY_INTERVAL = 1.0  # Seconds between background passes that reclaim expired messages
+MAX_REQUEST_SIZE = 64 * 1024 * 1024  # Largest request accepted, in bytes
 
 class PeerServer:
-    def __init__(self, peer_ip, peer_port):  
+    def __init__(self, peer_ip, peer_port, client_rate=0.0, client_burst=None, topic_rate=0.0, topic_burst=None):  
         self.peer_ip = peer_ip  
         self.peer_port = peer_port
         self.topics = {}
+        self.expiry = ExpiryIndex()  # Expiry of messages published with a TTL
+        # Token buckets limiting PUBLISHes per client and per topic (a rate of 0 disables a limit)
+        self.client_limiter = RateLimiter(client_rate, client_burst)
+        self.topic_limiter = RateLimiter(topic_rate, topic_burst)
+        # On-demand profiling of request handlers (PROFILE admin command)
+        self.profiler = Profiler(f"peer-{peer_port}")
+        # Event loop lag, and requests that blocked the loop for too long
+        self.monitor = LoopMonitor()
 
     async def handle_peer(self, reader, writer):
         try:
-            data = await reader.read(100)
-            message = json.loads(data.decode())
+            message = await self.read_request(reader)
             command = message.get('command')
 
-            if command == 'CREATE':
-                topic = message.get('topic')
-                self.topics[topic] = []
-                self.log_event(f"Topic Created: {topic}")
-            elif command == 'PUBLISH':
-                topic = message.get('topic')
-                msg = message.get('message')
-                if topic in self.topics:
-                    self.topics[topic].append(msg)
-                    self.log_event(f"Publisher sent message to topic '{topic}': {msg}")
-                else:
-                    self.log_event(f"Error: Topic '{topic}' not found.")
-            elif command == 'SUBSCRIBE':
-                topic = message.get('topic')
-                self.log_event(f"Subscriber subscribed to topic: {topic}")
-            elif command == 'PULL':
-                topic = message.get('topic')
-                if topic in self.topics:
-                    messages = self.topics.get(topic, [])
-                    response = {'messages': messages}
-                    writer.write(json.dumps(response).encode())
-                    await writer.drain()
-                    self.log_event(f"Subscriber pulled messages from topic '{topic}': {', '.join(messages)}")
-                else:
-                    self.log_event(f"Error: Topic '{topic}' not found.")
-                    writer.write(json.dumps({'error': 'Topic not found'}).encode())
-                    await writer.drain()
-            elif command == 'DELETE':
-                topic = message.get('topic')
-                if topic in self.topics:
-                    del self.topics[topic]
-                    self.log_event(f"Topic Deleted: {topic}")
-                else:
-                    self.log_event(f"Error: Topic '{topic}' not found.")
+            started = time.perf_counter()
+            if self.profiler.active:
+                steps = TimedSteps(self.profiler.run(command, self.process(command, message, writer)))
+            else:
+                steps = TimedSteps(self.process(command, message, writer))
+            await steps
+            topic = message.get('topic')
+            if self.monitor.handled(command, topic, steps.longest, time.perf_counter() - started):
+                self.log_event(f"Slow handler: {command} of topic '{topic}' blocked the event loop for {steps.longest * 1000:.1f}ms")
         except Exception as e:
             self.log_event(f"Error handling peer request: {str(e)}")
         finally:
             writer.close()
 
+    async def process(self, command, message, writer):
+        if command == 'PROFILE':
+            writer.write(json.dumps(self.profiler.handle(message)).encode())
+            await writer.drain()
+        elif command == 'STATS':
+            writer.write(json.dumps(self.get_stats()).encode())
+            await writer.drain()
+        elif command == 'CREATE':
+            topic = message.get('topic')
+            self.topics[topic] = []
+            self.expiry.drop(topic)
+            if message.get('ttl_ms') is not None:
+                self.expiry.set_ttl(topic, message['ttl_ms'] / 1000)
+            self.log_event(f"Topic Created: {topic}")
+        elif command == 'PUBLISH':
+            topic = message.get('topic')
+            msg = message.get('message')
+            retry_after = self.rate_limit(message, writer)
+            if retry_after:
+                writer.write(json.dumps({'status': 'Rate limited', 'retry_after': round(retry_after, 3)}).encode())
+                await writer.drain()
+                self.log_event(f"Rate limited publisher on topic '{topic}' (retry after {retry_after:.3f}s)")
+            elif topic in self.topics:
+                self.topics[topic].append(msg)
+                ttl = message['ttl_ms'] / 1000 if message.get('ttl_ms') is not None else None
+                expires_at = self.expiry.expires_at(topic, ttl, time.time())
+                if expires_at is not None:
+                    self.expiry.track(topic, self.expiry.base(topic) + len(self.topics[topic]) - 1, expires_at)
+                self.log_event(f"Publisher sent message to topic '{topic}': {msg}")
+            else:
+                self.log_event(f"Error: Topic '{topic}' not found.")
+        elif command == 'SUBSCRIBE':
+            topic = message.get('topic')
+            self.log_event(f"Subscriber subscribed to topic: {topic}")
+        elif command == 'PULL':
+            topic = message.get('topic')
+            if topic in self.topics:
+                self.expire_due()
+                messages = self.expiry.visible(topic, self.topics[topic])
+                response = {'messages': messages}
+                writer.write(json.dumps(response).encode())
+                await writer.drain()
+                self.log_event(f"Subscriber pulled messages from topic '{topic}': {', '.join(messages)}")
+            else:
+                self.log_event(f"Error: Topic '{topic}' not found.")
+                writer.write(json.dumps({'error': 'Topic not found'}).encode())
+                await writer.drain()
+        elif command == 'PULL_MANY':
+            topics = message.get('topics', [])
+            self.expire_due()
+            found = {topic: self.expiry.visible(topic, self.topics[topic]) for topic in topics if topic in self.topics}
+            missing = [topic for topic in topics if topic not in self.topics]
+            writer.write(json.dumps({'messages': found, 'missing': missing}).encode())
+            await writer.drain()
+            self.log_event(f"Subscriber pulled messages from {len(found)} topics")
+            if missing:
+                self.log_event(f"Error: {len(missing)} requested topics not found.")
+        elif command == 'DELETE':
+            topic = message.get('topic')
+            if topic in self.topics:
+                del self.topics[topic]
+                self.expiry.drop(topic)
+                self.log_event(f"Topic Deleted: {topic}")
+            else:
+                self.log_event(f"Error: Topic '{topic}' not found.")
+
+    def get_stats(self):
+        return {
+            'topics': len(self.topics),
+            'messages': sum(len(messages) for messages in self.topics.values()),
+            'expired_messages': self.expiry.expired,
+            **self.monitor.report(),
+        }
+
+    def rate_limit(self, message, writer):
+        # Take a token for the client and the topic of a PUBLISH; returns seconds to wait, or 0 if allowed.
+        # Clients are told apart by address, since anything in the message is theirs to change
+        now = time.monotonic()
+        buckets = []
+        if self.client_limiter.enabled:
+            client = writer.get_extra_info('peername')[0]
+            buckets.append(self.client_limiter.bucket(client, now))
+        if self.topic_limiter.enabled:
+            buckets.append(self.topic_limiter.bucket(message.get('topic'), now))
+        return acquire(buckets, now)
+
+    def expire_due(self):
+        # Drop expired messages; tombstoned ones behind live messages are hidden by ExpiryIndex.visible
+        for topic, count in self.expiry.reap(time.time(), stored=self.topics).items():
+            if topic in self.topics:
+                del self.topics[topic][:count]
+                self.log_event(f"Expired {count} messages from topic '{topic}'")
+
+    async def expiry_loop(self):
+        # Reclaim expired messages in the background, including from topics nobody pulls
+        while True:
+            await asyncio.sleep(EXPIRY_INTERVAL)
+            self.expire_due()
+
+    async def read_request(self, reader):
+        # Clients half-close after sending, so a request is everything up to EOF, parsed once
+        chunks, size = [], 0
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_REQUEST_SIZE:
+                raise ValueError(f"Request exceeds the {MAX_REQUEST_SIZE} byte limit")
+            chunks.append(chunk)
+        return json.loads(b''.join(chunks))
+
     def resolve_local_ip(self):
         
         try:
@@ -78,6 +179,8 @@ class PeerServer:
             print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - PeerServer started on {resolved_ip}, {self.peer_port}")
             print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Waiting for publishing/subscribing...")
 
+            self.expiry_task = asyncio.create_task(self.expiry_loop())
+            self.monitor_task = asyncio.create_task(self.monitor.run())
             async with server:
                 await server.serve_forever()
         except OSError as e:
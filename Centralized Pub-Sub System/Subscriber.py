@@ -19,6 +19,35 @@ class Subscriber:
             print(f"Error querying indexing server: {str(e)}")
             return []
 
+    async def query_indexing_server_many(self, topics):
+        # One query for all topics; returns {topic: [(peer_ip, peer_port), ...]} for the topics found
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Querying about Topics: {', '.join(topics)} from Indexing Server")
+        try:
+            response = await self.indexing_api.send_and_receive({'action': 'query_many', 'topics': topics})
+            return response.get('peers', {})
+        except Exception as e:
+            print(f"Error querying indexing server: {str(e)}")
+            return {}
+
+    async def subscribe_and_pull_many(self, topics, peer_ip, peer_port):
+        # Subscribe to all topics hosted by one peer, then pull them with a single request
+        try:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Topics: {', '.join(topics)} found at {peer_ip}, {peer_port}")
+            peer_api = ClientAPI(peer_ip, peer_port)
+            await asyncio.gather(*[peer_api.subscribe(topic) for topic in topics])
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Subscriber subscribed to topics: {', '.join(topics)}\n")
+
+            print(f"Subscriber pulling messages from topics: {', '.join(topics)}")
+            pulled = await peer_api.pull_many(topics)
+            for topic in topics:
+                messages = pulled.get(topic, [])
+                if messages:
+                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Pulled Messages from Topic: {topic}: {', '.join(messages)}")
+                else:
+                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - No messages found in Topic: {topic}")
+        except Exception as e:
+            print(f"Error subscribing and pulling messages: {str(e)}")
+
     async def subscribe_and_pull_messages(self, topic, peer_ip, peer_port):
         try:
             print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Topic: {topic} found at {peer_ip}, {peer_port}")
@@ -41,15 +70,23 @@ class Subscriber:
 
     async def start(self):
         topics = ['Sports', 'TV']  
-        
+
+        # Group the topics by hosting peer so that each peer is pulled once, all peers in parallel
+        peers_by_topic = await self.query_indexing_server_many(topics)
+        topics_by_peer = {}
         for topic in topics:
-            peers = await self.query_indexing_server(topic)
+            peers = peers_by_topic.get(topic)
             if peers:
                 for peer_ip, peer_port in peers:
-                    await self.subscribe_and_pull_messages(topic, peer_ip, peer_port)
+                    topics_by_peer.setdefault((peer_ip, peer_port), []).append(topic)
             else:
                 print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Topic {topic} not found on any peer node.")
 
+        await asyncio.gather(*[
+            self.subscribe_and_pull_many(peer_topics, peer_ip, peer_port)
+            for (peer_ip, peer_port), peer_topics in topics_by_peer.items()
+        ])
+
 if __name__ == "__main__":
     subscriber = Subscriber()
     asyncio.run(subscriber.start())
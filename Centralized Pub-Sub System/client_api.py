@@ -2,16 +2,28 @@ import asyncio
 import json
 
 class ClientAPI:
-    def __init__(self, host='localhost', port=8081):
+    def __init__(self, host='localhost', port=8081, max_retries=5):
         self.host = host
         self.port = port
+        self.max_retries = max_retries
 
     async def send_and_receive(self, message):
+        # Wait out rate limits for as long as the server asks, up to max_retries times
+        for attempt in range(self.max_retries + 1):
+            response = await self.send_once(message)
+            if response.get('status') != 'Rate limited' or attempt == self.max_retries:
+                return response
+            await asyncio.sleep(response['retry_after'])
+
+    async def send_once(self, message):
         reader, writer = await asyncio.open_connection(self.host, self.port)
         writer.write(json.dumps(message).encode('utf-8'))
+        # Half-close: servers read a request up to EOF
+        writer.write_eof()
         await writer.drain()
 
-        data = await reader.read(1024)
+        # Servers close the connection after replying, so read the whole reply
+        data = await reader.read()
         if data:
             response = json.loads(data.decode('utf-8'))
         else:
@@ -20,12 +32,18 @@ class ClientAPI:
         await writer.wait_closed()
         return response
 
-    async def create_topic(self, topic):
+    async def create_topic(self, topic, ttl_ms=None):
+        # With ttl_ms, messages of the topic expire that long after they are published
         message = {'command': 'CREATE', 'topic': topic}
+        if ttl_ms is not None:
+            message['ttl_ms'] = ttl_ms
         return await self.send_and_receive(message)
 
-    async def send_message(self, topic, message):
+    async def send_message(self, topic, message, ttl_ms=None):
+        # ttl_ms overrides the topic's TTL for this message
         msg = {'command': 'PUBLISH', 'topic': topic, 'message': message}
+        if ttl_ms is not None:
+            msg['ttl_ms'] = ttl_ms
         return await self.send_and_receive(msg)
 
     async def delete_topic(self, topic):
@@ -39,4 +57,20 @@ class ClientAPI:
     async def pull_messages(self, topic):
         message = {'command': 'PULL', 'topic': topic}
         response = await self.send_and_receive(message)
-        return response.get('messages', [])
\ No newline at end of file
+        return response.get('messages', [])
+
+    async def get_stats(self):
+        # Counters and event loop health of a peer server or the indexing server
+        return await self.send_and_receive({'command': 'STATS', 'action': 'stats'})
+
+    async def profile(self, op, **options):
+        # Control the profiler of a peer server or the indexing server: op is start, stop, dump,
+        # status, memory_start, memory_diff or memory_stop
+        message = {'command': 'PROFILE', 'action': 'profile', 'op': op, **options}
+        return await self.send_and_receive(message)
+
+    async def pull_many(self, topics):
+        # Pull several topics hosted by this peer in one request; returns {topic: messages}
+        message = {'command': 'PULL_MANY', 'topics': topics}
+        response = await self.send_and_receive(message)
+        return response.get('messages', {})
\ No newline at end of file
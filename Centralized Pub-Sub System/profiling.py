@@ -0,0 +1,245 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from monitor import TimedSteps
+
+PROFILE_COMMAND = "PROFILE"  # Admin requests controlling the profiler; never profiled themselves
+MODES = ("cprofile", "sampling")
+SAMPLE_INTERVAL = 0.005      # Seconds between stack samples in sampling mode
+MAX_STACK_DEPTH = 64         # Frames kept per sample, innermost first
+TOP_FUNCTIONS = 30           # Functions listed per command in a cProfile report
+PROFILE_DIR = "profiles"     # Subdirectory of the profiler's directory that reports are written to
+
+class Profiler:
+    """On-demand profiling of a running server, aggregated per command handler.
+
+    Servers only check `active` before running a handler, so profiling costs
+    nothing while it is off. Once started, a handler runs through `run` (asyncio)
+    or `command` (threads), which charge its work to its command:
+
+    - cprofile: each command has its own cProfile.Profile. For a coroutine it is
+      enabled only while that coroutine's steps run, so concurrent requests of
+      other commands are not counted against it. With threads only one handler
+      is traced at a time; the others are timed only.
+    - sampling: a background thread samples the stack of every thread that is
+      running a handler and counts the stacks per command. Lower overhead,
+      suited to hot production nodes.
+
+    Every handler is also timed: calls, wall time, and busy time (the part
+    spent running rather than awaiting, i.e. holding the event loop).
+    Memory is profiled separately, with tracemalloc snapshot diffs.
+    """
+
+    def __init__(self, name, directory="."):
+        self.name = name
+        self.directory = directory
+        self.active = False
+        self.mode = None
+        self.started_at = None
+        self.stopped_at = None
+        self.lock = threading.Lock()
+        self.tracing = threading.Lock()  # Held by the one thread being traced in cprofile mode
+        self.reset()
+        self.baseline = None
+        self.memory = []  # Lines of the last tracemalloc diff
+        self.dumps = 0
+
+    def reset(self):
+        self.handlers = {}  # command -> {"calls", "wall", "busy", "max"}
+        self.profiles = {}  # command -> cProfile.Profile
+        self.samples = {}   # command -> Counter of stacks, outermost frame first
+        self.labels = {}    # thread ident -> command it is running, in sampling mode
+        self.sampler = None
+        self.stopping = threading.Event()
+
+    def start(self, mode="cprofile", interval=SAMPLE_INTERVAL):
+        if mode not in MODES:
+            return {"status": f"Unknown profiling mode '{mode}'"}
+        if self.active:
+            return {"status": f"Already profiling ({self.mode})"}
+        self.reset()
+        self.mode = mode
+        self.started_at, self.stopped_at = time.time(), None
+        if mode == "sampling":
+            self.sampler = threading.Thread(target=self.sample, args=(interval,), daemon=True)
+            self.sampler.start()
+        self.active = True
+        return {"status": "Profiling", "mode": mode}
+
+    def stop(self):
+        if not self.active:
+            return {"status": "Not profiling"}
+        self.active = False
+        self.stopped_at = time.time()
+        if self.sampler:
+            self.stopping.set()
+            self.sampler.join()
+        return {"status": "Stopped", "mode": self.mode, "handlers": self.handler_table()}
+
+    def enter(self, command):
+        """Start charging the current thread's work to `command`; returns what `exit` needs to stop."""
+        if self.mode == "cprofile":
+            with self.lock:
+                profile = self.profiles.get(command)
+                if profile is None:
+                    profile = self.profiles[command] = cProfile.Profile()
+            profile.enable()
+            return profile
+        self.labels[threading.get_ident()] = command
+        return None
+
+    def exit(self, profile):
+        # The profile is passed back rather than looked up, as a restart may have replaced it
+        if profile is not None:
+            profile.disable()
+        else:
+            self.labels.pop(threading.get_ident(), None)
+
+    async def run(self, command, coro):
+        """Await a handler coroutine, profiling each of its steps under `command`."""
+        if str(command).upper() == PROFILE_COMMAND:
+            return await coro
+        started = time.perf_counter()
+        steps = TimedSteps(coro, lambda: self.enter(command), self.exit)
+        try:
+            return await steps
+        finally:
+            self.record(command, time.perf_counter() - started, steps.busy)
+
+    @contextmanager
+    def command(self, command):
+        """Profile a handler running synchronously in the current thread."""
+        if str(command).upper() == PROFILE_COMMAND:
+            yield
+            return
+        # cProfile cannot trace one profile from two threads at once
+        exclusive = self.mode == "cprofile"
+        traced = not exclusive or self.tracing.acquire(blocking=False)
+        token = self.enter(command) if traced else None
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if traced:
+                self.exit(token)
+                if exclusive:
+                    self.tracing.release()
+            self.record(command, elapsed, elapsed)
+
+    def record(self, command, wall, busy):
+        with self.lock:
+            handler = self.handlers.setdefault(command, {"calls": 0, "wall": 0.0, "busy": 0.0, "max": 0.0})
+            handler["calls"] += 1
+            handler["wall"] += wall
+            handler["busy"] += busy
+            handler["max"] = max(handler["max"], wall)
+
+    def sample(self, interval):
+        while not self.stopping.wait(interval):
+            frames = sys._current_frames()
+            for ident, command in list(self.labels.items()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.samples.setdefault(command, Counter())[tuple(reversed(stack))] += 1
+
+    def memory_start(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.baseline = tracemalloc.take_snapshot()
+        return {"status": "Tracing memory"}
+
+    def memory_diff(self, limit=20):
+        """Top allocation sites grown since the baseline; the current snapshot becomes the new baseline."""
+        if self.baseline is None or not tracemalloc.is_tracing():
+            return {"status": "Not tracing memory"}
+        snapshot = tracemalloc.take_snapshot()
+        stats = snapshot.compare_to(self.baseline, "lineno")
+        self.baseline = snapshot
+        self.memory = [str(stat) for stat in stats[:limit]]
+        current, peak = tracemalloc.get_traced_memory()
+        return {"status": "Memory diff", "traced_bytes": current, "peak_bytes": peak, "top": self.memory}
+
+    def memory_stop(self):
+        tracemalloc.stop()
+        self.baseline = None
+        return {"status": "Stopped tracing memory"}
+
+    def handler_table(self):
+        with self.lock:
+            return {command: {"calls": h["calls"], "wall": round(h["wall"], 6), "busy": round(h["busy"], 6),
+                              "max": round(h["max"], 6)}
+                    for command, h in sorted(self.handlers.items(), key=lambda item: -item[1]["busy"])}
+
+    def report(self):
+        """Text report: the handler table, then per command the hottest functions or stacks, then memory."""
+        end = self.stopped_at or time.time()
+        out = io.StringIO()
+        out.write(f"# Profile of {self.name}: {self.mode}, {end - (self.started_at or end):.3f}s\n\n")
+        out.write(f"{'command':<20}{'calls':>10}{'wall s':>12}{'busy s':>12}{'max s':>12}\n")
+        for command, h in self.handler_table().items():
+            out.write(f"{command:<20}{h['calls']:>10}{h['wall']:>12.6f}{h['busy']:>12.6f}{h['max']:>12.6f}\n")
+        for command, profile in sorted(self.profiles.items()):
+            out.write(f"\n## {command}\n")
+            try:
+                pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            except TypeError:
+                out.write("No calls traced\n")  # pstats refuses a profile that has recorded nothing
+        for command, stacks in sorted(self.samples.items()):
+            # Collapsed stacks, the input format of flame graph tools
+            out.write(f"\n## {command}: {sum(stacks.values())} samples\n")
+            for stack, count in stacks.most_common():
+                out.write(f"{command};{';'.join(stack)} {count}\n")
+        if self.memory:
+            out.write("\n## Memory growth\n")
+            out.write("\n".join(self.memory) + "\n")
+        return out.getvalue()
+
+    def dump(self):
+        # The file name is always our own, in a directory of reports only, and an existing file is never replaced
+        directory = os.path.join(self.directory, PROFILE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        self.dumps += 1
+        name = f"profile-{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.dumps}.prof.txt"
+        path = os.path.join(directory, name)
+        try:
+            with open(path, "x") as f:
+                f.write(self.report())
+        except FileExistsError:
+            return {"status": "Profile report already exists", "path": os.path.abspath(path)}
+        return {"status": "Dumped", "path": os.path.abspath(path)}
+
+    def status(self):
+        return {"status": "Profiling" if self.active else "Idle", "mode": self.mode,
+                "memory": tracemalloc.is_tracing(), "handlers": self.handler_table()}
+
+    def handle(self, request):
+        """Carry out a PROFILE admin request: {"op": start|stop|dump|status|memory_start|memory_diff|memory_stop}."""
+        op = request.get("op", "status")
+        if op == "start":
+            return self.start(request.get("mode", "cprofile"), request.get("interval_ms", SAMPLE_INTERVAL * 1000) / 1000)
+        elif op == "stop":
+            return self.stop()
+        elif op == "dump":
+            return self.dump()
+        elif op == "status":
+            return self.status()
+        elif op == "memory_start":
+            return self.memory_start(request.get("frames", 1))
+        elif op == "memory_diff":
+            return self.memory_diff(request.get("limit", 20))
+        elif op == "memory_stop":
+            return self.memory_stop()
+        return {"status": f"Unknown profiling op '{op}'"}
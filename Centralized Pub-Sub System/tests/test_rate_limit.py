@@ -0,0 +1,38 @@
+import sys
+import os
+import asyncio
+import uuid
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from client_api import ClientAPI
+from PeerServer import PeerServer
+
+PEER_PORT = 8095
+BURST = 5
+
+async def publish_with_new_ids(client, topic, count):
+    # Every PUBLISH claims to come from a different client
+    statuses = []
+    for i in range(count):
+        response = await client.send_once({'command': 'PUBLISH', 'topic': topic, 'message': f"message {i}",
+                                           'client_id': uuid.uuid4().hex})
+        statuses.append(response.get('status'))
+    return statuses
+
+async def run_test():
+    peer_server = PeerServer('127.0.0.1', PEER_PORT, client_rate=1.0, client_burst=BURST)
+    server_task = asyncio.create_task(peer_server.start())
+    await asyncio.sleep(0.5)
+    try:
+        client = ClientAPI('127.0.0.1', PEER_PORT, max_retries=0)
+        await client.create_topic("flood")
+        statuses = await publish_with_new_ids(client, "flood", 4 * BURST)
+        limited = statuses.count('Rate limited')
+        print(f"{limited} of {len(statuses)} PUBLISHes with changing client IDs were rate limited")
+        assert limited >= 2 * BURST, "Changing the client ID must not reset the client's rate limit"
+    finally:
+        server_task.cancel()
+
+if __name__ == "__main__":
+    asyncio.run(run_test())
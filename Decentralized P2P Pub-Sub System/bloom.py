@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import time
+
+FILTER_BITS = 8192     # Counters per node filter; gossiped as one bit each (1 KB)
+FILTER_HASHES = 4      # Hash functions per key
+FILTER_INTERVAL = 5.0  # Seconds between full filter gossips to every live node
+MAX_COUNT = 255        # A counter that reaches this stays there, as its true count is lost
+
+def positions(key, size, hashes):
+    """Bit positions of a key, by double hashing one digest. Stable across processes, unlike hash()."""
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:], "big") | 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+class CountingBloomFilter:
+    """Bloom filter of the topics held by this node, with a counter per position so that keys can be removed.
+
+    Only the bit view (counter > 0) is sent to other nodes. `version` counts
+    additions, so a node that receives them one by one can tell when it missed one.
+    """
+
+    def __init__(self, size=FILTER_BITS, hashes=FILTER_HASHES):
+        self.size = size
+        self.hashes = hashes
+        self.counts = bytearray(size)
+        self.keys = 0
+        self.version = 0
+
+    def add(self, key):
+        for i in positions(key, self.size, self.hashes):
+            if self.counts[i] < MAX_COUNT:
+                self.counts[i] += 1
+        self.keys += 1
+        self.version += 1
+
+    def remove(self, key):
+        for i in positions(key, self.size, self.hashes):
+            if 0 < self.counts[i] < MAX_COUNT:
+                self.counts[i] -= 1
+        self.keys -= 1
+
+    def __contains__(self, key):
+        return all(self.counts[i] for i in positions(key, self.size, self.hashes))
+
+    def bits(self):
+        """The filter as a plain Bloom filter, base64-encoded for gossip."""
+        packed = bytearray((self.size + 7) // 8)
+        for i, count in enumerate(self.counts):
+            if count:
+                packed[i >> 3] |= 1 << (i & 7)
+        return base64.b64encode(bytes(packed)).decode("ascii")
+
+    def report(self):
+        filled = sum(1 for count in self.counts if count) / self.size
+        return {"bits": self.size, "hashes": self.hashes, "keys": self.keys, "version": self.version,
+                "fill_ratio": round(filled, 4), "false_positive_rate": round(filled ** self.hashes, 6)}
+
+class BloomFilter:
+    """Bit view of another node's filter, kept up to date with the additions it announces."""
+
+    def __init__(self, bits, size, hashes):
+        self.packed = bytearray(base64.b64decode(bits))
+        self.size = size
+        self.hashes = hashes
+
+    def add(self, key):
+        for i in positions(key, self.size, self.hashes):
+            self.packed[i >> 3] |= 1 << (i & 7)
+
+    def __contains__(self, key):
+        return all(self.packed[i >> 3] & (1 << (i & 7)) for i in positions(key, self.size, self.hashes))
+
+class PeerFilters:
+    """The latest topic filter gossiped by each other node, and when it can be trusted.
+
+    A filter only proves a topic absent if it is complete (its node was not
+    still receiving topics in a handoff), recent, in step with every addition
+    its node announced, and built under the same membership as ours, since
+    otherwise the node may own keys it has not accounted for.
+    """
+
+    def __init__(self, max_age=3 * FILTER_INTERVAL):
+        self.max_age = max_age
+        self.filters = {}  # node -> {"filter", "version", "incarnation", "members", "complete", "received"}
+
+    def update(self, message):
+        """Store a full filter, unless we already applied newer additions from the same process."""
+        node = message["node"]
+        current = self.filters.get(node)
+        if current is not None and current["incarnation"] == message["incarnation"] and current["version"] > message["version"]:
+            return
+        self.filters[node] = {"filter": BloomFilter(message["bits"], message["size"], message["hashes"]),
+                              "version": message["version"], "incarnation": message["incarnation"],
+                              "members": message["members"], "complete": message["complete"],
+                              "received": time.monotonic()}
+
+    def add(self, message):
+        """Apply announced additions, or stop trusting the filter until a full one at least this new arrives."""
+        node = message["node"]
+        current = self.filters.get(node)
+        if current is None:
+            return
+        if (current["incarnation"] != message["incarnation"] or current["members"] != message["members"]
+                or current["version"] + len(message["keys"]) != message["version"]):
+            # Older full filters still on their way must not be trusted either
+            current.update(complete=False, version=message["version"], incarnation=message["incarnation"])
+            return
+        for key in message["keys"]:
+            current["filter"].add(key)
+        current["version"] = message["version"]
+
+    def absent(self, node, key, members):
+        """Whether `node` certainly does not hold `key`, given our current membership."""
+        current = self.filters.get(node)
+        if current is None or not current["complete"] or current["members"] != members:
+            return False
+        if time.monotonic() - current["received"] > self.max_age:
+            return False
+        return key not in current["filter"]
+
+    def report(self):
+        now = time.monotonic()
+        return {node: {"version": f["version"], "complete": f["complete"], "age": round(now - f["received"], 3)}
+                for node, f in sorted(self.filters.items())}
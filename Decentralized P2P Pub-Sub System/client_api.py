@@ -1,49 +1,152 @@
 import asyncio
-import json
+import itertools
 import logging
+import random
+import uuid
 from hypercube import route_to_target
-from dht_hash import hash_topic
+from wire import FrameCodec, request
+from dht_hash import PARTITION_SEPARATOR, hash_key_to_partition, hash_partition, hash_topic, valid_topic
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class ClientAPI:
-    def __init__(self, node_id, default_port=8000):
+    def __init__(self, node_id, default_port=8000, max_retries=5, base_backoff=0.05, max_backoff=2.0,
+                 compression_threshold=1024, heartbeat_interval=3.0):
         self.node_id = node_id
         self.host = '127.0.0.1'
         self.default_port = default_port
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.codec = FrameCodec(threshold=compression_threshold, enabled=compression_threshold >= 0)
+        self.partitions = {}   # Cached partition count per topic
+        self.round_robin = {}  # Next partition for unkeyed publishes per topic
+
+        # Every PUBLISH carries (producer_id, seq) so that the owner can drop retries it has already stored
+        self.producer_id = uuid.uuid4().hex
+        self.sequence = itertools.count(1)
+
+        # Consumer group membership: this client is one member of every group it joins
+        self.member_id = uuid.uuid4().hex
+        self.heartbeat_interval = heartbeat_interval
+        self.groups = {}  # (topic, group) -> {"generation", "assignment", "heartbeat_at"}
 
     async def send_and_receive(self, target_node, message):
+        """Send a request, backing off with jitter while the node reports it is busy or rate limited.
+
+        Requests with a producer sequence number are also retried after connection
+        errors, since the owner recognises a message it has already stored.
+        """
+        for attempt in range(self.max_retries + 1):
+            response = await self.send_once(target_node, message)
+            retry = response.get("status") in ("Busy", "Rate limited") or (not response and "seq" in message)
+            if not retry or attempt == self.max_retries:
+                return response
+
+            # Full jitter, but never retry sooner than the node asked us to
+            backoff = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+            delay = max(response.get("retry_after", 0), random.uniform(0, backoff))
+            reason = response.get("status", "unreachable").lower()
+            logging.warning(f"[ClientAPI] Peer {target_node} {reason}, retrying in {delay:.3f}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+        return response
+
+    async def send_once(self, target_node, message, key=None):
         routing_path = route_to_target(self.node_id, target_node)
         target_port = self.default_port + int(target_node, 2)
+        # Requests for a topic are sent to the owner of its key; nodes on the way relay them by key
+        key = key or target_node
 
         try:
-            reader, writer = await asyncio.open_connection(self.host, target_port)
-            writer.write(json.dumps(message).encode('utf-8'))
-            await writer.drain()
-
-            data = await reader.read(1024)
-            response = json.loads(data.decode('utf-8')) if data else {}
-            writer.close()
-            await writer.wait_closed()
-            return response
+            return await request(self.host, target_port, message, self.codec, key)
+        except ConnectionRefusedError:
+            if target_node == self.node_id:
+                logging.error(f"[ClientAPI] Entry peer {target_node} is not running")
+                return {}
+            # The owner is missing from the hypercube; our entry node routes to whoever holds its keys now
+            logging.warning(f"[ClientAPI] Peer {target_node} is not running, routing through entry peer {self.node_id}")
+            return await self.send_once(self.node_id, message, key)
         except Exception as e:
             logging.error(f"[ClientAPI] Error connecting to peer {target_node}: {e}")
             return {}
 
-    async def create_topic(self, topic):
-        target_node = hash_topic(topic)
-        message = {'command': 'CREATE', 'topic': topic}
-        return await self.send_and_receive(target_node, message)
+    async def create_topic(self, topic, partitions=1, ttl_ms=None):
+        """Create a topic, optionally split into partitions that live on different nodes.
 
-    async def send_message(self, topic, message):
-        target_node = hash_topic(topic)
-        msg = {'command': 'PUBLISH', 'topic': topic, 'message': message}
-        return await self.send_and_receive(target_node, msg)
+        With `ttl_ms`, messages of the topic expire that long after they are published.
+        """
+        if not 1 <= partitions <= 8:
+            raise ValueError("partitions must be between 1 and 8")
+        if not valid_topic(topic):
+            raise ValueError(f"topic names may not contain '{PARTITION_SEPARATOR}'")
+        ttl = {} if ttl_ms is None else {'ttl_ms': ttl_ms}
+        if partitions == 1:
+            target_node = hash_topic(topic)
+            message = {'command': 'CREATE', 'topic': topic, **ttl}
+            response = await self.send_and_receive(target_node, message)
+            self.learn_partitions(topic, response)
+            return response
+
+        responses = await asyncio.gather(*[
+            self.send_and_receive(hash_partition(topic, p), {'command': 'CREATE', 'topic': topic, 'partition': p, 'partitions': partitions, **ttl})
+            for p in range(partitions)
+        ])
+        self.partitions[topic] = partitions
+        return responses[0]
+
+    async def send_message(self, topic, message, key=None, ack="leader", replicas=1, delay_ms=None, deliver_at=None,
+                           ttl_ms=None):
+        """Publish to a topic. Partitioned topics are routed by message key, or round robin without one.
+
+        `ack` chooses when the reply comes back: "none" as soon as a node has received
+        the message, "leader" once the owner has appended it, "replicated" once
+        `replicas` further nodes also hold a copy.
+
+        With `delay_ms` or `deliver_at` (a Unix timestamp) the owner holds the
+        message and publishes it only once it is due. `ttl_ms` overrides the
+        topic's TTL for this message, counted from when it is published.
+        """
+        partitions = self.partitions.get(topic)
+        if partitions is None and key is not None:
+            partitions = await self.partition_count(topic)
+
+        if key is not None and partitions > 1:
+            partition = hash_key_to_partition(key, partitions)
+        elif partitions is not None and partitions > 1:
+            partition = self.round_robin.get(topic, 0) % partitions
+            self.round_robin[topic] = partition + 1
+        else:
+            # Unknown or unpartitioned: partition 0 is the plain topic and its reply tells us the count
+            partition = 0
+        msg = {'command': 'PUBLISH', 'topic': topic, 'message': message,
+               'producer_id': self.producer_id, 'seq': next(self.sequence), 'ack': ack}
+        if ack == "replicated":
+            msg['replicas'] = replicas
+        if delay_ms is not None:
+            msg['delay_ms'] = delay_ms
+        if deliver_at is not None:
+            msg['deliver_at'] = deliver_at
+        if ttl_ms is not None:
+            msg['ttl_ms'] = ttl_ms
+        if partition:
+            msg['partition'] = partition
+        response = await self.send_and_receive(hash_partition(topic, partition), msg)
+        if partition == 0:
+            self.learn_partitions(topic, response)
+        return response
 
     async def delete_topic(self, topic):
+        """Delete a topic. The owner of partition 0 reports how many more partitions to delete."""
         target_node = hash_topic(topic)
         message = {'command': 'DELETE', 'topic': topic}
-        return await self.send_and_receive(target_node, message)
+        response = await self.send_and_receive(target_node, message)
+        partitions = response.get("partitions", self.partitions.get(topic, 1))
+        self.partitions.pop(topic, None)
+        await asyncio.gather(*[
+            self.send_and_receive(hash_partition(topic, p), {'command': 'DELETE', 'topic': topic, 'partition': p})
+            for p in range(1, partitions)
+        ])
+        return response
 
     async def subscribe(self, topic):
         target_node = hash_topic(topic)
@@ -53,14 +156,207 @@ class ClientAPI:
         if response.get("status") == "Topic not found":
             logging.warning(f"[ClientAPI] Topic '{topic}' not found for subscription.")
             return {"status": "Topic not found"}
+        self.learn_partitions(topic, response)
         return response
 
     async def pull_messages(self, topic):
-        target_node = hash_topic(topic)
-        message = {'command': 'PULL', 'topic': topic}
-        response = await self.send_and_receive(target_node, message)
+        """Pull a topic's messages, reading all partitions of a partitioned topic in parallel."""
+        partitions = self.partitions.get(topic)
+        if partitions is None:
+            first = await self.send_and_receive(hash_topic(topic), {'command': 'PULL', 'topic': topic})
+            partitions = self.learn_partitions(topic, first)
+            rest = range(1, partitions)
+        else:
+            first = None
+            rest = range(partitions)
+
+        responses = await asyncio.gather(*[
+            self.send_and_receive(hash_partition(topic, p), {'command': 'PULL', 'topic': topic, 'partition': p})
+            for p in rest
+        ])
+        if first is not None:
+            responses.insert(0, first)
         # Return an empty list if the topic is not found
-        if response.get("status") == "Topic not found":
+        if responses[0].get("status") == "Topic not found":
             logging.warning(f"[ClientAPI] Topic '{topic}' not found for pulling messages.")
             return []
-        return response.get('messages', [])
+        return [msg for response in responses for msg in response.get('messages', [])]
+
+    async def poll(self, topic, offset=0, wait_ms=30000, min_messages=1, partition=0):
+        """Long-poll one partition of a topic for messages from `offset` on.
+
+        The owner holds the request until at least `min_messages` are available
+        or `wait_ms` has passed, so an idle topic costs one round trip per wait
+        rather than one per poll. Returns (messages, offset to poll from next);
+        the offset is None if the topic does not exist.
+        """
+        message = {'command': 'PULL', 'topic': topic, 'offset': offset, 'wait_ms': wait_ms, 'min_messages': min_messages}
+        if partition:
+            message['partition'] = partition
+        response = await self.send_and_receive(hash_partition(topic, partition), message)
+        if partition == 0:
+            self.learn_partitions(topic, response)
+        if response.get('status') in ('Busy', 'Rate limited') or not response:
+            return [], offset
+        return response.get('messages', []), response.get('next_offset')
+
+    async def pull_many(self, topics):
+        """Pull many topics at once and return {topic: messages}.
+
+        Topics (and partitions) are grouped by owner node and each owner gets a
+        single PULL_MANY, all sent in parallel, so the cost is about one round
+        trip however many topics are read. Partitioned topics seen for the first
+        time need a second round for their other partitions.
+        """
+        wanted = {}
+        for topic in topics:
+            wanted[topic] = range(self.partitions.get(topic, 1))
+        messages = {topic: {} for topic in wanted}
+        unknown = {topic for topic in wanted if topic not in self.partitions}
+
+        for _ in range(2):
+            by_owner = {}
+            for topic, partitions in wanted.items():
+                for p in partitions:
+                    by_owner.setdefault(hash_partition(topic, p), []).append({'topic': topic, 'partition': p})
+            if not by_owner:
+                break
+            responses = await asyncio.gather(*[
+                self.send_and_receive(owner, {'command': 'PULL_MANY', 'topics': items})
+                for owner, items in by_owner.items()
+            ])
+
+            wanted = {}
+            for response in responses:
+                for result in response.get('results', []):
+                    topic, p = result['topic'], result['partition']
+                    messages[topic][p] = result.get('messages', [])
+                    if p == 0 and topic in unknown:
+                        # The reply for partition 0 tells us about the other partitions
+                        partitions = self.learn_partitions(topic, result)
+                        if partitions > 1:
+                            wanted[topic] = range(1, partitions)
+
+        return {topic: [msg for p in sorted(parts) for msg in parts[p]] for topic, parts in messages.items()}
+
+    async def join_group(self, topic, group):
+        """Join a consumer group of a topic and return the partitions assigned to this member.
+
+        Members of a group share the topic's messages: partitions are spread
+        across the members, and members that share a partition split its
+        messages between them. The assignment changes whenever a member joins,
+        leaves or stops sending heartbeats.
+        """
+        message = {'command': 'JOIN_GROUP', 'topic': topic, 'group': group, 'member': self.member_id}
+        response = await self.send_and_receive(hash_topic(topic), message)
+        return self.learn_assignment(topic, group, response)
+
+    async def heartbeat(self, topic, group):
+        """Keep this member in a group and pick up a new assignment after a rebalance."""
+        message = {'command': 'HEARTBEAT', 'topic': topic, 'group': group, 'member': self.member_id}
+        response = await self.send_and_receive(hash_topic(topic), message)
+        if response.get("status") == "Unknown member":
+            # Our lease ran out; join again as a new member of the current generation
+            return await self.join_group(topic, group)
+        return self.learn_assignment(topic, group, response)
+
+    def learn_assignment(self, topic, group, response):
+        if response.get("status") != "Joined":
+            logging.warning(f"[ClientAPI] Could not join group '{group}' of topic '{topic}': {response.get('status')}")
+            self.groups.pop((topic, group), None)
+            return []
+        self.learn_partitions(topic, response)
+        state = self.groups.get((topic, group))
+        if state is not None and state["generation"] != response["generation"]:
+            logging.info(f"[ClientAPI] Group '{group}' rebalanced, now consuming partitions {response['assignment']}")
+        self.groups[(topic, group)] = {"generation": response["generation"], "assignment": response["assignment"],
+                                       "heartbeat_at": asyncio.get_running_loop().time()}
+        return response["assignment"]
+
+    async def fetch(self, topic, group, max_messages=100):
+        """Claim the next messages of a topic for this group member.
+
+        Returns a list of batches {"partition", "offset", "end", "messages"}, one
+        per assigned partition that had messages. A batch covers the offsets
+        [offset, end), less any messages that expired. Each batch must be
+        committed once processed, or it is handed to another member after the
+        claim timeout.
+        """
+        state = self.groups.get((topic, group))
+        if state is None:
+            await self.join_group(topic, group)
+        elif asyncio.get_running_loop().time() - state["heartbeat_at"] >= self.heartbeat_interval:
+            await self.heartbeat(topic, group)
+        state = self.groups.get((topic, group))
+        if state is None:
+            return []
+
+        partitions = state["assignment"]
+        responses = await asyncio.gather(*[
+            self.send_and_receive(hash_partition(topic, p), {'command': 'FETCH', 'topic': topic, 'partition': p, 'group': group,
+                                                             'member': self.member_id, 'max_messages': max_messages})
+            for p in partitions
+        ])
+        return [{"partition": p, "offset": response["offset"], "end": response["end"], "messages": response["messages"]}
+                for p, response in zip(partitions, responses) if response.get("messages")]
+
+    async def commit(self, topic, group, batch):
+        """Mark a fetched batch as processed. Returns the group's committed offset in that partition."""
+        message = {'command': 'COMMIT', 'topic': topic, 'partition': batch["partition"], 'group': group,
+                   'offset': batch["offset"], 'end': batch["end"]}
+        response = await self.send_and_receive(hash_partition(topic, batch["partition"]), message)
+        return response.get("committed")
+
+    async def leave_group(self, topic, group):
+        """Leave a group; uncommitted claims go back to the remaining members immediately."""
+        state = self.groups.pop((topic, group), None)
+        partitions = set(state["assignment"] if state else []) | {0}
+        await asyncio.gather(*[
+            self.send_and_receive(hash_partition(topic, p), {'command': 'LEAVE_GROUP', 'topic': topic, 'partition': p,
+                                                             'group': group, 'member': self.member_id})
+            for p in sorted(partitions)
+        ])
+
+    def learn_partitions(self, topic, response):
+        """Cache the partition count reported alongside a reply from the owner of partition 0."""
+        if response.get("status") in ("Topic not found", "Topic moved", "Busy", "Rate limited", "Accepted") or not response:
+            return 1
+        self.partitions[topic] = response.get("partitions", 1)
+        return self.partitions[topic]
+
+    async def partition_count(self, topic):
+        """Number of partitions of a topic, asking the owner of partition 0 on first use."""
+        if topic not in self.partitions:
+            response = await self.send_and_receive(hash_topic(topic), {'command': 'DESCRIBE', 'topic': topic})
+            return self.learn_partitions(topic, response)
+        return self.partitions[topic]
+
+    async def get_stats(self, target_node):
+        return await self.send_and_receive(target_node, {'command': 'STATS'})
+
+    async def profile(self, target_node, op, **options):
+        """Control a node's profiler: op is start, stop, dump, status, memory_start, memory_diff or memory_stop."""
+        return await self.send_and_receive(target_node, {'command': 'PROFILE', 'op': op, **options})
+
+    async def members(self):
+        """Live nodes of the hypercube as seen by our entry node."""
+        response = await self.send_and_receive(self.node_id, {'command': 'MEMBERS'})
+        return response.get('members', [])
+
+    async def broadcast(self, query):
+        """Ask every live node at once (TOPICS, STATS or MEMBERS) through our entry node."""
+        return await self.send_and_receive(self.node_id, {'command': 'BROADCAST', 'query': query})
+
+    async def list_topics(self):
+        """All topics in the cluster."""
+        response = await self.broadcast('TOPICS')
+        return response.get('topics', [])
+
+    async def cluster_stats(self):
+        """STATS of every live node, by node ID."""
+        response = await self.broadcast('STATS')
+        return response.get('stats', {})
+
+    async def leave(self, target_node):
+        """Ask a node to hand its topics to the remaining nodes and shut down."""
+        return await self.send_and_receive(target_node, {'command': 'LEAVE'})
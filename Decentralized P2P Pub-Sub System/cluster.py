@@ -0,0 +1,82 @@
+import contextlib
+import os
+import subprocess
+import sys
+import time
+from hypercube import ALL_NODES
+from wire import request_blocking
+
+PEER_NODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'peer_node.py')
+
+def start_nodes(node_ids=ALL_NODES, node_args=(), quiet=True):
+    """Spawn all peer node processes at once and return them by node ID."""
+    output = subprocess.DEVNULL if quiet else None
+    return {
+        node_id: subprocess.Popen([sys.executable, PEER_NODE, node_id, *node_args], stdout=output, stderr=output)
+        for node_id in node_ids
+    }
+
+def is_ready(node_id, timeout=0.2):
+    """Health probe: True once the node answers PING as ready."""
+    try:
+        response = request_blocking("localhost", 8000 + int(node_id, 2), {"command": "PING"}, timeout=timeout)
+    except (OSError, ValueError):
+        return False
+    return response.get("status") == "Ready"
+
+def wait_until_ready(processes, timeout=10.0, interval=0.01):
+    """Poll every node until all of them are ready, failing fast if one exits."""
+    deadline = time.monotonic() + timeout
+    pending = set(processes)
+    while pending:
+        for node_id in sorted(pending):
+            if processes[node_id].poll() is not None:
+                raise RuntimeError(f"Peer node {node_id} exited with code {processes[node_id].returncode}")
+            if is_ready(node_id):
+                pending.discard(node_id)
+        if pending and time.monotonic() > deadline:
+            raise TimeoutError(f"Peer nodes {sorted(pending)} not ready after {timeout} seconds")
+        if pending:
+            time.sleep(interval)
+
+def stop_nodes(processes, timeout=3):
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def start_cluster(node_ids=ALL_NODES, node_args=(), timeout=10.0, quiet=True):
+    """Start the nodes and return once every one of them is ready.
+
+    All nodes are spawned at once. Of a subset, the nodes after the first join
+    through it, since a node started without a seed assumes that all 8 nodes
+    are running; they wait for the first node to be ready before they join.
+    """
+    node_ids = list(node_ids)
+    subset = sorted(node_ids) != sorted(ALL_NODES)
+    first = node_ids[:1] if subset else node_ids
+    processes = start_nodes(first, node_args, quiet)
+    if subset:
+        processes.update(start_nodes(node_ids[1:], (*node_args, "--join", node_ids[0]), quiet))
+    try:
+        wait_until_ready(processes, timeout)
+    except Exception:
+        stop_nodes(processes)
+        raise
+    return processes
+
+@contextlib.contextmanager
+def running_cluster(node_ids=ALL_NODES, node_args=(), timeout=10.0, quiet=True):
+    """Context manager running a ready cluster for the duration of the block.
+
+        with running_cluster(ALL_NODES[:4]) as processes:
+            ...
+    """
+    processes = start_cluster(node_ids, node_args, timeout, quiet)
+    try:
+        yield processes
+    finally:
+        stop_nodes(processes)
@@ -0,0 +1,151 @@
+import bisect
+
+class GroupMembership:
+    """Members of one consumer group of a topic, kept by the owner of the topic's partition 0.
+
+    Members hold leases that they renew with heartbeats. Every join, leave or
+    expired lease starts a new generation, and each member's partitions are
+    recomputed from the sorted member list, so members pick up the new
+    assignment on their next heartbeat.
+    """
+
+    def __init__(self, session_timeout=10.0):
+        self.session_timeout = session_timeout
+        self.members = {}  # member ID -> lease deadline
+        self.generation = 0
+
+    def expire(self, now):
+        expired = [member for member, deadline in self.members.items() if deadline < now]
+        for member in expired:
+            del self.members[member]
+        if expired:
+            self.generation += 1
+        return expired
+
+    def join(self, member, now):
+        self.expire(now)
+        if member not in self.members:
+            self.generation += 1
+        self.members[member] = now + self.session_timeout
+
+    def heartbeat(self, member, now):
+        """Renew a member's lease. False if the member is unknown or its lease already expired."""
+        self.expire(now)
+        if member not in self.members:
+            return False
+        self.members[member] = now + self.session_timeout
+        return True
+
+    def leave(self, member):
+        if self.members.pop(member, None) is not None:
+            self.generation += 1
+
+    def assignment(self, member, partitions):
+        """Partitions a member consumes. With more members than partitions, members share partitions."""
+        ordered = sorted(self.members)
+        if member not in ordered:
+            return []
+        index = ordered.index(member)
+        if len(ordered) <= partitions:
+            return [p for p in range(partitions) if p % len(ordered) == index]
+        return [index % partitions]
+
+    def export(self):
+        return {"members": sorted(self.members), "generation": self.generation}
+
+    @classmethod
+    def restore(cls, state, session_timeout, now):
+        membership = cls(session_timeout)
+        membership.generation = state["generation"] + 1  # Everyone has to fetch the assignment again
+        membership.members = {member: now + session_timeout for member in state["members"]}
+        return membership
+
+class PartitionCursor:
+    """Progress of one consumer group through one partition, kept by the partition's owner.
+
+    Offsets are absolute positions in the partition. A fetch claims the next range
+    of messages for a member until a deadline; committing the range marks it
+    processed. Claims that expire or whose member leaves are handed out again,
+    so delivery is at least once. `committed` is the offset before which every
+    message has been committed, however out of order the commits arrived.
+    """
+
+    def __init__(self, claim_timeout=30.0, committed=0):
+        self.claim_timeout = claim_timeout
+        self.committed = committed
+        self.next_offset = committed  # First offset never handed out
+        self.claims = {}              # start -> [end, member, deadline]
+        self.done = {}                # start -> end of ranges committed past `committed`
+        self.redeliver = []           # Sorted (start, end) ranges to hand out again
+
+    def claim(self, member, available, max_messages, now):
+        """Claim up to max_messages for a member; returns (start, end) or None if nothing is free."""
+        self.expire(now)
+        if self.redeliver:
+            start, end = self.redeliver.pop(0)
+            if end - start > max_messages:
+                bisect.insort(self.redeliver, (start + max_messages, end))
+                end = start + max_messages
+        elif self.next_offset < available:
+            start = self.next_offset
+            end = min(available, start + max_messages)
+            self.next_offset = end
+        else:
+            return None
+        self.claims[start] = [end, member, now + self.claim_timeout]
+        return start, end
+
+    def skip_to(self, first):
+        """Count everything before `first` as consumed: those messages expired before anyone fetched them."""
+        if self.next_offset < first:
+            self.commit(self.next_offset, first)
+            self.next_offset = first
+        while self.redeliver and self.redeliver[0][0] < first:
+            start, end = self.redeliver.pop(0)
+            if end > first:
+                bisect.insort(self.redeliver, (first, end))
+                end = first
+            self.commit(start, end)
+
+    def commit(self, start, end):
+        self.claims.pop(start, None)
+        if end > self.next_offset:
+            # Only when replaying logged commits: the gap before this range was claimed but not committed
+            if start > self.next_offset:
+                bisect.insort(self.redeliver, (self.next_offset, start))
+            self.next_offset = end
+        if (start, end) in self.redeliver:
+            self.redeliver.remove((start, end))
+        if start >= self.committed and start not in self.done:
+            self.done[start] = end
+        while self.committed in self.done:
+            self.committed = self.done.pop(self.committed)
+
+    def expire(self, now):
+        for start in [start for start, (_, _, deadline) in self.claims.items() if deadline < now]:
+            self.unclaim(start)
+
+    def release(self, member):
+        for start in [start for start, (_, owner, _) in self.claims.items() if owner == member]:
+            self.unclaim(start)
+
+    def unclaim(self, start):
+        end, _, _ = self.claims.pop(start)
+        bisect.insort(self.redeliver, (start, end))
+
+    def lag(self, available):
+        return available - self.committed
+
+    def export(self):
+        """State for a new owner. Outstanding claims are handed out again there."""
+        pending = sorted(self.redeliver + [(start, claim[0]) for start, claim in self.claims.items()])
+        return {"committed": self.committed, "next_offset": self.next_offset,
+                "done": sorted(self.done.items()), "pending": pending}
+
+    @classmethod
+    def restore(cls, state, claim_timeout):
+        cursor = cls(claim_timeout, state["committed"])
+        cursor.next_offset = state["next_offset"]
+        cursor.done = {start: end for start, end in state["done"]}
+        cursor.redeliver = [tuple(r) for r in state["pending"]]
+        return cursor
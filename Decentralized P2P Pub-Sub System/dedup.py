@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+class DedupWindow:
+    """Recently published sequence numbers of each producer, for dropping retried PUBLISHes.
+
+    For every producer the window holds the sequence numbers it has published
+    within `window` of its highest one. A sequence number inside the window is a
+    duplicate if it has been seen. One below the window can no longer be checked
+    and is accepted as new, so such a late retry may be stored twice.
+    Only the `max_producers` most recently active producers are tracked.
+
+    Sequence numbers are unique per producer across all topics, so windows from
+    different nodes can be merged without mistaking a new message for a retry.
+    """
+
+    def __init__(self, window=1024, max_producers=10000):
+        self.window = window
+        self.max_producers = max_producers
+        self.producers = OrderedDict()  # producer_id -> [highest seq, set of seqs within the window]
+        self.duplicates = 0
+
+    def check(self, producer_id, seq):
+        """Return "new" or "duplicate" for a producer's sequence number."""
+        state = self.producers.get(producer_id)
+        if state is None:
+            return "new"
+        highest, seen = state
+        if seq <= highest - self.window:
+            return "new"  # Possibly a late retry, but refusing it could lose a message never stored
+        if seq in seen:
+            self.duplicates += 1
+            return "duplicate"
+        return "new"
+
+    def record(self, producer_id, seq):
+        state = self.producers.get(producer_id)
+        if state is None:
+            state = self.producers[producer_id] = [seq, set()]
+            if len(self.producers) > self.max_producers:
+                self.producers.popitem(last=False)
+        else:
+            self.producers.move_to_end(producer_id)
+        state[1].add(seq)
+        if seq > state[0]:
+            state[0] = seq
+        # Prune in bulk so that recording stays O(1) amortised
+        if len(state[1]) > 2 * self.window:
+            floor = state[0] - self.window
+            state[1] = {s for s in state[1] if s > floor}
+
+    def export(self):
+        """JSON-friendly copy of the window, for snapshots and topic handoff."""
+        return {producer: sorted(s for s in seen if s > highest - self.window)
+                for producer, (highest, seen) in self.producers.items()}
+
+    def merge(self, exported):
+        for producer, seqs in exported.items():
+            for seq in seqs:
+                self.record(producer, seq)
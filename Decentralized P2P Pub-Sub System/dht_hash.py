@@ -10,3 +10,29 @@ def hash_topic(topic):
     binary_id = format(hash_value % 8, '03b')  # Mod 8 to ensure 3-bit binary ID
     logging.info(f"[DHT Hash] Topic '{topic}' hashed to ID '{binary_id}'")
     return binary_id
+
+def hash_partition(topic, partition):
+    """Returns the node owning a topic partition; the partitions of a topic sit on consecutive node IDs."""
+    base_id = int(hash_topic(topic), 2)
+    return format((base_id + partition) % 8, '03b')
+
+PARTITION_SEPARATOR = '#'  # Not allowed in topic names, so that storage names cannot collide
+
+def valid_topic(topic):
+    """Whether a topic name can be stored without being mistaken for a partition of another topic."""
+    return isinstance(topic, str) and PARTITION_SEPARATOR not in topic
+
+def partition_key(topic, partition):
+    """Name under which the owner node stores a partition. Partition 0 keeps the plain topic name."""
+    return topic if partition == 0 else f"{topic}{PARTITION_SEPARATOR}{partition}"
+
+def hash_key_to_partition(key, partitions):
+    """Maps a message key to a partition so that messages with the same key stay in order."""
+    return int(hashlib.sha256(str(key).encode()).hexdigest(), 16) % partitions
+
+def split_partition_key(key):
+    """Inverse of partition_key: returns (topic, partition) for a stored topic name."""
+    topic, sep, suffix = key.rpartition(PARTITION_SEPARATOR)
+    if sep and suffix.isdigit():
+        return topic, int(suffix)
+    return key, 0
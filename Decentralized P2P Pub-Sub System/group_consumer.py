@@ -0,0 +1,47 @@
+import asyncio
+import argparse
+from client_api import ClientAPI
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class GroupConsumer:
+    """One worker of a consumer group: fetches its share of a topic, processes it and commits."""
+
+    def __init__(self, peer_id, topic, group, batch_size=100, idle_wait=1.0):
+        self.api = ClientAPI(peer_id)
+        self.topic = topic
+        self.group = group
+        self.batch_size = batch_size
+        self.idle_wait = idle_wait
+
+    async def start(self):
+        assignment = await self.api.join_group(self.topic, self.group)
+        logging.info(f"[GroupConsumer] Joined group '{self.group}' of topic '{self.topic}', partitions {assignment}")
+        try:
+            while True:
+                batches = await self.api.fetch(self.topic, self.group, self.batch_size)
+                if not batches:
+                    await asyncio.sleep(self.idle_wait)
+                    continue
+                for batch in batches:
+                    for msg in batch["messages"]:
+                        logging.info(f"[GroupConsumer] Partition {batch['partition']}: {msg}")
+                    committed = await self.api.commit(self.topic, self.group, batch)
+                    logging.info(f"[GroupConsumer] Committed partition {batch['partition']} up to offset {committed}")
+        finally:
+            await self.api.leave_group(self.topic, self.group)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consumer Group Worker Configuration")
+    parser.add_argument("peer_id", type=str, help="ID of the Peer Node to connect to (e.g., 000)")
+    parser.add_argument("topic", type=str, help="Topic to consume")
+    parser.add_argument("group", type=str, help="Consumer group to join")
+    parser.add_argument("--batch-size", type=int, default=100, help="Messages claimed per partition and fetch")
+    args = parser.parse_args()
+
+    consumer = GroupConsumer(args.peer_id, args.topic, args.group, args.batch_size)
+    try:
+        asyncio.run(consumer.start())
+    except KeyboardInterrupt:
+        pass
@@ -27,3 +27,79 @@ def route_to_target(current_node, target_node):
         current = next_step
     logging.info(f"[Hypercube] Routing path from '{current_node}' to '{target_node}': {path}")
     return path
+
+DIMENSION = 3
+ALL_NODES = [format(i, '03b') for i in range(2 ** DIMENSION)]
+
+def xor_distance(node_a, node_b):
+    return int(node_a, 2) ^ int(node_b, 2)
+
+def owner_of(key, live_nodes):
+    """Live node responsible for a key in an incomplete hypercube.
+
+    Each key belongs to the live node at the smallest XOR distance from it, so a
+    missing node's key range falls to its nearest live neighbours. Distances to
+    distinct nodes never tie.
+    """
+    return min(live_nodes, key=lambda node: xor_distance(key, node))
+
+def replica_nodes(key, live_nodes, count):
+    """The `count` live nodes after the owner in XOR distance from a key.
+
+    These are the nodes that would take over the key, in order, if the nodes
+    before them disappeared.
+    """
+    ranked = sorted(live_nodes, key=lambda node: xor_distance(key, node))
+    return ranked[1:count + 1]
+
+def next_hops(current_node, target_node, live_nodes, order=None):
+    """Candidate next hops from current_node towards target_node, best first.
+
+    Each candidate is a (neighbour, order) pair: the neighbour starts one of the
+    node-disjoint paths of dimension_orders(), and `order` is the order in which
+    the nodes after it continue flipping bits. Only live neighbours are used, and
+    each hop reduces the XOR distance to the target, which rules out routing
+    loops; the target itself is the last resort when no such neighbour is alive.
+    """
+    hops = []
+    for bits in dimension_orders(current_node, target_node, order):
+        neighbor = route_in_order(current_node, bits[:1])[0]
+        if neighbor in live_nodes:
+            hops.append((neighbor, bits))
+    if target_node not in [neighbor for neighbor, _ in hops]:
+        hops.append((target_node, []))
+    return hops
+
+def dimension_orders(current_node, target_node, order=None):
+    """Orders in which to flip the bits that differ between two nodes, one for each disjoint path.
+
+    Paths that flip the differing bits in cyclic rotations of one order share no
+    node other than their ends. The first order follows `order` as far as it
+    covers the differing bits, and otherwise flips the highest bit first.
+    """
+    diff = xor_distance(current_node, target_node)
+    bits = [i for i in reversed(range(DIMENSION)) if diff >> i & 1]
+    if order:
+        bits = [i for i in order if i in bits] + [i for i in bits if i not in order]
+    return [bits[i:] + bits[:i] for i in range(len(bits))]
+
+def route_in_order(current_node, order):
+    """Nodes visited from current_node when flipping the bits of `order` one after another."""
+    path = []
+    current = int(current_node, 2)
+    for i in order:
+        current ^= 1 << i
+        path.append(format(current, '03b'))
+    return path
+
+def binomial_children(node_id, root_id):
+    """Children of node_id in the binomial spanning tree of the hypercube rooted at root_id.
+
+    Relative to the root, a node whose lowest set bit is bit k has the children
+    reached by flipping each bit below k; the root flips every bit. A broadcast
+    along this tree reaches all 2^DIMENSION nodes in DIMENSION rounds.
+    """
+    node = int(node_id, 2)
+    relative = node ^ int(root_id, 2)
+    limit = (relative & -relative).bit_length() - 1 if relative else DIMENSION
+    return [format(node ^ (1 << i), '03b') for i in reversed(range(limit))]
@@ -0,0 +1,78 @@
+import asyncio
+from collections import deque
+
+class PriorityLanes:
+    """Concurrency slots shared by lanes of requests, handed out by weight.
+
+    Replaces a single semaphore. When slots are free a request takes one
+    straight away; otherwise it waits in its lane's FIFO queue. Each freed slot
+    goes to a waiting lane chosen by smooth weighted round-robin, so with
+    weights {"control": 4, "data": 1} and both lanes backed up, control requests
+    get four of every five slots and data requests are never starved.
+
+    A lane can also be capped below the total (`limits`), which keeps the
+    remaining slots free for the other lanes however busy it is.
+    """
+
+    def __init__(self, slots, weights, limits=None):
+        self.slots = slots
+        self.weights = dict(weights)
+        self.limits = {lane: (limits or {}).get(lane, slots) for lane in self.weights}
+        self.waiters = {lane: deque() for lane in self.weights}
+        self.credit = {lane: 0 for lane in self.weights}
+        self.running = {lane: 0 for lane in self.weights}
+        self.served = {lane: 0 for lane in self.weights}
+
+    @property
+    def in_flight(self):
+        return sum(self.running.values())
+
+    def queued(self, lane=None):
+        if lane is None:
+            return sum(len(waiters) for waiters in self.waiters.values())
+        return len(self.waiters[lane])
+
+    def can_run(self, lane):
+        return self.in_flight < self.slots and self.running[lane] < self.limits[lane]
+
+    async def acquire(self, lane):
+        if not self.waiters[lane] and self.can_run(lane):
+            self.start(lane)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[lane].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(lane)  # Granted a slot just as we were cancelled
+            else:
+                self.waiters[lane].remove(waiter)
+            raise
+
+    def release(self, lane):
+        self.running[lane] -= 1
+        self.wake()
+
+    def start(self, lane):
+        self.running[lane] += 1
+        self.served[lane] += 1
+
+    def wake(self):
+        """Hand free slots to waiting requests, picking lanes by smooth weighted round-robin."""
+        while True:
+            ready = [lane for lane, waiters in self.waiters.items() if waiters and self.can_run(lane)]
+            if not ready:
+                return
+            total = 0
+            for lane in ready:
+                self.credit[lane] += self.weights[lane]
+                total += self.weights[lane]
+            lane = max(ready, key=self.credit.get)
+            self.credit[lane] -= total
+            self.start(lane)
+            self.waiters[lane].popleft().set_result(None)
+
+    def report(self):
+        return {lane: {"weight": self.weights[lane], "limit": self.limits[lane], "in_flight": self.running[lane],
+                       "queued": len(self.waiters[lane]), "served": self.served[lane]} for lane in self.weights}
@@ -1,97 +1,1332 @@
+import argparse
 import asyncio
-import json
 import logging
-import sys
-from dht_hash import hash_topic
-from hypercube import get_neighbors
+import os
+import signal
+import time
+import uuid
+from bloom import FILTER_BITS, FILTER_INTERVAL, CountingBloomFilter, PeerFilters
+from consumer_group import GroupMembership, PartitionCursor
+from dedup import DedupWindow
+from dht_hash import hash_partition, partition_key, split_partition_key, valid_topic
+from hypercube import ALL_NODES, DIMENSION, binomial_children, get_neighbors, next_hops, owner_of, replica_nodes, xor_distance
+from lanes import PriorityLanes
+from monitor import LoopMonitor, TimedSteps
+from persistence import NodeStore
+from profiling import Profiler
+from ratelimit import RateLimiter, acquire
+from rtt import RttTable
+from timer_wheel import TimerWheel
+from ttl import ExpiryIndex
+from functools import partial
+from topic_store import STORES, TieredMessageLog, TieredStorage
+from wire import FLAG_ACCEPTS_COMPRESSED, FLAG_FORWARDED, FrameCodec, read_frame, relay, request, routed_frame, write_message
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+MAX_HOPS = 2 * DIMENSION  # Forwarding budget; guards against loops between nodes with stale membership
+HANDOFF_BATCH = 500       # Messages per HANDOFF batch when moving topics to a new owner
+ACK_LEVELS = ("none", "leader", "replicated")  # When a PUBLISH is acknowledged
+REPLICATE_TIMEOUT = 2.0   # Seconds to wait for a replica to confirm a message
+FILTER_TIMEOUT = 1.0      # Seconds to wait for a node to take our topic filter or its additions
+FILTER_RETRY = 0.5        # Seconds between attempts to deliver topic additions a node missed
+BROADCAST_QUERIES = ("TOPICS", "STATS", "MEMBERS")  # Queries that can be asked of every node at once
+BROADCAST_TIMEOUT = 5.0   # Seconds to wait for a whole subtree of a broadcast
+HEDGED_COMMANDS = ("PULL", "PULL_MANY", "DESCRIBE", "SUBSCRIBE")  # Safe to send twice
+HEDGE_QUANTILE = 0.95     # Latency after which a duplicate is sent along another path
+OWNER_WAIT = REPLICATE_TIMEOUT + FILTER_TIMEOUT  # Longest an owner may wait on other nodes before it replies
+GROUP_COMMANDS = ("JOIN_GROUP", "HEARTBEAT", "LEAVE_GROUP", "FETCH", "COMMIT")  # Consumer group requests
+EXPIRY_INTERVAL = 1.0     # Seconds between background passes that reclaim expired messages
+PROBE_INTERVAL = 2.0      # Seconds between probes of every node believed to be live
+PROBE_TIMEOUT = 1.0       # A probe that times out leaves the node in place; only a refused connection removes it
+SEED_TIMEOUT = 10.0       # Seconds to keep retrying a seed node that is still starting
+SEED_RETRY = 0.02         # Seconds between attempts to reach the seed node
+# Bulk data requests, admitted in their own lane; everything else (topic management,
+# membership, group coordination, queries) is control traffic and gets priority
+DATA_COMMANDS = ("PUBLISH", "PULL", "PULL_MANY", "FETCH", "HANDOFF", "HANDOFF_PULL", "REPLICATE")
+FILTERED_COMMANDS = ("PULL", "SUBSCRIBE", "DESCRIBE")  # Answered by the entry node when the owner's filter rules the topic out
+MAX_WAIT_MS = 60000       # Longest a long-poll PULL may be parked at its owner
+
 class PeerNode:
-    def __init__(self, node_id):
+    def __init__(self, node_id, max_concurrent=64, max_queue=128, max_queue_wait=1.0,
+                 data_dir=None, snapshot_interval=30.0, seed=None, compression_threshold=1024, store="list",
+                 dedup_window=1024, min_rto=0.1, session_timeout=10.0, claim_timeout=30.0,
+                 client_rate=0.0, client_burst=None, topic_rate=0.0, topic_burst=None,
+                 control_weight=4, control_reserve=None, slow_handler=0.05, memory_budget=None,
+                 filter_bits=FILTER_BITS, max_parked=1024):
         self.node_id = node_id
         self.port = 8000 + int(node_id, 2)
         self.topics = {}
+        self.new_message_log = STORES[store]  # Message container of each topic: list, arena-backed or tiered
+        # Tiered logs share a memory budget (bytes) and spill cold segments to disk beyond it
+        self.tier = None
+        if store == "tiered":
+            self.tier = TieredStorage(memory_budget, os.path.join(data_dir, node_id, "spill") if data_dir else None)
+            self.new_message_log = partial(TieredMessageLog, tier=self.tier)
+        self.partition_counts = {}  # Partition count of partitioned topics whose partition 0 lives here
         self.neighbors = get_neighbors(node_id)
 
+        # Membership of the (possibly incomplete) hypercube. Without a seed node the
+        # full hypercube is assumed; nodes that refuse connections are dropped.
+        self.seed = seed
+        self.live_nodes = set(ALL_NODES)
+        self.handoff_sources = set()  # Nodes still streaming us topics that we now own
+        self.joins_received = set()   # Nodes that announced themselves while we were joining
+        self.incoming = set()         # Topics whose handoff to us is not complete yet
+        self.handoff_cursors = {}     # Messages of each outgoing topic already sent to its new owner
+        self.handoff_received = {}    # Ranges of each handed-off topic applied here, and whether it is complete
+        self.shutdown = asyncio.Event()
+        self.ready = False  # Set once the node has announced itself and can be used by clients
+
+        # Admission control: at most max_concurrent requests are processed at once,
+        # at most max_queue more per lane may wait for a slot, everything else is rejected.
+        # Control requests are scheduled ahead of data by weight, and control_reserve
+        # slots are kept for them so that topic management never waits behind bulk PULLs.
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        if control_reserve is None:
+            control_reserve = max(1, max_concurrent // 8)
+        self.lanes = PriorityLanes(max_concurrent, {"control": control_weight, "data": 1},
+                                   limits={"data": max(1, max_concurrent - control_reserve)})
+        self.avg_service_time = 0.0
+        self.stats = {"accepted": 0, "rejected": 0, "completed": 0, "hedges_sent": 0, "hedges_won": 0, "relayed": 0,
+                      "rate_limited": 0, "filter_rejections": 0, "long_polls": 0}
+
+        # Long-poll PULLs spend nearly all their time waiting, so instead of a slot they take one of
+        # max_parked places. The owner parks them until enough messages arrive or their wait is up.
+        self.max_parked = max_parked
+        self.parked = 0
+        self.pull_waiters = {}  # topic -> futures of PULLs parked on it
+
+
+        # PUBLISH rate limits per producer and per topic, enforced where requests enter the cluster
+        self.client_limiter = RateLimiter(client_rate, client_burst)
+        self.topic_limiter = RateLimiter(topic_rate, topic_burst)
+
+        # Frames above the threshold are compressed for peers that accept it (negative disables)
+        self.codec = FrameCodec(threshold=compression_threshold, enabled=compression_threshold >= 0, forwarded=True)
+
+        # Smoothed RTT per neighbor and command, from which forwarding timeouts are derived
+        self.rtt = RttTable(min_rto=min_rto)
+
+        # Sequence numbers recently published by each producer, so that retried PUBLISHes are stored once
+        self.dedup = DedupWindow(dedup_window)
+
+        # Copies of messages published with ack "replicated" for keys owned by other nodes.
+        # Replicas live on the nodes next in line to own a key and are promoted if the owner disappears.
+        self.replicas = {}
+        self.replica_holders = {}  # Nodes holding replicas of each of our topics
+        self.background = set()    # Background tasks, such as fire-and-forget publishes
+
+        # Consumer groups: members of each group are tracked by the owner of the topic's partition 0,
+        # the progress of each group through a partition by the partition's owner
+        self.memberships = {}  # topic -> {group: GroupMembership}
+        self.cursors = {}      # storage key -> {group: PartitionCursor}
+        self.session_timeout = session_timeout
+        self.claim_timeout = claim_timeout
+
+        # Messages published with a delay wait in a timer wheel until they are due
+        self.delayed = {}           # delayed ID -> {"topic", "message", "deliver_at"}
+        self.delayed_by_topic = {}  # topic -> delayed IDs
+        self.timers = TimerWheel(time.time())
+        self.timers_armed = asyncio.Event()
+
+        # Expiry of messages published with a TTL, and the absolute offset of the first message of each topic
+        self.expiry = ExpiryIndex()
+
+        # Optional persistence: mutations are logged and the topic store is snapshotted periodically
+        self.store = NodeStore(data_dir, node_id) if data_dir else None
+        self.snapshot_interval = snapshot_interval
+
+        # On-demand profiling of request handlers (PROFILE admin command); reports go to the data directory
+        self.profiler = Profiler(f"node-{node_id}", data_dir or ".")
+
+        # Event loop lag, and requests that blocked the loop for longer than slow_handler seconds
+        self.monitor = LoopMonitor(slow_threshold=slow_handler)
+
+        # Bloom filter of the topics (and replicas) held here, gossiped to every node so that entry nodes
+        # can answer reads of topics that do not exist without forwarding them (0 bits disables)
+        self.topic_filter = CountingBloomFilter(filter_bits) if filter_bits > 0 else None
+        self.peer_filters = PeerFilters()
+        self.incarnation = uuid.uuid4().hex  # Tells other nodes our filter versions restarted with this process
+        self.filter_delivered = {}  # node -> (when it confirmed our last full filter, that filter's version)
+
     async def handle_request(self, reader, writer):
-        data = await reader.read(1024)
-        message = json.loads(data.decode())
-        action = message.get("command")
-        topic = message.get("topic")
-        target_node = hash_topic(topic)  # Target node based on topic hash
+        flags, route, payload = await read_frame(reader)
+        started = time.perf_counter()
+        steps = TimedSteps(self.serve_request(flags, route, payload, writer))
+        request = await steps
+        command, topic = request.get("command"), request.get("topic")
+        if self.monitor.handled(command, topic, steps.longest, time.perf_counter() - started):
+            logging.warning(f"[{self.node_id}] {command} of topic '{topic}' blocked the event loop for {steps.longest * 1000:.1f}ms")
 
-        # Check if the request should be handled locally or forwarded
-        if target_node == self.node_id:
-            response = self.process_local_request(action, topic, message)
+    async def serve_request(self, flags, route, payload, writer):
+        """Answer one request, including decoding it and encoding the reply. Returns its header or message."""
+        request = route
+        # Limits and filters apply where a request enters the cluster, which a client cannot fake with "hops"
+        entry = not flags & FLAG_FORWARDED
+        if route is not None and self.should_relay(route):
+            # Not ours: pass the payload on and the reply back without decoding either
+            response = (self.rate_limit(route, writer) or self.filter_miss(route)) if entry else None
+            if response is None:
+                response = await self.admit(route["command"], lambda: self.relay_request(flags, route, payload),
+                                            long_poll=poll_wait(route) > 0)
         else:
-            response = await self.forward_request(target_node, message)
+            message = request = self.codec.decode_payload(flags, payload, route)
+            response = (self.rate_limit(message, writer) or self.filter_miss(message)) if entry else None
+            if response is None:
+                response = await self.admit(message.get("command"), lambda: self.dispatch(message),
+                                            long_poll=poll_wait(message) > 0)
 
-        writer.write(json.dumps(response).encode())
+        if isinstance(response, bytes):
+            writer.write(response)
+        else:
+            write_message(writer, response, self.codec, compress=bool(flags & FLAG_ACCEPTS_COMPRESSED))
         await writer.drain()
         writer.close()
         await writer.wait_closed()
+        return request
+
+    async def admit(self, command, handler, long_poll=False):
+        """Run a request handler under the node's concurrency limit, or reject it with a retry hint."""
+        if long_poll:
+            return await self.park(command, handler)
+        loop = asyncio.get_running_loop()
+        lane = "data" if command in DATA_COMMANDS else "control"
+        if self.lanes.queued(lane) >= self.max_queue:
+            return self.busy_response(lane)
+
+        queued_at = loop.time()
+        await self.lanes.acquire(lane)
+
+        # The client has likely given up on a request that sat in the queue this long
+        if loop.time() - queued_at > self.max_queue_wait:
+            self.lanes.release(lane)
+            return self.busy_response(lane)
+
+        self.stats["accepted"] += 1
+        started_at = loop.time()
+        try:
+            if self.profiler.active:
+                return await self.profiler.run(command, handler())
+            return await handler()
+        finally:
+            self.lanes.release(lane)
+            self.stats["completed"] += 1
+            # Exponentially weighted average of service time, used for retry hints
+            self.avg_service_time += 0.1 * ((loop.time() - started_at) - self.avg_service_time)
+
+    async def park(self, command, handler):
+        """Run a long-poll PULL outside the lanes, as one of at most max_parked."""
+        if self.parked >= self.max_parked:
+            return self.busy_response("data")
+        self.parked += 1
+        self.stats["long_polls"] += 1
+        try:
+            if self.profiler.active:
+                return await self.profiler.run(command, handler())
+            return await handler()
+        finally:
+            self.parked -= 1
+
+    def rate_limit(self, request, writer):
+        """Reject a PUBLISH entering the cluster here if its client or topic is over its rate.
+
+        Only the entry node counts a request (one not marked FLAG_FORWARDED), so a
+        forwarded message is never charged twice. The check runs before admission,
+        so a flood costs no queue slots.
+        """
+        if request.get("command") != "PUBLISH":
+            return None
+        now = time.monotonic()
+        buckets = []
+        if self.client_limiter.enabled:
+            # Keyed on the client's address: a producer ID is the client's to choose, and a new one would get a new bucket
+            client = writer.get_extra_info("peername")[0]
+            buckets.append(self.client_limiter.bucket(client, now))
+        if self.topic_limiter.enabled:
+            buckets.append(self.topic_limiter.bucket(request.get("topic"), now))
+        retry_after = acquire(buckets, now)
+        if not retry_after:
+            return None
+        self.stats["rate_limited"] += 1
+        logging.warning(f"[{self.node_id}] Rate limited PUBLISH to topic '{request.get('topic')}' (retry after {retry_after:.3f}s)")
+        return {"status": "Rate limited", "retry_after": round(retry_after, 3)}
+
+    def filter_miss(self, request):
+        """Answer a read entering the cluster here if the owner's topic filter proves the topic does not exist.
+
+        Like rate limiting, this runs before admission, on the entry node only.
+        A filter can only err towards "maybe", which is forwarded as usual.
+        """
+        if request.get("command") not in FILTERED_COMMANDS or request.get("topic") is None:
+            return None
+        topic, partition = request["topic"], request.get("partition", 0)
+        owner = owner_of(hash_partition(topic, partition), self.live_nodes)
+        if owner == self.node_id or not self.peer_filters.absent(owner, partition_key(topic, partition), sorted(self.live_nodes)):
+            return None
+        self.stats["filter_rejections"] += 1
+        logging.info(f"[{self.node_id}] Topic '{topic}' is not in the filter of its owner {owner}, answering {request['command']} here")
+        # The same reply the owner would have given
+        return {"messages": []} if request["command"] == "PULL" else {"status": "Topic not found"}
+
+    def busy_response(self, lane):
+        self.stats["rejected"] += 1
+        retry_after = max(0.01, self.avg_service_time * (self.lanes.queued(lane) + 1) / self.lanes.limits[lane])
+        logging.warning(f"[{self.node_id}] Overloaded, rejecting {lane} request (retry after {retry_after:.3f}s)")
+        return {"status": "Busy", "retry_after": round(retry_after, 3)}
+
+    async def dispatch(self, message):
+        action = message.get("command")
+        if action == "STATS":
+            return self.get_stats()
+        elif action == "PING":
+            return {"status": "Ready" if self.ready else "Starting", "node_id": self.node_id}
+        elif action == "MEMBERS":
+            return {"members": sorted(self.live_nodes)}
+        elif action == "PROFILE":
+            return self.profiler.handle(message)
+        elif action == "JOIN":
+            return self.handle_join(message["node"])
+        elif action == "LEFT":
+            return self.handle_left(message["node"], message.get("handoff", False))
+        elif action == "LEAVE":
+            if self.live_nodes == {self.node_id}:
+                return {"status": "Cannot leave as the last node"}
+            self.leave_task = asyncio.create_task(self.leave())
+            return {"status": "Leaving"}
+        elif action == "HANDOFF":
+            return self.receive_handoff(message)
+        elif action == "HANDOFF_PULL":
+            return self.release_topic(message["topic"])
+        elif action == "REPLICATE":
+            return self.store_replica(message)
+        elif action == "DROP_REPLICA":
+            if self.replicas.pop(message["topic"], None) is not None:
+                self.topic_removed(message["topic"])
+            return {"status": "Dropped"}
+        elif action == "FILTER":
+            self.peer_filters.update(message)
+            return {"status": "Received"}
+        elif action == "FILTER_ADD":
+            self.peer_filters.add(message)
+            return {"status": "Received"}
+        elif action == "PULL_MANY":
+            return await self.pull_many(message)
+        elif action == "BROADCAST":
+            return await self.broadcast(message)
+
+        if not valid_topic(message.get("topic")):
+            return {"status": "Invalid topic name"}
+
+        if action == "PUBLISH":
+            ack = message.get("ack", "leader")
+            if ack not in ACK_LEVELS:
+                return {"status": "Unknown ack level"}
+            if ack == "none" and not message.get("hops"):
+                # Acknowledge on receipt; the publish carries on in the background
+                self.spawn(self.dispatch(dict(message, ack="leader")))
+                return {"status": "Accepted"}
+
+        topic = message.get("topic")
+        partition = message.get("partition", 0)
+        key = hash_partition(topic, partition)  # Key based on topic hash
+
+        # Handle locally if we own the key, otherwise forward towards its owner.
+        # The owner is recomputed if it turns out to be gone while forwarding.
+        while True:
+            owner = owner_of(key, self.live_nodes)
+            if owner == self.node_id:
+                return await self.handle_locally(action, key, partition_key(topic, partition), message)
+            response = await self.forward_request(owner, message, key)
+            if response is not None:
+                return response
+
+    def should_relay(self, route):
+        """Whether a routed request is for another node and can pass through undecoded."""
+        if route.get("ack") == "none" and not route.get("hops"):
+            return False  # The entry node acknowledges these itself
+        return owner_of(route["key"], self.live_nodes) != self.node_id
+
+    async def relay_request(self, flags, route, payload):
+        """Forward a routed request towards the owner of its key.
+
+        Only the routing header is rewritten; the payload bytes and the reply
+        frame pass through untouched, so a hop costs the same whatever the
+        message size.
+        """
+        hops = route.get("hops", 0)
+        if hops >= MAX_HOPS:
+            logging.error(f"[{self.node_id}] Dropping request after {hops} hops")
+            return {"status": "Failed to forward request"}
+        kind = route["command"]
+        wait = poll_wait(route)
+        retry = idempotent(route)
+        hedge = retry and not wait
+
+        while True:
+            owner = owner_of(route["key"], self.live_nodes)
+            if owner == self.node_id:
+                # The owner disappeared and we inherited the key
+                return await self.dispatch(self.codec.decode_payload(flags, payload, route))
+            reply = await self.forward_via(owner, kind, hedge, lambda neighbor, order: self.relay_frame(
+                neighbor, routed_frame(flags | FLAG_FORWARDED, dict(route, hops=hops + 1, order=order), payload)),
+                wait, retry, route.get("order"))
+            if reply is not None:
+                self.stats["relayed"] += 1
+                return reply
+
+    async def relay_frame(self, target_node, frame):
+        return await relay("localhost", 8000 + int(target_node, 2), frame)
+
+    async def handle_locally(self, action, key, storage_key, message):
+        """Serve a request for a key this node owns."""
+        if self.handoff_sources and (storage_key not in self.topics or storage_key in self.incoming):
+            await self.pull_through(storage_key)
+        elif storage_key not in self.topics and storage_key in self.replicas:
+            self.promote_replica(storage_key)
+        if poll_wait(message):
+            return await self.long_poll(storage_key, message)
+        response = self.process_local_request(action, storage_key, message)
+        if action == "CREATE" and response["status"] == "Topic created":
+            # Before the client hears of the topic, so no entry node can still rule it out
+            await self.announce_topics([storage_key])
+        elif action == "PUBLISH" and message.get("ack") == "replicated" and response["status"] == "Message published":
+            await self.replicate(key, storage_key, message, response)
+        elif action == "DELETE" and storage_key in self.replica_holders:
+            self.drop_replicas(storage_key)
+        return response
+
+    async def long_poll(self, topic, message):
+        """PULL that waits up to wait_ms for at least min_messages (default 1) from its offset.
+
+        Returns as soon as enough messages are there, when the wait is up, or
+        when the topic is deleted or handed to another node in the meantime.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + poll_wait(message)
+        wanted = max(1, message.get("min_messages", 1))
+        while True:
+            response = self.process_local_request("PULL", topic, message)
+            remaining = deadline - loop.time()
+            if topic not in self.topics and self.owner_of_topic(topic) != self.node_id:
+                # We may be leaving, so rather than follow the topic the client polls its new owner
+                return {"status": "Topic moved", "messages": [], "next_offset": message.get("offset", 0)}
+            if len(response["messages"]) >= wanted or remaining <= 0 or topic not in self.topics:
+                return response
+            waiter = loop.create_future()
+            self.pull_waiters.setdefault(topic, set()).add(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                waiters = self.pull_waiters.get(topic)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self.pull_waiters[topic]
+
+    def wake_pullers(self, topic):
+        """Let the PULLs parked on a topic check it again."""
+        for waiter in self.pull_waiters.pop(topic, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def pull_many(self, message):
+        """Pull several topics at once.
+
+        Topics owned here are read locally. The rest are grouped by owner and
+        forwarded as one PULL_MANY per owner, all in parallel. Results come back
+        in request order, each tagged with its topic and partition.
+        """
+        items = message.get("topics", [])
+        results = [None] * len(items)
+        remote = {}
+        for i, item in enumerate(items):
+            topic, partition = item["topic"], item.get("partition", 0)
+            if not valid_topic(topic):
+                results[i] = {"topic": topic, "partition": partition, "status": "Invalid topic name", "messages": []}
+                continue
+            key = hash_partition(topic, partition)
+            owner = owner_of(key, self.live_nodes)
+            if owner == self.node_id:
+                response = await self.handle_locally("PULL", key, partition_key(topic, partition), {"command": "PULL", **item})
+                results[i] = dict(response, topic=topic, partition=partition)
+            else:
+                remote.setdefault(owner, []).append(i)
+
+        batches = list(remote.items())
+        replies = await asyncio.gather(*[
+            self.forward_request(owner, dict(message, topics=[items[i] for i in indexes])) for owner, indexes in batches
+        ])
+        for (owner, indexes), reply in zip(batches, replies):
+            if reply is None:
+                # The owner is gone; pull its topics again from whoever owns them now
+                reply = await self.pull_many(dict(message, topics=[items[i] for i in indexes]))
+            entries = reply.get("results", [])
+            for n, i in enumerate(indexes):
+                if n < len(entries):
+                    results[i] = entries[n]
+                else:
+                    results[i] = {"topic": items[i]["topic"], "partition": items[i].get("partition", 0),
+                                  "status": reply.get("status", "Failed to forward request"), "messages": []}
+        return {"results": results}
+
+    def get_stats(self):
+        """Report admission counters and current load of this node."""
+        return {
+            "node_id": self.node_id,
+            "in_flight": self.lanes.in_flight,
+            "queued": self.lanes.queued(),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "avg_service_time": round(self.avg_service_time, 6),
+            "parked": self.parked,
+            "max_parked": self.max_parked,
+            "lanes": self.lanes.report(),
+            "live_nodes": sorted(self.live_nodes),
+            "handoff_sources": sorted(self.handoff_sources),
+            "handoff_topics": {"outgoing": len(self.handoff_cursors), "incoming": len(self.incoming)},
+            "compression": self.codec.report(),
+            "rtt": self.rtt.report(),
+            "duplicates_dropped": self.dedup.duplicates,
+            "replica_topics": len(self.replicas),
+            "replica_messages": sum(len(messages) for messages in self.replicas.values()),
+            "consumer_groups": sum(len(groups) for groups in self.cursors.values()),
+            "delayed_messages": len(self.delayed),
+            "expired_messages": self.expiry.expired,
+            "tiered_storage": self.tier.report() if self.tier else None,
+            "topic_filter": dict(self.topic_filter.report(), peers=self.peer_filters.report()) if self.topic_filter else None,
+            **self.monitor.report(),
+            **self.stats,
+        }
 
     def process_local_request(self, action, topic, message):
         """Handle requests that target this node directly."""
         if action == "CREATE":
-            return self.create_topic(topic)
+            response = self.create_topic(topic)
+            if response["status"] == "Topic created":
+                if message.get("partition", 0) == 0 and message.get("partitions", 1) > 1:
+                    self.partition_counts[topic] = message["partitions"]
+                if message.get("ttl_ms") is not None:
+                    self.expiry.set_ttl(topic, message["ttl_ms"] / 1000)
         elif action == "PUBLISH":
-            return self.publish_message(topic, message.get("message"))
+            response = self.publish_once(topic, message)
         elif action == "DELETE":
-            return self.delete_topic(topic)
+            response = self.delete_topic(topic)
+            if topic in self.partition_counts:
+                response["partitions"] = self.partition_counts.pop(topic)
         elif action == "SUBSCRIBE":
-            return self.subscribe_to_topic(topic)
+            response = self.subscribe_to_topic(topic)
         elif action == "PULL":
-            return {"messages": self.pull_topic_messages(topic)}
+            response = {"messages": self.pull_topic_messages(topic, message.get("offset"))}
+            if topic in self.topics:
+                # Where the next PULL should start to get only messages published after these
+                response["next_offset"] = self.expiry.base(topic) + len(self.topics[topic])
+        elif action == "DESCRIBE":
+            response = self.describe_topic(topic)
+        elif action in GROUP_COMMANDS:
+            response = self.handle_group_request(action, topic, message)
         else:
             return {"status": "Unknown action"}
 
-    async def forward_request(self, target_node, message):
-        """Forward request to the appropriate neighbor node."""
-        path = get_neighbors(self.node_id)  # Use routing to get next neighbor
-        adaptive_timeout = 5 + (len(path) * 2)  # Adjust timeout based on hop count
-        
-        for neighbor in path:
+        if self.store:
+            self.persist(action, topic, message, response)
+
+        # Let clients learn the partition count from any reply about partition 0
+        if topic in self.partition_counts:
+            response["partitions"] = self.partition_counts[topic]
+        return response
+
+    def handle_group_request(self, action, topic, message):
+        """Membership of a consumer group (partition 0 only) and range claims on one partition."""
+        if topic not in self.topics:
+            logging.warning(f"[{self.node_id}] Topic '{topic}' not found")
+            return {"status": "Topic not found"}
+        if action == "COMMIT" and "offset" not in message:
+            return {"status": "Missing offset"}
+        group, member, now = message.get("group"), message.get("member"), time.monotonic()
+
+        if action in ("JOIN_GROUP", "HEARTBEAT"):
+            groups = self.memberships.setdefault(topic, {})
+            membership = groups.get(group)
+            if membership is None:
+                membership = groups[group] = GroupMembership(self.session_timeout)
+            generation = membership.generation
+            if action == "JOIN_GROUP":
+                membership.join(member, now)
+            elif not membership.heartbeat(member, now):
+                return {"status": "Unknown member"}
+            if membership.generation != generation:
+                logging.info(f"[{self.node_id}] Group '{group}' of topic '{topic}' rebalanced to generation "
+                             f"{membership.generation} with {len(membership.members)} members")
+            return {"status": "Joined", "generation": membership.generation, "members": len(membership.members),
+                    "assignment": membership.assignment(member, self.partition_counts.get(topic, 1))}
+
+        cursors = self.cursors.setdefault(topic, {})
+        cursor = cursors.get(group)
+        if cursor is None:
+            cursor = cursors[group] = PartitionCursor(self.claim_timeout)
+        if action == "FETCH":
+            self.expire_due()
+            messages, base = self.topics[topic], self.expiry.base(topic)
+            cursor.skip_to(base)
+            while True:
+                claimed = cursor.claim(member, base + len(messages), message.get("max_messages", 100), now)
+                if claimed is None:
+                    return {"status": "No messages", "offset": cursor.next_offset, "messages": [], "committed": cursor.committed}
+                start, end = claimed
+                batch = self.expiry.visible(topic, messages, start, end)
+                if batch:
+                    return {"status": "Claimed", "offset": start, "end": end, "messages": batch, "committed": cursor.committed}
+                cursor.commit(start, end)  # Everything in the range expired; nothing to hand out
+        if action == "COMMIT":
+            end = message.get("end", message["offset"] + message.get("count", 0))
+            cursor.commit(message["offset"], end)
+            available = self.expiry.base(topic) + len(self.topics[topic])
+            return {"status": "Committed", "committed": cursor.committed, "lag": cursor.lag(available)}
+
+        # LEAVE_GROUP: hand the member's claims to the others right away instead of at claim expiry
+        cursor.release(member)
+        membership = self.memberships.get(topic, {}).get(group)
+        if membership is not None:
+            membership.leave(member)
+            logging.info(f"[{self.node_id}] Member left group '{group}' of topic '{topic}', "
+                         f"generation {membership.generation}")
+        return {"status": "Left"}
+
+    def export_groups(self, topic):
+        """Consumer group state of a topic, for its new owner."""
+        return {
+            "memberships": {group: m.export() for group, m in self.memberships.get(topic, {}).items()},
+            "cursors": {group: c.export() for group, c in self.cursors.get(topic, {}).items()},
+        }
+
+    def import_groups(self, topic, state):
+        now = time.monotonic()
+        for group, exported in state.get("memberships", {}).items():
+            self.memberships.setdefault(topic, {})[group] = GroupMembership.restore(exported, self.session_timeout, now)
+        for group, exported in state.get("cursors", {}).items():
+            self.cursors.setdefault(topic, {})[group] = PartitionCursor.restore(exported, self.claim_timeout)
+
+    def persist(self, action, topic, message, response):
+        """Append successful mutations to the node's log."""
+        status = response.get("status")
+        if action == "CREATE" and status == "Topic created":
+            self.store.append({"op": "CREATE", "topic": topic, "partitions": self.partition_counts.get(topic, 1),
+                               "ttl": self.expiry.ttls.get(topic)})
+        elif action == "PUBLISH" and status == "Message published" and not response.get("duplicate"):
+            entry = {"op": "PUBLISH", "topic": topic, "message": message.get("message")}
+            if "expires_at" in response:
+                entry["expires_at"] = response["expires_at"]
+            if "producer_id" in message:
+                entry["producer_id"], entry["producer_seq"] = message["producer_id"], message["seq"]
+            self.store.append(entry)
+        elif action == "PUBLISH" and status == "Message scheduled":
+            entry = {"op": "SCHEDULE", "topic": topic, "message": message.get("message"),
+                     "deliver_at": response["deliver_at"], "delayed_id": response["delayed_id"],
+                     "ttl": self.delayed[response["delayed_id"]]["ttl"]}
+            if "producer_id" in message:
+                entry["producer_id"], entry["producer_seq"] = message["producer_id"], message["seq"]
+            self.store.append(entry)
+        elif action == "DELETE" and status == "Topic deleted":
+            self.store.append({"op": "DELETE", "topic": topic})
+        elif action == "COMMIT" and status == "Committed":
+            offset = message["offset"]
+            self.store.append({"op": "COMMIT", "topic": topic, "group": message.get("group"), "offset": offset,
+                               "end": message.get("end", offset + message.get("count", 0))})
+        elif (action, status) in (("JOIN_GROUP", "Joined"), ("LEAVE_GROUP", "Left")):
+            membership = self.memberships.get(topic, {}).get(message.get("group"))
+            if membership is not None:
+                self.store.append({"op": "MEMBERS", "topic": topic, "group": message.get("group"), "state": membership.export()})
+
+    async def snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
             try:
-                logging.info(f"[{self.node_id}] Forwarding request to {neighbor} with timeout {adaptive_timeout} seconds")
-                response = await asyncio.wait_for(self.send_request(neighbor, message), timeout=adaptive_timeout)
-                return response
-            except asyncio.TimeoutError:
-                logging.error(f"[{self.node_id}] Timeout while forwarding to {neighbor}")
+                groups = {topic: self.export_groups(topic) for topic in set(self.memberships) | set(self.cursors)}
+                await self.store.snapshot(self.topics, self.partition_counts, self.dedup, self.delayed, self.expiry, groups)
             except Exception as e:
-                logging.error(f"[{self.node_id}] Error while forwarding to {neighbor}: {e}")
-        
+                logging.error(f"[{self.node_id}] Snapshot failed: {e}")
+
+    async def forward_request(self, target_node, message, key=None):
+        """Forward request one hop closer to target_node over live hypercube links.
+
+        Returns None when target_node itself turned out to be gone, so that the
+        caller can pick the new owner of the key.
+        """
+        hops = message.get("hops", 0)
+        if hops >= MAX_HOPS:
+            logging.error(f"[{self.node_id}] Dropping request after {hops} hops")
+            return {"status": "Failed to forward request"}
+        kind = message.get("command")
+        wait = poll_wait(message)
+        retry = idempotent(message)
+        # Long polls are slow on purpose, so a late reply is no reason to hedge them
+        hedge = retry and not wait
+        return await self.forward_via(target_node, kind, hedge, lambda neighbor, order: self.send_request(
+            neighbor, dict(message, hops=hops + 1, order=order), key), wait, retry, message.get("order"))
+
+    async def forward_via(self, target_node, kind, hedge, send, wait=0.0, retry=True, order=None):
+        """Deliver a request towards target_node with send(neighbor, order), failing over and hedging between paths.
+
+        Each path flips the bits that differ from target_node in its own rotation
+        of one dimension order, which the request carries so that the nodes after
+        us keep to it. The paths therefore share no node, and a hedge does not
+        run into the same slow node as the request it duplicates. `order` is the
+        order this request arrived with, if any.
+
+        `wait` is how long the owner may legitimately hold the request (a long poll), on top of the RTT.
+        A request that is not `retry`-safe may already have been applied when it times out, so it is
+        given time for the owner's own waits on every remaining hop, and is sent along another path
+        only if a neighbor refused the connection.
+        """
+        path = next_hops(self.node_id, target_node, self.live_nodes, order)
+        slack = 0.0 if retry else OWNER_WAIT * bin(xor_distance(self.node_id, target_node)).count("1")
+
+        # Candidates are tried in order, each after the previous one failed. If the
+        # first one is slower than its usual p95 latency, the next one is also sent
+        # a copy and whichever answers first wins.
+        candidates = list(path)
+        attempts = {}
+        hedged_to = None
+        try:
+            while candidates or attempts:
+                if candidates and not attempts:
+                    neighbor, bits = candidates.pop(0)
+                    attempts[asyncio.create_task(self.forward_once(neighbor, kind, partial(send, order=bits), wait, slack))] = neighbor
+                delay = None
+                if hedge and hedged_to is None and candidates and len(attempts) == 1:
+                    delay = self.rtt.percentile(next(iter(attempts.values())), kind, HEDGE_QUANTILE)
+                done, _ = await asyncio.wait(attempts, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # At most one duplicate per request
+                    hedged_to, bits = candidates.pop(0)
+                    logging.info(f"[{self.node_id}] No reply within {delay:.3f}s, hedging request via {hedged_to}")
+                    self.stats["hedges_sent"] += 1
+                    attempts[asyncio.create_task(self.forward_once(hedged_to, kind, partial(send, order=bits)))] = hedged_to
+                    continue
+
+                for task in done:
+                    neighbor = attempts.pop(task)
+                    if task.exception() is None:
+                        if neighbor == hedged_to:
+                            self.stats["hedges_won"] += 1
+                        return task.result()
+                    if not retry and not isinstance(task.exception(), ConnectionRefusedError):
+                        return {"status": "Failed to forward request"}
+        finally:
+            # The slower copy of a hedged request is no longer needed
+            for task in attempts:
+                task.cancel()
+
+        if target_node not in self.live_nodes:
+            return None
         return {"status": "Failed to forward request"}
 
-    async def send_request(self, target_node, message):
-        """Send a JSON request to another peer node."""
-        reader, writer = await asyncio.open_connection("localhost", 8000 + int(target_node, 2))
-        writer.write(json.dumps(message).encode())
-        await writer.drain()
-        
-        data = await reader.read(1024)
-        response = json.loads(data.decode())
-        
-        writer.close()
-        await writer.wait_closed()
+    async def forward_once(self, neighbor, kind, send, wait=0.0, slack=0.0):
+        """Send a forwarded request to one neighbor, with a timeout from its RTT estimate plus `wait` and `slack`."""
+        # Timeout derived from this neighbor's recent RTTs for this kind of request
+        timeout = self.rtt.timeout(neighbor, kind) + wait + slack
+        started_at = asyncio.get_running_loop().time()
+        try:
+            logging.info(f"[{self.node_id}] Forwarding request to {neighbor} with timeout {timeout:.3f} seconds")
+            response = await asyncio.wait_for(send(neighbor), timeout=timeout)
+            if not wait:
+                # How long a long poll was parked says nothing about the link
+                self.rtt.observe(neighbor, kind, asyncio.get_running_loop().time() - started_at)
+            return response
+        except asyncio.TimeoutError:
+            self.rtt.timed_out(neighbor, kind)
+            logging.error(f"[{self.node_id}] Timeout while forwarding to {neighbor} after {timeout:.3f} seconds")
+            raise
+        except ConnectionRefusedError:
+            logging.error(f"[{self.node_id}] Node {neighbor} is not running")
+            self.mark_dead(neighbor)
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"[{self.node_id}] Error while forwarding to {neighbor}: {e}")
+            raise
+
+    async def send_request(self, target_node, message, key=None):
+        """Send a JSON request to another peer node, with a routing header when it is addressed to a key."""
+        return await request("localhost", 8000 + int(target_node, 2), message, self.codec, key)
+
+    # Cluster-wide queries
+    async def broadcast(self, message):
+        """Answer a query for this node and its whole subtree of the binomial broadcast tree.
+
+        The node that receives the query from a client is the root. Each node asks
+        its children in parallel and merges their replies into its own, so the
+        whole cluster answers in DIMENSION rounds.
+        """
+        query = message.get("query")
+        if query not in BROADCAST_QUERIES:
+            return {"status": "Unknown query"}
+        root = message.get("root", self.node_id)
+        reply = self.answer_query(query)
+        subtrees = await asyncio.gather(*[self.broadcast_subtree(child, root, query) for child in binomial_children(self.node_id, root)])
+        for subtree in subtrees:
+            merge_replies(reply, subtree)
+        return reply
+
+    async def broadcast_subtree(self, child, root, query):
+        """Broadcast to a child's subtree, covering the child's own children if it does not answer."""
+        if child in self.live_nodes:
+            try:
+                return await asyncio.wait_for(
+                    self.send_request(child, {"command": "BROADCAST", "query": query, "root": root}), BROADCAST_TIMEOUT)
+            except ConnectionRefusedError:
+                self.mark_dead(child)
+            except Exception as e:
+                logging.error(f"[{self.node_id}] Broadcast to {child} failed: {e}")
+
+        # Merging is idempotent, so nodes reached twice after a timeout are not counted twice
+        reply = {"unreachable": [child]} if child in self.live_nodes else {}
+        subtrees = await asyncio.gather(*[self.broadcast_subtree(grandchild, root, query) for grandchild in binomial_children(child, root)])
+        for subtree in subtrees:
+            merge_replies(reply, subtree)
+        return reply
+
+    def answer_query(self, query):
+        reply = {"reached": [self.node_id]}
+        if query == "TOPICS":
+            reply["topics"] = sorted({split_partition_key(topic)[0] for topic in self.topics})
+        elif query == "STATS":
+            reply["stats"] = {self.node_id: self.get_stats()}
+        elif query == "MEMBERS":
+            reply["members"] = {self.node_id: sorted(self.live_nodes)}
+        return reply
+
+    # Replication of messages published with ack "replicated"
+    async def replicate(self, key, topic, message, response):
+        """Copy a published message to the next nodes in line for its key and wait for them."""
+        wanted = max(1, message.get("replicas", 1))
+        targets = replica_nodes(key, self.live_nodes, wanted)
+        replica = {"command": "REPLICATE", "topic": topic, "message": message.get("message"),
+                   "producer_id": message.get("producer_id"), "seq": message.get("seq")}
+        results = await asyncio.gather(
+            *[asyncio.wait_for(self.send_request(node, replica), REPLICATE_TIMEOUT) for node in targets],
+            return_exceptions=True,
+        )
+        confirmed = [node for node, result in zip(targets, results) if isinstance(result, dict) and result.get("status") == "Replicated"]
+        self.replica_holders.setdefault(topic, set()).update(confirmed)
+        response["replicas"] = len(confirmed)
+        if len(confirmed) < wanted:
+            logging.warning(f"[{self.node_id}] Message on topic '{topic}' reached {len(confirmed)} of {wanted} replicas")
+            response["status"] = "Replication incomplete"
+
+    def store_replica(self, message):
+        topic, producer_id, seq = message["topic"], message.get("producer_id"), message.get("seq")
+        if producer_id is not None and seq is not None:
+            if self.dedup.check(producer_id, seq) != "new":
+                return {"status": "Replicated"}
+            self.dedup.record(producer_id, seq)
+        if topic not in self.replicas:
+            self.replicas[topic] = self.new_message_log()
+            self.topic_added(topic)  # So that the key is not ruled out if we have to promote the replica
+        self.replicas[topic].append(message["message"])
+        return {"status": "Replicated"}
+
+    def promote_replica(self, topic):
+        """Serve a key from our replica after its owner disappeared without handing it off."""
+        self.topics[topic] = self.replicas.pop(topic)
+        # The old owner's list of replica holders is gone, so a DELETE has to reach every node
+        self.replica_holders[topic] = self.live_nodes - {self.node_id}
+        logging.warning(f"[{self.node_id}] Promoted replica of topic '{topic}' ({len(self.topics[topic])} messages)")
+        if self.store:
+            self.store.append({"op": "INSERT", "topic": topic, "offset": 0, "messages": self.topics[topic][:]})
+
+    def drop_replicas(self, topic):
+        for node in self.replica_holders.pop(topic):
+            self.spawn(self.send_request(node, {"command": "DROP_REPLICA", "topic": topic}))
+
+    # Topic filters
+    def topic_added(self, topic):
+        if self.topic_filter is not None:
+            self.topic_filter.add(topic)
+
+    def topic_removed(self, topic):
+        if self.topic_filter is not None:
+            self.topic_filter.remove(topic)
+
+    def filter_message(self):
+        return {"command": "FILTER", "node": self.node_id, "incarnation": self.incarnation,
+                "version": self.topic_filter.version, "members": sorted(self.live_nodes),
+                "complete": self.ready and not self.handoff_sources and not self.incoming,
+                "bits": self.topic_filter.bits(), "size": self.topic_filter.size, "hashes": self.topic_filter.hashes}
+
+    async def filter_loop(self):
+        """Gossip our whole topic filter to every live node. This also carries deletions, which are never announced."""
+        while True:
+            await asyncio.sleep(FILTER_INTERVAL)
+            if self.ready:
+                message = self.filter_message()
+                await asyncio.gather(*[self.send_filter(node, message) for node in sorted(self.live_nodes - {self.node_id})])
+
+    async def announce_topics(self, topics):
+        """Add topics to every other node's copy of our filter, or wait until that copy is no longer trusted."""
+        if self.topic_filter is None:
+            return
+        message = {"command": "FILTER_ADD", "node": self.node_id, "incarnation": self.incarnation,
+                   "version": self.topic_filter.version, "members": sorted(self.live_nodes), "keys": topics}
+        await asyncio.gather(*[self.deliver_additions(node, message) for node in sorted(self.live_nodes - {self.node_id})])
+
+    async def deliver_additions(self, node, message):
+        """Retry additions until `node` has them, a full filter with them, or a copy too old to rule anything out.
+
+        Otherwise a node that missed them would keep trusting a filter without
+        the new topics, and answer reads of them as if they did not exist.
+        """
+        while not await self.send_filter(node, message):
+            delivered_at, version = self.filter_delivered.get(node, (None, 0))
+            if delivered_at is None or version >= message["version"] or node not in self.live_nodes:
+                return
+            if time.monotonic() - delivered_at > self.peer_filters.max_age:
+                return
+            await asyncio.sleep(FILTER_RETRY)
+
+    async def send_filter(self, node, message):
+        """Send a filter or additions to one node. True once the node confirmed it."""
+        try:
+            await asyncio.wait_for(self.send_request(node, message), FILTER_TIMEOUT)
+        except ConnectionRefusedError:
+            self.filter_delivered.pop(node, None)  # A restarted node starts without any of our filters
+            logging.warning(f"[{self.node_id}] Could not send topic filter to {node}: not running")
+            return False
+        except Exception as e:
+            logging.warning(f"[{self.node_id}] Could not send topic filter to {node}: {e!r}")
+            return False
+        if message["command"] == "FILTER":
+            self.filter_delivered[node] = (time.monotonic(), message["version"])
+        return True
+
+    def spawn(self, coro):
+        """Run a coroutine in the background and log it if it fails."""
+        task = asyncio.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background_done)
+
+    def background_done(self, task):
+        self.background.discard(task)
+        if not task.cancelled() and task.exception():
+            logging.error(f"[{self.node_id}] Background task failed: {task.exception()}")
+
+    # Membership and topic handoff
+    def mark_dead(self, node):
+        if node != self.node_id and node in self.live_nodes:
+            self.live_nodes.discard(node)
+            self.handoff_sources.discard(node)
+            logging.warning(f"[{self.node_id}] Removed node {node} from the hypercube, live nodes: {sorted(self.live_nodes)}")
+
+    def owner_of_topic(self, storage_key, live_nodes=None):
+        return owner_of(hash_partition(*split_partition_key(storage_key)), live_nodes or self.live_nodes)
+
+    async def join(self):
+        """Learn the membership from the seed node, then announce ourselves to every live node."""
+        if self.seed:
+            response = await self.ask_seed()
+            self.live_nodes = set(response["members"])
+        self.live_nodes.add(self.node_id)
+
+        announced = {self.node_id}
+        while self.live_nodes - announced:
+            others = sorted(self.live_nodes - announced)
+            announced.update(others)
+            self.joins_received.difference_update(others)
+            # Expect a handoff from everyone until they say otherwise; a fast source may finish before replying
+            self.handoff_sources.update(others)
+            responses = await asyncio.gather(
+                *[self.send_request(node, {"command": "JOIN", "node": self.node_id}) for node in others],
+                return_exceptions=True,
+            )
+            for node, response in zip(others, responses):
+                if isinstance(response, Exception):
+                    # A node that refused us but has announced itself since then started after our attempt
+                    if node not in self.joins_received:
+                        self.mark_dead(node)
+                    continue
+                if not response.get("handoff"):
+                    self.handoff_sources.discard(node)
+                # Nodes that joined concurrently with us are announced in the next round. Nodes we
+                # already tried are left out: the peer may not have noticed yet that they are down.
+                self.live_nodes.update(set(response.get("members", [])) - announced)
+        logging.info(f"[{self.node_id}] Joined hypercube, live nodes: {sorted(self.live_nodes)}")
+
+    async def ask_seed(self):
+        """Ask the seed node for the membership once it is ready, since it may have been started together with us."""
+        deadline = time.monotonic() + SEED_TIMEOUT
+        while True:
+            try:
+                response = await self.send_request(self.seed, {"command": "PING"})
+                if response.get("status") == "Ready":
+                    return await self.send_request(self.seed, {"command": "MEMBERS"})
+            except ConnectionRefusedError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Seed node {self.seed} not ready after {SEED_TIMEOUT} seconds")
+            await asyncio.sleep(SEED_RETRY)
+
+    async def probe_loop(self):
+        """Probe every node believed to be live, so that views of the membership converge.
+
+        A node that went down without a LEFT, or was wrongly reported live when
+        we joined, would otherwise stay in our view for as long as no request
+        happens to be sent to it directly, and requests for its keys would bounce
+        between nodes that disagree on who owns them.
+        """
+        while True:
+            await asyncio.sleep(PROBE_INTERVAL)
+            await asyncio.gather(*[self.probe(node) for node in sorted(self.live_nodes - {self.node_id})])
+
+    async def probe(self, node):
+        try:
+            await asyncio.wait_for(self.send_request(node, {"command": "PING"}), PROBE_TIMEOUT)
+        except ConnectionRefusedError:
+            self.mark_dead(node)
+        except Exception as e:
+            logging.warning(f"[{self.node_id}] Probe of {node} failed: {e!r}")
+
+    def handle_join(self, node):
+        self.live_nodes.add(node)
+        self.joins_received.add(node)
+        # Topics already on their way to another node, or still arriving here, are passed on
+        # by whoever holds them once their handoff completes
+        moving = [topic for topic in self.topics if self.owner_of_topic(topic) == node
+                  and topic not in self.handoff_cursors and topic not in self.incoming]
+        logging.info(f"[{self.node_id}] Node {node} joined, handing off {len(moving)} topics")
+        if moving:
+            self.start_hand_off(node, moving)
+        return {"status": "Joined", "handoff": bool(moving), "members": sorted(self.live_nodes)}
+
+    def handle_left(self, node, handoff):
+        self.live_nodes.discard(node)
+        if handoff:
+            self.handoff_sources.add(node)
+        logging.info(f"[{self.node_id}] Node {node} left, live nodes: {sorted(self.live_nodes)}")
+        return {"status": "Acknowledged"}
+
+    async def leave(self):
+        """Hand every topic to its next owner, then stop serving."""
+        remaining = self.live_nodes - {self.node_id}
+        assignment = {}
+        for topic in self.topics:
+            assignment.setdefault(self.owner_of_topic(topic, remaining), []).append(topic)
+
+        # From here on every request for our keys is forwarded to the new owners
+        self.live_nodes = set(remaining)
+        await asyncio.gather(
+            *[self.send_request(node, {"command": "LEFT", "node": self.node_id, "handoff": node in assignment}) for node in remaining],
+            return_exceptions=True,
+        )
+        await asyncio.gather(*[self.hand_off(node, topics) for node, topics in assignment.items()])
+        logging.info(f"[{self.node_id}] Left the hypercube")
+        self.shutdown.set()
+
+    def start_hand_off(self, node, topics):
+        """Mark topics as moving before their handoff task runs, so no other handoff picks them up."""
+        for topic in topics:
+            self.handoff_cursors.setdefault(topic, 0)
+        asyncio.create_task(self.hand_off(node, topics))
+
+    def pass_on(self, topics):
+        """Hand topics that another node has joined for since to their current owners."""
+        assignment = {}
+        for topic in topics:
+            owner = self.owner_of_topic(topic)
+            if topic in self.topics and owner != self.node_id and topic not in self.handoff_cursors:
+                assignment.setdefault(owner, []).append(topic)
+        for node, moving in assignment.items():
+            logging.info(f"[{self.node_id}] Passing on {len(moving)} topics to {node}")
+            self.start_hand_off(node, moving)
+
+    async def hand_off(self, node, topics):
+        """Stream topics to their new owner in batches of at most HANDOFF_BATCH messages.
+
+        The new owner serves requests throughout; a topic it needs before its
+        batch arrives is fetched directly with HANDOFF_PULL. A topic that has
+        a different owner by the time its first batch is due is passed on to
+        that owner instead; one already under way is finished, and its
+        receiver passes it on.
+        """
+        for topic in topics:
+            self.handoff_cursors.setdefault(topic, 0)
+        batch, batch_size, deferred = [], 0, []
+        try:
+            for topic in topics:
+                if self.owner_of_topic(topic) != node:
+                    deferred.append(topic)
+                    continue
+                offset = 0
+                while topic in self.topics:
+                    messages = self.topics[topic]
+                    chunk = messages[offset:offset + HANDOFF_BATCH - batch_size]
+                    last = offset + len(chunk) >= len(messages)
+                    batch.append({"topic": topic, "offset": offset, "messages": chunk, "last": last,
+                                  "partitions": self.partition_counts.get(topic, 1)})
+                    if last:
+                        batch[-1]["groups"] = self.export_groups(topic)
+                        batch[-1]["delayed"] = self.export_delayed(topic)
+                        batch[-1]["expiry"] = self.expiry.export(topic)
+                    offset += len(chunk)
+                    self.handoff_cursors[topic] = offset
+                    batch_size += len(chunk)
+                    if batch_size >= HANDOFF_BATCH:
+                        await self.send_handoff_batch(node, batch)
+                        batch, batch_size = [], 0
+                    if last:
+                        break
+            await self.send_handoff_batch(node, batch, done=True)
+        except Exception as e:
+            # The new owner is unreachable, so keep serving the topics that were not moved
+            logging.error(f"[{self.node_id}] Handoff to {node} failed: {e}")
+            self.mark_dead(node)
+            deferred = topics
+        for topic in deferred:
+            if topic in self.topics:
+                self.handoff_cursors.pop(topic, None)
+        self.pass_on(deferred)
+
+    async def send_handoff_batch(self, node, batch, done=False):
+        message = {"command": "HANDOFF", "node": self.node_id, "entries": batch, "done": done}
+        if done:
+            # Retries of messages we stored must still be recognised by the new owner
+            message["dedup"] = self.dedup.export()
+        await self.send_request(node, message)
+        for entry in batch:
+            if entry["last"]:
+                self.drop_handed_off_topic(entry["topic"])
+
+    def drop_handed_off_topic(self, topic):
+        if topic in self.topics:
+            del self.topics[topic]
+            self.topic_removed(topic)
+            self.partition_counts.pop(topic, None)
+            self.handoff_cursors.pop(topic, None)
+            self.handoff_received.pop(topic, None)
+            self.memberships.pop(topic, None)
+            self.cursors.pop(topic, None)
+            self.drop_delayed(topic)
+            self.expiry.drop(topic)
+            self.wake_pullers(topic)
+            if self.store:
+                self.store.append({"op": "DELETE", "topic": topic})
+
+    def release_topic(self, topic):
+        """Give up the rest of a topic that a new owner needs right away."""
+        if topic not in self.topics:
+            return {"found": False}
+        offset = self.handoff_cursors.get(topic, 0)
+        response = {"found": True, "topic": topic, "offset": offset, "messages": self.topics[topic][offset:], "last": True,
+                    "partitions": self.partition_counts.get(topic, 1), "dedup": self.dedup.export(),
+                    "groups": self.export_groups(topic), "delayed": self.export_delayed(topic),
+                    "expiry": self.expiry.export(topic)}
+        self.drop_handed_off_topic(topic)
         return response
 
+    def receive_handoff(self, message):
+        completed = []
+        for entry in message["entries"]:
+            self.apply_handoff_entry(entry)
+            if entry["last"]:
+                self.incoming.discard(entry["topic"])
+                completed.append(entry["topic"])
+            elif entry["offset"] == 0:
+                self.incoming.add(entry["topic"])
+        # A node may have joined for some of these topics while they were on their way to us
+        self.pass_on(completed)
+        if message.get("done"):
+            self.dedup.merge(message.get("dedup", {}))
+            self.handoff_sources.discard(message["node"])
+            logging.info(f"[{self.node_id}] Handoff from {message['node']} complete")
+        return {"status": "Received"}
+
+    def apply_handoff_entry(self, entry):
+        """Insert handed-off messages at their original offset, ahead of anything published here since.
+
+        Messages of a range already applied, and anything for a topic whose
+        handoff has completed, are ignored, so a batch that arrives twice is
+        stored once.
+        """
+        topic = entry["topic"]
+        received = self.handoff_received.setdefault(topic, {"ranges": [], "complete": False})
+        if received["complete"]:
+            logging.warning(f"[{self.node_id}] Ignoring repeated handoff of '{topic}'")
+            return
+        if self.replicas.pop(topic, None) is not None:  # The handed-off topic supersedes any replica of it
+            self.topic_removed(topic)
+        if topic not in self.topics:
+            self.topics[topic] = self.new_message_log()
+            self.topic_added(topic)
+        offset = entry["offset"]
+        for start, end in missing_ranges(received["ranges"], offset, offset + len(entry["messages"])):
+            self.insert_handed_off(topic, start, entry["messages"][start - offset:end - offset], entry.get("partitions", 1))
+        received["ranges"] = merge_range(received["ranges"], offset, offset + len(entry["messages"]))
+        received["complete"] = entry.get("last", False)
+        self.wake_pullers(topic)
+        if entry.get("partitions", 1) > 1:
+            self.partition_counts[topic] = entry["partitions"]
+        if "groups" in entry:
+            self.import_groups(topic, entry["groups"])
+            if self.store:
+                self.store.append({"op": "GROUPS", "topic": topic, "state": entry["groups"]})
+        if "expiry" in entry:
+            self.expiry.restore(topic, entry["expiry"])
+            if self.store:
+                self.store.append({"op": "EXPIRY", "topic": topic, "state": entry["expiry"]})
+        for pending in entry.get("delayed", []):
+            self.schedule_message(topic, pending["message"], pending["deliver_at"], pending["delayed_id"], pending.get("ttl"))
+            if self.store:
+                self.store.append({"op": "SCHEDULE", "topic": topic, "message": pending["message"],
+                                   "deliver_at": pending["deliver_at"], "delayed_id": pending["delayed_id"],
+                                   "ttl": pending.get("ttl")})
+
+    def insert_handed_off(self, topic, offset, chunk, partitions):
+        messages = self.topics[topic]
+        if isinstance(messages, list) and offset < len(messages):
+            # Inserting ahead of stored messages: a new list, since a snapshot may still be serialising the old one
+            self.topics[topic] = messages[:offset] + chunk + messages[offset:]
+        else:
+            messages[offset:offset] = chunk
+        if self.store:
+            self.store.append({"op": "INSERT", "topic": topic, "offset": offset,
+                               "messages": chunk, "partitions": partitions})
+
+    async def pull_through(self, topic):
+        """Fetch a topic we own from the node still handing it off, before serving a request for it."""
+        for source in sorted(self.handoff_sources):
+            try:
+                response = await self.send_request(source, {"command": "HANDOFF_PULL", "topic": topic})
+            except ConnectionRefusedError:
+                self.mark_dead(source)
+                continue
+            if response.get("found"):
+                self.apply_handoff_entry(response)
+                self.dedup.merge(response.get("dedup", {}))
+                break
+        self.incoming.discard(topic)
+
     # Existing methods for topic operations
+    def publish_once(self, topic, message):
+        """Publish a message unless it is a retry of one already stored for the same producer."""
+        producer_id, seq = message.get("producer_id"), message.get("seq")
+        if producer_id is None or seq is None:
+            return self.publish_or_schedule(topic, message)
+
+        verdict = self.dedup.check(producer_id, seq)
+        if verdict == "duplicate":
+            logging.info(f"[{self.node_id}] Dropped duplicate message {seq} from producer {producer_id} on topic '{topic}'")
+            return {"status": "Message published", "duplicate": True}
+
+        response = self.publish_or_schedule(topic, message)
+        if response["status"] in ("Message published", "Message scheduled"):
+            self.dedup.record(producer_id, seq)
+        return response
+
+    def publish_or_schedule(self, topic, message):
+        """Publish now, or hold the message until its deliver_at time (or delay_ms from now)."""
+        deliver_at = message.get("deliver_at")
+        if deliver_at is None and message.get("delay_ms"):
+            deliver_at = time.time() + message["delay_ms"] / 1000
+        ttl = message["ttl_ms"] / 1000 if message.get("ttl_ms") is not None else None
+        if deliver_at is None or deliver_at <= time.time():
+            return self.publish_message(topic, message.get("message"), ttl)
+        return self.schedule_message(topic, message.get("message"), deliver_at, ttl=ttl)
+
+    def schedule_message(self, topic, message, deliver_at, delayed_id=None, ttl=None):
+        if topic not in self.topics:
+            logging.warning(f"[{self.node_id}] Topic '{topic}' not found")
+            return {"status": "Topic not found"}
+        delayed_id = delayed_id or uuid.uuid4().hex
+        self.delayed[delayed_id] = {"topic": topic, "message": message, "deliver_at": deliver_at, "ttl": ttl}
+        self.delayed_by_topic.setdefault(topic, set()).add(delayed_id)
+        self.timers.schedule(deliver_at, delayed_id)
+        self.timers_armed.set()
+        logging.info(f"[{self.node_id}] Message scheduled on topic '{topic}' in {deliver_at - time.time():.3f}s")
+        return {"status": "Message scheduled", "deliver_at": deliver_at, "delayed_id": delayed_id}
+
+    async def delivery_loop(self):
+        """Publish delayed messages as they fall due, one wheel tick at a time."""
+        while True:
+            if not self.timers.pending:
+                self.timers_armed.clear()
+                await self.timers_armed.wait()
+            await asyncio.sleep(self.timers.tick)
+            for delayed_id in self.timers.advance(time.time()):
+                self.deliver(delayed_id)
+
+    def deliver(self, delayed_id):
+        pending = self.delayed.pop(delayed_id, None)
+        if pending is None:
+            return  # The topic was deleted or handed off in the meantime
+        topic = pending["topic"]
+        ids = self.delayed_by_topic[topic]
+        ids.discard(delayed_id)
+        if not ids:
+            del self.delayed_by_topic[topic]
+        response = self.publish_message(topic, pending["message"], pending["ttl"])
+        if self.store and response["status"] == "Message published":
+            entry = {"op": "PUBLISH", "topic": topic, "message": pending["message"], "delayed_id": delayed_id}
+            if "expires_at" in response:
+                entry["expires_at"] = response["expires_at"]
+            self.store.append(entry)
+
+    async def expiry_loop(self):
+        """Reclaim expired messages in the background, including from topics nobody reads."""
+        while True:
+            await asyncio.sleep(EXPIRY_INTERVAL)
+            self.expire_due()
+
+    def expire_due(self):
+        """Expire every message that is due. Reads call this first, so they never see an expired message."""
+        # Topics moving between nodes are addressed by list position, so they only get tombstones for now
+        pinned = set(self.handoff_cursors) | self.incoming
+        for topic, count in self.expiry.reap(time.time(), pinned, self.topics).items():
+            messages = self.topics.get(topic)
+            if messages is None:
+                continue
+            if isinstance(messages, list):
+                # A new list, since a snapshot may still be serialising the old one
+                self.topics[topic] = messages[count:]
+            else:
+                del messages[:count]
+            logging.info(f"[{self.node_id}] Expired {count} messages from topic '{topic}'")
+
+    def export_delayed(self, topic):
+        """Pending delayed messages of a topic, for its new owner."""
+        return [dict(self.delayed[delayed_id], delayed_id=delayed_id) for delayed_id in self.delayed_by_topic.get(topic, ())]
+
+    def drop_delayed(self, topic):
+        # Their timers stay in the wheel and are skipped when they fire
+        for delayed_id in self.delayed_by_topic.pop(topic, ()):
+            del self.delayed[delayed_id]
+
     def create_topic(self, topic):
         if topic not in self.topics:
-            self.topics[topic] = []
+            self.topics[topic] = self.new_message_log()
+            self.topic_added(topic)
             logging.info(f"[{self.node_id}] Created topic '{topic}'")
             return {"status": "Topic created"}
         else:
             logging.info(f"[{self.node_id}] Topic '{topic}' already exists")
             return {"status": "Topic already exists"}
 
-    def publish_message(self, topic, message):
+    def publish_message(self, topic, message, ttl=None):
         if topic in self.topics:
-            self.topics[topic].append(message)
+            messages = self.topics[topic]
+            messages.append(message)
+            self.wake_pullers(topic)
             logging.info(f"[{self.node_id}] Message published to topic '{topic}'")
-            return {"status": "Message published"}
+            expires_at = self.expiry.expires_at(topic, ttl, time.time())
+            if expires_at is None:
+                return {"status": "Message published"}
+            self.expiry.track(topic, self.expiry.base(topic) + len(messages) - 1, expires_at)
+            return {"status": "Message published", "expires_at": expires_at}
         else:
             logging.warning(f"[{self.node_id}] Topic '{topic}' not found")
             return {"status": "Topic not found"}
@@ -99,6 +1334,13 @@ class PeerNode:
     def delete_topic(self, topic):
         if topic in self.topics:
             del self.topics[topic]
+            self.topic_removed(topic)
+            self.handoff_received.pop(topic, None)
+            self.memberships.pop(topic, None)
+            self.cursors.pop(topic, None)
+            self.drop_delayed(topic)
+            self.expiry.drop(topic)
+            self.wake_pullers(topic)
             logging.info(f"[{self.node_id}] Deleted topic '{topic}'")
             return {"status": "Topic deleted"}
         else:
@@ -113,9 +1355,17 @@ class PeerNode:
             logging.warning(f"[{self.node_id}] Topic '{topic}' not found for subscription")
             return {"status": "Topic not found"}
 
-    def pull_topic_messages(self, topic):
+    def describe_topic(self, topic):
         if topic in self.topics:
-            messages = self.topics[topic]
+            return {"status": "Topic found", "partitions": self.partition_counts.get(topic, 1)}
+        else:
+            logging.warning(f"[{self.node_id}] Topic '{topic}' not found")
+            return {"status": "Topic not found"}
+
+    def pull_topic_messages(self, topic, offset=None):
+        if topic in self.topics:
+            self.expire_due()
+            messages = self.expiry.visible(topic, self.topics[topic], offset)
             logging.info(f"[{self.node_id}] Pulled messages from topic '{topic}'")
             return messages
         else:
@@ -123,16 +1373,115 @@ class PeerNode:
             return []
     
     async def start_server(self):
+        if self.store:
+            scheduled, groups = {}, {}
+            topics, self.partition_counts = self.store.load(self.dedup, scheduled, self.expiry, groups)
+            self.topics = {topic: self.new_message_log(messages) for topic, messages in topics.items()}
+            for topic, state in groups.items():
+                if topic in self.topics:
+                    self.import_groups(topic, state)
+            for topic in self.topics:
+                self.topic_added(topic)
+            for delayed_id, pending in scheduled.items():
+                self.schedule_message(pending["topic"], pending["message"], pending["deliver_at"], delayed_id, pending.get("ttl"))
+            self.snapshot_task = asyncio.create_task(self.snapshot_loop())
+        self.delivery_task = asyncio.create_task(self.delivery_loop())
+        self.expiry_task = asyncio.create_task(self.expiry_loop())
+        self.monitor_task = asyncio.create_task(self.monitor.run())
+        if self.topic_filter is not None:
+            self.filter_task = asyncio.create_task(self.filter_loop())
+
         server = await asyncio.start_server(self.handle_request, "localhost", self.port)
         logging.info(f"[{self.node_id}] Server started on port {self.port}")
-        async with server:
-            await server.serve_forever()
+        # Stop cleanly when terminated, so that the log is closed and spill files are removed
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.shutdown.set)
+        try:
+            async with server:
+                await self.join()
+                self.ready = True
+                self.probe_task = asyncio.create_task(self.probe_loop())
+                await self.shutdown.wait()
+        finally:
+            if self.store:
+                self.store.close()
+            if self.tier:
+                self.tier.close()
+
+def idempotent(request):
+    """Whether a request may safely reach its owner twice. Retried publishes are dropped by the owner."""
+    kind = request.get("command")
+    return kind in HEDGED_COMMANDS or (kind == "PUBLISH" and "seq" in request)
+
+def missing_ranges(ranges, start, end):
+    """The parts of [start, end) not covered by a sorted list of disjoint ranges."""
+    missing = []
+    for low, high in ranges:
+        if low > start:
+            missing.append((start, min(low, end)))
+        start = max(start, high)
+        if start >= end:
+            break
+    if start < end:
+        missing.append((start, end))
+    return [(low, high) for low, high in missing if low < high]
+
+def merge_range(ranges, start, end):
+    """Add [start, end) to a sorted list of disjoint ranges, joining any it touches."""
+    merged = []
+    for low, high in sorted(ranges + [(start, end)]):
+        if merged and low <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+def poll_wait(request):
+    """Seconds a long-poll PULL may be parked at its owner; 0 for any other request."""
+    if request.get("command") != "PULL" or not request.get("wait_ms"):
+        return 0.0
+    return min(request["wait_ms"], MAX_WAIT_MS) / 1000
+
+def merge_replies(into, reply):
+    """Merge one broadcast reply into another: lists are unioned, per-node dicts combined."""
+    for field, value in reply.items():
+        if isinstance(value, list):
+            into[field] = sorted(set(into.get(field, [])) | set(value))
+        elif isinstance(value, dict):
+            into.setdefault(field, {}).update(value)
+    return into
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python peer_node.py <node_id>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Peer Node Configuration")
+    parser.add_argument("node_id", type=str, help="Binary ID of the Peer Node (e.g., 000)")
+    parser.add_argument("--max-concurrent", type=int, default=64, help="Requests processed at once")
+    parser.add_argument("--max-queue", type=int, default=128, help="Requests of each lane allowed to wait for a slot")
+    parser.add_argument("--max-queue-wait", type=float, default=1.0, help="Seconds a request may wait before being rejected")
+    parser.add_argument("--data-dir", type=str, default=None, help="Directory for the node's log and snapshots (in-memory only if omitted)")
+    parser.add_argument("--snapshot-interval", type=float, default=30.0, help="Seconds between snapshots of the topic store")
+    parser.add_argument("--join", type=str, default=None, help="ID of a running node to join through (assumes all 8 nodes if omitted)")
+    parser.add_argument("--compression-threshold", type=int, default=1024, help="Compress frames of at least this many bytes (-1 disables)")
+    parser.add_argument("--store", choices=sorted(STORES), default="list", help="Message storage of each topic")
+    parser.add_argument("--memory-budget", type=float, default=None, help="MB of messages a tiered store keeps in memory before spilling to disk")
+    parser.add_argument("--dedup-window", type=int, default=1024, help="Recent sequence numbers remembered per producer")
+    parser.add_argument("--min-rto", type=float, default=0.1, help="Lower bound of per-neighbor forwarding timeouts, in seconds")
+    parser.add_argument("--session-timeout", type=float, default=10.0, help="Seconds a consumer group member stays without a heartbeat")
+    parser.add_argument("--claim-timeout", type=float, default=30.0, help="Seconds before fetched but uncommitted messages are handed out again")
+    parser.add_argument("--client-rate", type=float, default=0.0, help="PUBLISHes per second allowed per client address (0 disables)")
+    parser.add_argument("--client-burst", type=float, default=None, help="PUBLISHes a client address may send at once (defaults to the rate)")
+    parser.add_argument("--topic-rate", type=float, default=0.0, help="PUBLISHes per second allowed per topic at each entry node (0 disables)")
+    parser.add_argument("--topic-burst", type=float, default=None, help="PUBLISHes a topic may receive at once (defaults to the rate)")
+    parser.add_argument("--control-weight", type=int, default=4, help="Slots given to waiting control requests for each one given to data")
+    parser.add_argument("--control-reserve", type=int, default=None, help="Slots that only control requests may use (defaults to max-concurrent / 8)")
+    parser.add_argument("--slow-handler", type=float, default=0.05, help="Seconds a request may block the event loop before it is reported as slow")
+    parser.add_argument("--filter-bits", type=int, default=FILTER_BITS, help="Size of the topic filter gossiped to other nodes (0 disables)")
+    parser.add_argument("--max-parked", type=int, default=1024, help="Long-poll PULLs that may wait at once")
+    args = parser.parse_args()
 
-    node_id = sys.argv[1]
-    node = PeerNode(node_id)
+    node = PeerNode(args.node_id, args.max_concurrent, args.max_queue, args.max_queue_wait,
+                    args.data_dir, args.snapshot_interval, args.join, args.compression_threshold, args.store,
+                    args.dedup_window, args.min_rto, args.session_timeout, args.claim_timeout,
+                    args.client_rate, args.client_burst, args.topic_rate, args.topic_burst,
+                    args.control_weight, args.control_reserve, args.slow_handler,
+                    int(args.memory_budget * 1024 * 1024) if args.memory_budget is not None else None,
+                    args.filter_bits, args.max_parked)
     asyncio.run(node.start_server())
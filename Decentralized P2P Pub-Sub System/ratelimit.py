@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` saved up. One token per request."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait(self, now):
+        """Seconds until a token is available; 0 if one is available now."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class RateLimiter:
+    """Token buckets keyed by client or topic, for the `max_keys` most recently active keys.
+
+    A rate of 0 disables the limiter. A key whose bucket was evicted starts
+    again with a full bucket, which at worst lets an idle client burst again.
+    """
+
+    def __init__(self, rate=0.0, burst=None, max_keys=10000):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def bucket(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+def acquire(buckets, now):
+    """Take a token from every bucket, or from none of them.
+
+    Returns 0 on success, otherwise the seconds after which all of the buckets
+    will have a token again.
+    """
+    retry_after = max((bucket.wait(now) for bucket in buckets), default=0.0)
+    if retry_after == 0:
+        for bucket in buckets:
+            bucket.take()
+    return retry_after
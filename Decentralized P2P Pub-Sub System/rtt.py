@@ -0,0 +1,98 @@
+from collections import deque
+
+ALPHA = 1 / 8       # Gain of the smoothed RTT
+BETA = 1 / 4        # Gain of the RTT variation
+K = 4               # Variations added to the smoothed RTT to get the timeout
+GRANULARITY = 0.001 # Smallest variation term, in seconds
+WINDOW = 128        # Recent samples kept for latency percentiles
+MIN_SAMPLES = 20    # Samples needed before a percentile is trusted
+
+class RttEstimator:
+    """Retransmission timeout of one destination, computed the way TCP does (RFC 6298).
+
+    The smoothed RTT and its mean deviation are updated from every answered
+    request; the timeout is srtt + 4 * rttvar, clamped to [min_rto, max_rto].
+    A timeout doubles the current value until the next sample arrives, so a
+    destination that is slow rather than dead is not cut off repeatedly.
+    """
+
+    def __init__(self, initial_rto=1.0, min_rto=0.1, max_rto=10.0):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.samples = 0
+        self.timeouts = 0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.samples += 1
+        self.recent.append(rtt)
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + max(GRANULARITY, K * self.rttvar)))
+
+    def timed_out(self):
+        self.timeouts += 1
+        self.rto = min(self.max_rto, self.rto * 2)
+
+    def percentile(self, q):
+        """The q-quantile of the recent samples, or None while there are too few of them."""
+        if len(self.recent) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def report(self):
+        p95 = self.percentile(0.95)
+        return {
+            "srtt": round(self.srtt, 6) if self.srtt is not None else None,
+            "rttvar": round(self.rttvar, 6) if self.rttvar is not None else None,
+            "rto": round(self.rto, 6),
+            "p95": round(p95, 6) if p95 is not None else None,
+            "samples": self.samples,
+            "timeouts": self.timeouts,
+        }
+
+class RttTable:
+    """RTT estimators per destination and request kind.
+
+    Requests of different kinds take very different times to answer (a PULL of a
+    large topic versus a PING), so each kind gets its own estimate per destination.
+    """
+
+    def __init__(self, initial_rto=1.0, min_rto=0.1, max_rto=10.0):
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.estimators = {}
+
+    def get(self, destination, kind):
+        estimator = self.estimators.get((destination, kind))
+        if estimator is None:
+            estimator = self.estimators[(destination, kind)] = RttEstimator(self.initial_rto, self.min_rto, self.max_rto)
+        return estimator
+
+    def timeout(self, destination, kind):
+        return self.get(destination, kind).rto
+
+    def observe(self, destination, kind, rtt):
+        self.get(destination, kind).observe(rtt)
+
+    def timed_out(self, destination, kind):
+        self.get(destination, kind).timed_out()
+
+    def percentile(self, destination, kind, q):
+        return self.get(destination, kind).percentile(q)
+
+    def report(self):
+        """{destination: {kind: estimate}}"""
+        report = {}
+        for (destination, kind), estimator in sorted(self.estimators.items()):
+            report.setdefault(destination, {})[kind] = estimator.report()
+        return report
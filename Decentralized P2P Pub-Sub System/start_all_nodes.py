@@ -1,28 +1,26 @@
-import subprocess
+import argparse
 import time
+from cluster import start_cluster, stop_nodes
+from hypercube import ALL_NODES
 
-def start_all_nodes():
-    processes = []
-    # Start all 8 peer nodes (binary IDs from 000 to 111)
-    for i in range(8):
-        node_id = format(i, '03b')  # Generate binary IDs (000, 001, ..., 111)
-        print(f"Starting node {node_id}...")
-        # Run each peer node in a separate process
-        process = subprocess.Popen(['python', 'peer_node.py', node_id])
-        processes.append(process)
-        time.sleep(1)  # Small delay to stagger start times (optional)
-
+def start_all_nodes(node_ids=ALL_NODES):
+    # Start the requested peer nodes (by default all 8 binary IDs from 000 to 111); a subset joins through its first node
+    print(f"Starting nodes {', '.join(node_ids)}...")
+    processes = start_cluster(node_ids, quiet=False)
     print("All peer nodes are running.")
     return processes
 
 if __name__ == "__main__":
-    processes = start_all_nodes()
+    parser = argparse.ArgumentParser(description="Start a hypercube of peer nodes")
+    parser.add_argument("node_ids", nargs="*", default=ALL_NODES, help="IDs of the nodes to start (default: all 8)")
+    args = parser.parse_args()
+
+    processes = start_all_nodes(args.node_ids)
     try:
         # Keep the main script running so nodes continue to run
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         # Terminate all processes on script exit
-        for process in processes:
-            process.terminate()
+        stop_nodes(processes)
         print("All nodes have been stopped.")
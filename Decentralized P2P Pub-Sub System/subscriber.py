@@ -6,32 +6,58 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class Subscriber:
-    def __init__(self, peer_id):
+    def __init__(self, peer_id, follow=False, wait_ms=30000):
         self.api = ClientAPI(peer_id)
+        self.follow_topics = follow
+        self.wait_ms = wait_ms
 
     async def start(self):
         topics = ['News', 'Sports', 'Entertainment', 'Music']
 
         for topic in topics:
             logging.info(f"[Subscriber] Attempting to subscribe to topic: '{topic}'")
-            subscribe_response = await self.api.subscribe(topic)
+        subscribe_responses = await asyncio.gather(*[self.api.subscribe(topic) for topic in topics])
 
-            # Only proceed with pulling messages if subscription was successful
+        # Only pull messages for topics whose subscription was successful
+        subscribed = []
+        for topic, subscribe_response in zip(topics, subscribe_responses):
             if subscribe_response.get("status") == "Subscribed":
-                logging.info(f"[Subscriber] Pulling messages for topic: '{topic}'")
-                messages = await self.api.pull_messages(topic)
-                if messages:
-                    for msg in messages:
-                        logging.info(f"[Subscriber] Message on topic '{topic}': {msg}")
-                else:
-                    logging.info(f"[Subscriber] No messages available for topic '{topic}'")
+                subscribed.append(topic)
             else:
                 logging.info(f"[Subscriber] Topic '{topic}' does not exist or is unavailable")
 
+        if self.follow_topics:
+            await asyncio.gather(*[self.follow(topic, p) for topic in subscribed
+                                   for p in range(await self.api.partition_count(topic))])
+            return
+
+        logging.info(f"[Subscriber] Pulling messages for topics: {subscribed}")
+        pulled = await self.api.pull_many(subscribed)
+        for topic in subscribed:
+            if pulled[topic]:
+                for msg in pulled[topic]:
+                    logging.info(f"[Subscriber] Message on topic '{topic}': {msg}")
+            else:
+                logging.info(f"[Subscriber] No messages available for topic '{topic}'")
+
+    async def follow(self, topic, partition):
+        # Long-poll for new messages; the owner answers as soon as one arrives
+        logging.info(f"[Subscriber] Following topic '{topic}' partition {partition}")
+        offset = 0
+        while True:
+            messages, offset = await self.api.poll(topic, offset, self.wait_ms, partition=partition)
+            if offset is None:
+                logging.info(f"[Subscriber] Topic '{topic}' no longer exists")
+                return
+            for msg in messages:
+                logging.info(f"[Subscriber] Message on topic '{topic}': {msg}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Subscriber Configuration")
     parser.add_argument("peer_id", type=str, help="ID of the Peer Node to connect to (e.g., 000)")
+    parser.add_argument("--follow", action="store_true", help="Keep receiving new messages instead of pulling once")
+    parser.add_argument("--wait-ms", type=int, default=30000, help="How long each long poll may wait for a message when following")
     args = parser.parse_args()
 
-    subscriber = Subscriber(args.peer_id)
+    subscriber = Subscriber(args.peer_id, args.follow, args.wait_ms)
     asyncio.run(subscriber.start())
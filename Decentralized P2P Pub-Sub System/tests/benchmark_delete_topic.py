@@ -5,30 +5,14 @@ import asyncio
 import os
 import sys
 import matplotlib.pyplot as plt
-import subprocess
 
 # Ensure the tests can find the client API and other project files
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 
 from client_api import ClientAPI
-
-# Start a subprocess to run a PeerNode
-def start_peer_node(peer_id):
-    print(f"[LOG] Starting PeerNode with ID {peer_id}")
-    return subprocess.Popen(
-        [sys.executable, os.path.join(parent_dir, 'peer_node.py'), peer_id],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-
-# Stop the server process
-def stop_server(server_process):
-    server_process.terminate()
-    try:
-        server_process.wait(timeout=3)
-    except subprocess.TimeoutExpired:
-        server_process.kill()
+from cluster import running_cluster
+from hypercube import ALL_NODES
 
 # Ensure the directories exist for storing CSV and graph files
 def ensure_directory_exists(directory):
@@ -75,42 +59,28 @@ def run_delete_topic_benchmark(num_peers, num_topics, csv_filename):
         writer = csv.writer(file)
         writer.writerow(["Number of Peers", "Number of Topics", "Throughput (topics/second)", "Average Latency (seconds)"])
 
-        # Start the required number of peer nodes and give them time to start up
-        peer_processes = []
-        for i in range(num_peers):
-            peer_id = format(i, '03b')  # Binary ID (e.g., "000", "001", etc.)
-            peer_process = start_peer_node(peer_id)
-            peer_processes.append(peer_process)
-            time.sleep(5)  # Increased delay to ensure each peer starts properly
-
-        # Delay to ensure all peers are fully initialized before benchmarking
-        time.sleep(5)
-
-        # Run benchmark for each peer count
-        for peer_count in range(1, num_peers + 1):
-            total_throughput = 0
-            total_latency = 0
-
-            print(f"[LOG] Running benchmark with {peer_count} peers...")
+        with running_cluster(ALL_NODES[:num_peers]):
+            # Run benchmark for each peer count
+            for peer_count in range(1, num_peers + 1):
+                total_throughput = 0
+                total_latency = 0
 
-            # Run benchmark for each peer
-            for i in range(peer_count):
-                peer_id = format(i, '03b')
+                print(f"[LOG] Running benchmark with {peer_count} peers...")
 
-                # Run benchmark asynchronously with extended timeout and delay
-                throughput, avg_latency = asyncio.run(benchmark_delete_topic(peer_id, num_topics))
+                # Run benchmark for each peer
+                for i in range(peer_count):
+                    peer_id = format(i, '03b')
 
-                total_throughput += throughput
-                total_latency += avg_latency
+                    # Run benchmark asynchronously with extended timeout and delay
+                    throughput, avg_latency = asyncio.run(benchmark_delete_topic(peer_id, num_topics))
 
-            avg_throughput = total_throughput / peer_count
-            avg_latency = total_latency / peer_count
-            print(f"[LOG] Benchmark result for {peer_count} peers: {num_topics} topics, Throughput: {avg_throughput:.2f} topics/sec, Avg Latency: {avg_latency:.6f} sec")
-            writer.writerow([peer_count, num_topics, avg_throughput, avg_latency])
+                    total_throughput += throughput
+                    total_latency += avg_latency
 
-        # Stop all peers after the benchmark
-        for peer_process in peer_processes:
-            stop_server(peer_process)
+                avg_throughput = total_throughput / peer_count
+                avg_latency = total_latency / peer_count
+                print(f"[LOG] Benchmark result for {peer_count} peers: {num_topics} topics, Throughput: {avg_throughput:.2f} topics/sec, Avg Latency: {avg_latency:.6f} sec")
+                writer.writerow([peer_count, num_topics, avg_throughput, avg_latency])
 
 # Plot the results from the CSV file
 def plot_delete_topic_graph(csv_filename, throughput_graph_filename, latency_graph_filename):
@@ -1,31 +1,18 @@
 import csv
+import random
 import time
 import uuid
 import asyncio
 import os
 import sys
 import matplotlib.pyplot as plt
-import subprocess
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 
 from client_api import ClientAPI
-
-def start_peer_node(peer_id):
-    print(f"[LOG] Starting PeerNode with ID {peer_id}")
-    return subprocess.Popen(
-        [sys.executable, os.path.join(parent_dir, 'peer_node.py'), peer_id],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-
-def stop_server(server_process):
-    server_process.terminate()
-    try:
-        server_process.wait(timeout=3)
-    except subprocess.TimeoutExpired:
-        server_process.kill()
+from cluster import running_cluster
+from hypercube import ALL_NODES
 
 def ensure_directory_exists(directory):
     if not os.path.exists(directory):
@@ -68,45 +55,83 @@ def run_pull_messages_benchmark(num_peers, num_pulls, num_publish_messages, csv_
         writer = csv.writer(file)
         writer.writerow(["Number of Peers", "Number of Pulls", "Throughput (pulls/second)", "Average Latency (seconds)"])
 
-        peer_processes = []
-        for i in range(num_peers):
-            peer_id = format(i, '03b')
-            peer_process = start_peer_node(peer_id)
-            peer_processes.append(peer_process)
-            time.sleep(3)
-
-        time.sleep(5)
-
-        for peer_count in range(1, num_peers + 1):
-            total_throughput = 0
-            total_latency = 0
+        with running_cluster(ALL_NODES[:num_peers]):
+            for peer_count in range(1, num_peers + 1):
+                total_throughput = 0
+                total_latency = 0
 
-            print(f"[LOG] Running pull messages benchmark with {peer_count} peers...")
+                print(f"[LOG] Running pull messages benchmark with {peer_count} peers...")
 
-            for i in range(peer_count):
-                peer_id = format(i, '03b')
-                topic_name = f"topic_{uuid.uuid4()}"  # Unique topic for each benchmark run
-                message_content = f"test_message_{uuid.uuid4()}"
+                for i in range(peer_count):
+                    peer_id = format(i, '03b')
+                    topic_name = f"topic_{uuid.uuid4()}"  # Unique topic for each benchmark run
+                    message_content = f"test_message_{uuid.uuid4()}"
                 
-                # Pre-create the topic and publish messages before pulling
-                client = ClientAPI(peer_id)
-                asyncio.run(client.create_topic(topic_name))
-                for _ in range(num_publish_messages):
-                    asyncio.run(client.send_message(topic_name, message_content))
-
-                # Run pull_messages benchmark asynchronously with extended timeout and delay
-                throughput, avg_latency = asyncio.run(benchmark_pull_messages(peer_id, topic_name, num_pulls))
-
-                total_throughput += throughput
-                total_latency += avg_latency
-
-            avg_throughput = total_throughput / peer_count
-            avg_latency = total_latency / peer_count
-            print(f"[LOG] Benchmark result for {peer_count} peers: {num_pulls} pulls, Throughput: {avg_throughput:.2f} pulls/sec, Avg Latency: {avg_latency:.6f} sec")
-            writer.writerow([peer_count, num_pulls, avg_throughput, avg_latency])
-
-        for peer_process in peer_processes:
-            stop_server(peer_process)
+                    # Pre-create the topic and publish messages before pulling
+                    client = ClientAPI(peer_id)
+                    asyncio.run(client.create_topic(topic_name))
+                    for _ in range(num_publish_messages):
+                        asyncio.run(client.send_message(topic_name, message_content))
+
+                    # Run pull_messages benchmark asynchronously with extended timeout and delay
+                    throughput, avg_latency = asyncio.run(benchmark_pull_messages(peer_id, topic_name, num_pulls))
+
+                    total_throughput += throughput
+                    total_latency += avg_latency
+
+                avg_throughput = total_throughput / peer_count
+                avg_latency = total_latency / peer_count
+                print(f"[LOG] Benchmark result for {peer_count} peers: {num_pulls} pulls, Throughput: {avg_throughput:.2f} pulls/sec, Avg Latency: {avg_latency:.6f} sec")
+                writer.writerow([peer_count, num_pulls, avg_throughput, avg_latency])
+
+# Delivery delay of messages published at random times, and PULL requests spent, for a
+# subscriber polling every poll_interval seconds versus one long-polling with wait_ms
+async def benchmark_delivery(peer_id, topic_name, num_messages, poll_interval=2, wait_ms=30000, max_gap=1.0):
+    publisher = ClientAPI(peer_id)
+    await publisher.create_topic(topic_name)
+    published_at = {}
+    results = {}
+
+    async def publish():
+        for i in range(num_messages):
+            await asyncio.sleep(random.uniform(0, max_gap))
+            published_at[i] = time.time()
+            await publisher.send_message(topic_name, i)
+
+    async def poll_loop():
+        client, seen, delays, requests = ClientAPI(peer_id), 0, [], 0
+        while seen < num_messages:
+            messages = await client.pull_messages(topic_name)
+            requests += 1
+            for i in messages[seen:]:
+                delays.append(time.time() - published_at[i])
+            seen = len(messages)
+            if seen < num_messages:
+                await asyncio.sleep(poll_interval)
+        return delays, requests
+
+    async def long_poll_loop():
+        client, offset, delays, requests = ClientAPI(peer_id), 0, [], 0
+        while len(delays) < num_messages:
+            messages, offset = await client.poll(topic_name, offset, wait_ms)
+            requests += 1
+            for i in messages:
+                delays.append(time.time() - published_at[i])
+        return delays, requests
+
+    _, results["poll"], results["long_poll"] = await asyncio.gather(publish(), poll_loop(), long_poll_loop())
+    for mode, (delays, requests) in results.items():
+        print(f"[LOG] {mode}: {requests} PULL requests, average delivery delay {sum(delays) / len(delays):.6f} sec")
+    return results
+
+def run_delivery_benchmark(num_messages, csv_filename):
+    ensure_directory_exists("data")
+    with running_cluster(ALL_NODES), open(csv_filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Mode", "Messages", "PULL Requests", "Average Delivery Delay (seconds)"])
+        results = asyncio.run(benchmark_delivery("000", f"topic_{uuid.uuid4()}", num_messages))
+        for mode, (delays, requests) in results.items():
+            writer.writerow([mode, num_messages, requests, sum(delays) / len(delays)])
 
 def plot_pull_messages_graph(csv_filename, throughput_graph_filename, latency_graph_filename):
     num_peers = []
@@ -149,3 +174,4 @@ if __name__ == "__main__":
 
     run_pull_messages_benchmark(num_peers, num_pulls, num_publish_messages, csv_filename)
     plot_pull_messages_graph(csv_filename, throughput_graph_filename, latency_graph_filename)
+    run_delivery_benchmark(20, "data/pull_delivery_benchmark.csv")
@@ -5,27 +5,13 @@ import asyncio
 import os
 import sys
 import matplotlib.pyplot as plt
-import subprocess
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 
 from client_api import ClientAPI
-
-def start_peer_node(peer_id):
-    print(f"[LOG] Starting PeerNode with ID {peer_id}")
-    return subprocess.Popen(
-        [sys.executable, os.path.join(parent_dir, 'peer_node.py'), peer_id],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-
-def stop_server(server_process):
-    server_process.terminate()
-    try:
-        server_process.wait(timeout=3)
-    except subprocess.TimeoutExpired:
-        server_process.kill()
+from cluster import running_cluster
+from hypercube import ALL_NODES
 
 def ensure_directory_exists(directory):
     if not os.path.exists(directory):
@@ -72,35 +58,24 @@ def run_subscribe_benchmark(num_peers, num_topics, csv_filename):
         writer = csv.writer(file)
         writer.writerow(["Number of Peers", "Number of Topics", "Throughput (subscriptions/second)", "Average Latency (seconds)"])
 
-        peer_processes = []
-        for i in range(num_peers):
-            peer_id = format(i, '03b')
-            peer_process = start_peer_node(peer_id)
-            peer_processes.append(peer_process)
-            time.sleep(3)
-
-        time.sleep(5)
-
-        for peer_count in range(1, num_peers + 1):
-            total_throughput = 0
-            total_latency = 0
-
-            print(f"[LOG] Running benchmark with {peer_count} peers...")
+        with running_cluster(ALL_NODES[:num_peers]):
+            for peer_count in range(1, num_peers + 1):
+                total_throughput = 0
+                total_latency = 0
 
-            for i in range(peer_count):
-                peer_id = format(i, '03b')
-                throughput, avg_latency = asyncio.run(benchmark_subscribe(peer_id, num_topics))
+                print(f"[LOG] Running benchmark with {peer_count} peers...")
 
-                total_throughput += throughput
-                total_latency += avg_latency
+                for i in range(peer_count):
+                    peer_id = format(i, '03b')
+                    throughput, avg_latency = asyncio.run(benchmark_subscribe(peer_id, num_topics))
 
-            avg_throughput = total_throughput / peer_count
-            avg_latency = total_latency / peer_count
-            print(f"[LOG] Benchmark result for {peer_count} peers: {num_topics} topics, Throughput: {avg_throughput:.2f} subscriptions/sec, Avg Latency: {avg_latency:.6f} sec")
-            writer.writerow([peer_count, num_topics, avg_throughput, avg_latency])
+                    total_throughput += throughput
+                    total_latency += avg_latency
 
-        for peer_process in peer_processes:
-            stop_server(peer_process)
+                avg_throughput = total_throughput / peer_count
+                avg_latency = total_latency / peer_count
+                print(f"[LOG] Benchmark result for {peer_count} peers: {num_topics} topics, Throughput: {avg_throughput:.2f} subscriptions/sec, Avg Latency: {avg_latency:.6f} sec")
+                writer.writerow([peer_count, num_topics, avg_throughput, avg_latency])
 
 def plot_subscribe_graph(csv_filename, throughput_graph_filename, latency_graph_filename):
     num_peers = []
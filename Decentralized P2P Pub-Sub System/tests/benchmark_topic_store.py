@@ -0,0 +1,102 @@
+import csv
+import json
+import os
+import sys
+import time
+import tracemalloc
+import matplotlib.pyplot as plt
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from topic_store import STORES
+
+def ensure_directory_exists(directory):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+def make_payload(i, size):
+    """A text payload of roughly `size` bytes, unique per message like real events."""
+    prefix = f"event-{i}:"
+    return prefix + "x" * max(0, size - len(prefix))
+
+# Measure the memory cost of one stored message for a topic store
+def measure_bytes_per_message(store_name, num_messages, payload_size):
+    payloads = [make_payload(i, payload_size) for i in range(num_messages)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = STORES[store_name]()
+    for payload in payloads:
+        # Copy so the list store owns its strings, as it would after decoding a request
+        store.append(payload.encode().decode())
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return store, (after - before) / num_messages
+
+# Measure how fast PULL replies can be built from a topic store
+def measure_pull_throughput(store, num_pulls):
+    start_time = time.perf_counter()
+    for _ in range(num_pulls):
+        # What PeerNode does for a PULL: slice the topic and encode the reply
+        json.dumps({"messages": store[:]})
+    end_time = time.perf_counter()
+    return num_pulls * len(store) / (end_time - start_time)
+
+def run_topic_store_benchmark(message_counts, payload_size, num_pulls, csv_filename):
+    ensure_directory_exists("data")
+    with open(csv_filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Store", "Number of Messages", "Bytes per Message", "Pull Throughput (messages/second)"])
+
+        for num_messages in message_counts:
+            for store_name in STORES:
+                store, bytes_per_message = measure_bytes_per_message(store_name, num_messages, payload_size)
+                throughput = measure_pull_throughput(store, num_pulls)
+                print(f"[LOG] {store_name} store, {num_messages} messages: {bytes_per_message:.1f} bytes/message, pull throughput {throughput:.0f} messages/sec")
+                writer.writerow([store_name, num_messages, f"{bytes_per_message:.1f}", f"{throughput:.0f}"])
+
+def plot_topic_store_results(csv_filename, memory_graph_filename, throughput_graph_filename):
+    results = {}
+    with open(csv_filename, 'r') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            series = results.setdefault(row['Store'], {'messages': [], 'bytes': [], 'throughput': []})
+            series['messages'].append(int(row['Number of Messages']))
+            series['bytes'].append(float(row['Bytes per Message']))
+            series['throughput'].append(float(row['Pull Throughput (messages/second)']))
+
+    ensure_directory_exists("graphs")
+    plt.figure()
+    for store_name, series in results.items():
+        plt.plot(series['messages'], series['bytes'], label=f"{store_name} store", marker='o')
+    plt.xscale('log')
+    plt.xlabel("Number of Messages")
+    plt.ylabel("Bytes per Message")
+    plt.title("Topic Store Memory per Message")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(memory_graph_filename)
+    plt.show()
+
+    plt.figure()
+    for store_name, series in results.items():
+        plt.plot(series['messages'], series['throughput'], label=f"{store_name} store", marker='o')
+    plt.xscale('log')
+    plt.xlabel("Number of Messages")
+    plt.ylabel("Pull Throughput (Messages/Second)")
+    plt.title("Topic Store Pull Throughput")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(throughput_graph_filename)
+    plt.show()
+
+if __name__ == "__main__":
+    message_counts = [1000, 10000, 100000]
+    payload_size = 60  # Typical event payload in bytes
+    num_pulls = 5
+    csv_filename = "data/topic_store_benchmark.csv"
+    memory_graph_filename = "graphs/topic_store_bytes_per_message.png"
+    throughput_graph_filename = "graphs/topic_store_pull_throughput.png"
+
+    run_topic_store_benchmark(message_counts, payload_size, num_pulls, csv_filename)
+    plot_topic_store_results(csv_filename, memory_graph_filename, throughput_graph_filename)
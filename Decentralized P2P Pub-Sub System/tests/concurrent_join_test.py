@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+
+# Ensure the tests can find the client API and other project files
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from client_api import ClientAPI
+from cluster import start_cluster, start_nodes, stop_nodes, wait_until_ready
+
+INITIAL_NODES = ["000", "001", "010", "011"]
+JOINING_NODES = ["100", "101", "110"]
+TOPICS = 20
+MESSAGES = 30
+
+async def fill_topics(client):
+    for i in range(TOPICS):
+        await client.create_topic(f"join_topic_{i}")
+        for j in range(MESSAGES):
+            await client.send_message(f"join_topic_{i}", f"message {j}")
+
+async def wait_for_handoffs(client, nodes, timeout=15.0):
+    # Every node holds all of its topics once none of them is still streaming or passing one on
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = [await client.get_stats(node) for node in nodes]
+        if all(not s["handoff_sources"] and not any(s["handoff_topics"].values()) for s in stats):
+            return
+        await asyncio.sleep(0.2)
+    raise TimeoutError("Handoffs did not finish")
+
+async def count_messages(client):
+    return {f"join_topic_{i}": len(await client.pull_messages(f"join_topic_{i}")) for i in range(TOPICS)}
+
+def test_concurrent_joins():
+    """Nodes joining at the same time must each receive their topics exactly once."""
+    processes = start_cluster(INITIAL_NODES)
+    try:
+        client = ClientAPI("000")
+        asyncio.run(fill_topics(client))
+
+        # All joiners start together and learn the membership from the same seed
+        joined = start_nodes(JOINING_NODES, ("--join", "000"))
+        processes.update(joined)
+        wait_until_ready(joined)
+        asyncio.run(wait_for_handoffs(client, INITIAL_NODES + JOINING_NODES))
+
+        counts = asyncio.run(count_messages(client))
+        wrong = {topic: count for topic, count in counts.items() if count != MESSAGES}
+        assert not wrong, f"Topics with the wrong number of messages: {wrong}"
+        print(f"[LOG] All {TOPICS} topics hold exactly {MESSAGES} messages after {len(JOINING_NODES)} concurrent joins")
+    finally:
+        stop_nodes(processes)
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    test_concurrent_joins()
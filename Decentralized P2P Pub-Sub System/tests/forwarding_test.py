@@ -5,28 +5,14 @@ import asyncio
 import os
 import sys
 import matplotlib.pyplot as plt
-import subprocess
 
 # Ensure the tests can find the client API and other project files
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 
 from client_api import ClientAPI
-
-def start_peer_node(peer_id):
-    print(f"[LOG] Starting PeerNode with ID {peer_id}")
-    return subprocess.Popen(
-        [sys.executable, os.path.join(parent_dir, 'peer_node.py'), peer_id],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-
-def stop_server(server_process):
-    server_process.terminate()
-    try:
-        server_process.wait(timeout=3)
-    except subprocess.TimeoutExpired:
-        server_process.kill()
+from cluster import running_cluster
+from hypercube import ALL_NODES
 
 def ensure_directory_exists(directory):
     if not os.path.exists(directory):
@@ -66,59 +52,48 @@ def run_forwarding_benchmark(num_peers, num_trials, csv_filename):
         writer = csv.writer(file)
         writer.writerow(["Number of Peers", "Average Latency (seconds)", "Max Throughput (requests/second)"])
 
-        peer_processes = []
-        for i in range(num_peers):
-            peer_id = format(i, '03b')  # Binary ID
-            peer_process = start_peer_node(peer_id)
-            peer_processes.append(peer_process)
-            time.sleep(1)
-
-        time.sleep(5)  # Wait for all peers to initialize
-
-        for peer_count in range(1, num_peers + 1):
-            avg_latencies = []
-            throughputs = []
-            print(f"[LOG] Running request forwarding benchmark with {peer_count} peers for {num_trials} trials...")
-
-            for _ in range(num_trials):
-                total_latencies = []
-                start_benchmark = time.time()
-
-                # Set up a topic on each peer
-                topic_name = f"topic_{uuid.uuid4()}"
-                asyncio.run(setup_topic_for_peer("000", topic_name))
-                time.sleep(1)
-
-                # Forwarding requests across all peer pairs
-                for i in range(peer_count):
-                    for j in range(peer_count):
-                        if i != j:  # Skip self-access
-                            requesting_peer = format(i, '03b')
-                            target_peer = format(j, '03b')
-                            latency = asyncio.run(benchmark_forwarding(requesting_peer, target_peer, topic_name))
-                            total_latencies.append(latency)
-
-                end_benchmark = time.time()
-                benchmark_duration = end_benchmark - start_benchmark
-                avg_latency = sum(total_latencies) / len(total_latencies) if total_latencies else float('inf')
-                avg_latencies.append(avg_latency)
-
-                # Calculate throughput only if the benchmark duration is non-zero
-                if benchmark_duration > 0:
-                    max_throughput = len(total_latencies) / benchmark_duration
-                    throughputs.append(max_throughput)
-                else:
-                    throughputs.append(0)
-
-            # Calculate average results over trials
-            avg_latency_across_trials = sum(avg_latencies) / len(avg_latencies) if avg_latencies else float('inf')
-            avg_throughput_across_trials = sum(throughputs) / len(throughputs) if throughputs else 0
-
-            print(f"[LOG] Results for {peer_count} peers - Avg Latency: {avg_latency_across_trials:.4f}s, Max Throughput: {avg_throughput_across_trials:.2f} req/s")
-            writer.writerow([peer_count, f"{avg_latency_across_trials:.4f}", f"{avg_throughput_across_trials:.2f}"])
-
-        for peer_process in peer_processes:
-            stop_server(peer_process)
+        with running_cluster(ALL_NODES[:num_peers]):
+            for peer_count in range(1, num_peers + 1):
+                avg_latencies = []
+                throughputs = []
+                print(f"[LOG] Running request forwarding benchmark with {peer_count} peers for {num_trials} trials...")
+
+                for _ in range(num_trials):
+                    total_latencies = []
+                    start_benchmark = time.time()
+
+                    # Set up a topic on each peer
+                    topic_name = f"topic_{uuid.uuid4()}"
+                    asyncio.run(setup_topic_for_peer("000", topic_name))
+                    time.sleep(1)
+
+                    # Forwarding requests across all peer pairs
+                    for i in range(peer_count):
+                        for j in range(peer_count):
+                            if i != j:  # Skip self-access
+                                requesting_peer = format(i, '03b')
+                                target_peer = format(j, '03b')
+                                latency = asyncio.run(benchmark_forwarding(requesting_peer, target_peer, topic_name))
+                                total_latencies.append(latency)
+
+                    end_benchmark = time.time()
+                    benchmark_duration = end_benchmark - start_benchmark
+                    avg_latency = sum(total_latencies) / len(total_latencies) if total_latencies else float('inf')
+                    avg_latencies.append(avg_latency)
+
+                    # Calculate throughput only if the benchmark duration is non-zero
+                    if benchmark_duration > 0:
+                        max_throughput = len(total_latencies) / benchmark_duration
+                        throughputs.append(max_throughput)
+                    else:
+                        throughputs.append(0)
+
+                # Calculate average results over trials
+                avg_latency_across_trials = sum(avg_latencies) / len(avg_latencies) if avg_latencies else float('inf')
+                avg_throughput_across_trials = sum(throughputs) / len(throughputs) if throughputs else 0
+
+                print(f"[LOG] Results for {peer_count} peers - Avg Latency: {avg_latency_across_trials:.4f}s, Max Throughput: {avg_throughput_across_trials:.2f} req/s")
+                writer.writerow([peer_count, f"{avg_latency_across_trials:.4f}", f"{avg_throughput_across_trials:.2f}"])
 
 def plot_forwarding_results(csv_filename, latency_graph_filename, throughput_graph_filename):
     num_peers = []
@@ -4,7 +4,6 @@ import asyncio
 import os
 import sys
 import uuid
-import subprocess
 import matplotlib.pyplot as plt
 
 # Ensure the tests can find the client API and other project files
@@ -12,14 +11,7 @@ parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 
 from client_api import ClientAPI
-
-def start_peer_node(node_id):
-    """Start a peer node process with the given node ID."""
-    return subprocess.Popen(
-        [sys.executable, os.path.join(parent_dir, 'peer_node.py'), node_id],
-        stdout=None,  # Redirect to None to avoid buffer issues
-        stderr=None
-    )
+from cluster import start_cluster, stop_nodes
 
 def hash_topic_md5(topic):
     """Hash topic using MD5 to generate a binary ID for DHT."""
@@ -56,12 +48,10 @@ async def setup_topics_with_hash_function(client_apis, hash_function, retries=3,
 
 async def run_hash_function_experiment():
     # Start peer nodes and create ClientAPI instances for each
-    peer_processes = [start_peer_node(format(i, '03b')) for i in range(8)]
+    # Returns once every node answers its readiness probe
+    peer_processes = start_cluster(quiet=False)
     client_apis = [ClientAPI(format(i, '03b')) for i in range(8)]
 
-    # Allow time for nodes to initialize
-    await asyncio.sleep(8)
-
     try:
         # Experiment with MD5
         md5_distribution, md5_latency = await setup_topics_with_hash_function(client_apis, hash_topic_md5)
@@ -79,9 +69,7 @@ async def run_hash_function_experiment():
         plot_results(md5_distribution, md5_latency, sha256_distribution, sha256_latency)
     finally:
         # Terminate peer node processes
-        for process in peer_processes:
-            process.terminate()
-            process.wait()
+        stop_nodes(peer_processes)
 
 def plot_results(md5_distribution, md5_latency, sha256_distribution, sha256_latency):
     nodes = list(md5_distribution.keys())
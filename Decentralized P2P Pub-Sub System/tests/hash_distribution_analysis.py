@@ -0,0 +1,154 @@
+import argparse
+import csv
+import hashlib
+import math
+import os
+import sys
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from hypercube import ALL_NODES, xor_distance
+
+def ensure_directory_exists(directory):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+def topic_names(count, kind, seed):
+    """Topic names like the benchmarks use: sequential 'topic_<i>' or random hex suffixes."""
+    if kind == "sequential":
+        return [f"topic_{i}" for i in range(count)]
+    rng = np.random.default_rng(seed)
+    return [f"topic_{value:016x}" for value in rng.integers(0, 2 ** 63, size=count).tolist()]
+
+def digest_words(names, algorithm):
+    """Digest every name and return the digests as big-endian 64-bit words, one row per name.
+
+    Hashing itself has to go through hashlib one name at a time; everything after
+    this point is vectorized.
+    """
+    digests = b"".join(hashlib.new(algorithm, name.encode()).digest() for name in names)
+    return np.frombuffer(digests, dtype='>u8').reshape(len(names), -1).astype(np.uint64)
+
+def digest_mod(words, n):
+    """The full digest, read as one big integer, modulo n, as hash_topic computes it.
+
+    Evaluated word by word with Horner's rule: r = (r * 2^64 + word) mod n.
+    Every intermediate value stays below n^2, so this is exact for any n < 2^32.
+    """
+    n = np.uint64(n)
+    shift = np.uint64((2 ** 64) % int(n))
+    remainder = np.zeros(len(words), dtype=np.uint64)
+    for column in range(words.shape[1]):
+        remainder = (remainder * shift + words[:, column] % n) % n
+    return remainder
+
+def xor_owner_table(size):
+    """Owner of each of the 8 hypercube keys when only the first `size` nodes are live."""
+    live = ALL_NODES[:size]
+    owners = [min(live, key=lambda node: xor_distance(key, node)) for key in ALL_NODES]
+    return np.array([live.index(owner) for owner in owners], dtype=np.int64)
+
+def place(strategy, words_sha256, words_md5, size, partitions):
+    """Node index (0..size-1) of every unit of load under a placement strategy."""
+    if strategy == "sha256-mod":
+        return digest_mod(words_sha256, size).astype(np.int64)
+    if strategy == "md5-mod":
+        return digest_mod(words_md5, size).astype(np.int64)
+
+    # The hypercube itself: keys are hash mod 8 and belong to the nearest live node by XOR
+    keys = digest_mod(words_sha256, 8).astype(np.int64)
+    table = xor_owner_table(size)
+    if strategy == "hypercube-xor":
+        return table[keys]
+    if strategy == "hypercube-partitioned":
+        # Every partition of a topic is one unit of load, on consecutive keys
+        return table[(keys[:, None] + np.arange(partitions)) % 8].ravel()
+    raise ValueError(f"Unknown strategy {strategy}")
+
+def imbalance(counts):
+    """Load statistics of one placement: max/mean, coefficient of variation and chi-square."""
+    counts = counts.astype(np.float64)
+    mean = counts.mean()
+    expected = counts.sum() / len(counts)
+    chi_square = float(((counts - expected) ** 2 / expected).sum())
+    dof = len(counts) - 1
+    return {
+        "max_over_mean": float(counts.max() / mean),
+        "cv": float(counts.std() / mean),
+        "chi_square": chi_square,
+        "dof": dof,
+        "p_value": chi_square_p_value(chi_square, dof),
+    }
+
+def chi_square_p_value(chi_square, dof):
+    """Upper tail of the chi-square distribution (Wilson-Hilferty approximation)."""
+    if dof <= 0:
+        return 1.0
+    z = ((chi_square / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def run_analysis(num_topics, sizes, strategies, name_kind, partitions, seed, csv_filename):
+    print(f"Hashing {num_topics} topic names ({name_kind})...")
+    names = topic_names(num_topics, name_kind, seed)
+    start_time = time.perf_counter()
+    words_sha256 = digest_words(names, "sha256")
+    words_md5 = digest_words(names, "md5")
+    hash_time = time.perf_counter() - start_time
+    print(f"Hashed {num_topics} topics twice in {hash_time:.2f}s ({2 * num_topics / hash_time:.0f} hashes/second)")
+
+    results = []
+    for strategy in strategies:
+        for size in sizes:
+            if strategy.startswith("hypercube") and size > len(ALL_NODES):
+                continue
+            start_time = time.perf_counter()
+            counts = np.bincount(place(strategy, words_sha256, words_md5, size, partitions), minlength=size)
+            elapsed = time.perf_counter() - start_time
+            stats = imbalance(counts)
+            results.append({"strategy": strategy, "nodes": size, "units": int(counts.sum()), "seconds": elapsed, **stats})
+            print(f"[LOG] {strategy:<22} nodes={size:<3} max/mean={stats['max_over_mean']:.4f} "
+                  f"cv={stats['cv']:.5f} chi2={stats['chi_square']:.1f} (dof {stats['dof']}, p={stats['p_value']:.3f})")
+
+    ensure_directory_exists(os.path.dirname(csv_filename))
+    with open(csv_filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Strategy", "Nodes", "Load Units", "Max/Mean", "CV", "Chi-Square", "DoF", "P-Value", "Placement Seconds"])
+        for r in results:
+            writer.writerow([r["strategy"], r["nodes"], r["units"], f"{r['max_over_mean']:.6f}", f"{r['cv']:.6f}",
+                             f"{r['chi_square']:.3f}", r["dof"], f"{r['p_value']:.4f}", f"{r['seconds']:.4f}"])
+    return results
+
+def plot_results(results, graph_filename):
+    ensure_directory_exists(os.path.dirname(graph_filename))
+    plt.figure(figsize=(10, 5))
+    for strategy in dict.fromkeys(r["strategy"] for r in results):
+        rows = [r for r in results if r["strategy"] == strategy]
+        plt.plot([r["nodes"] for r in rows], [r["max_over_mean"] for r in rows], marker='o', label=strategy)
+    plt.xlabel("Number of Nodes")
+    plt.ylabel("Max / Mean Load")
+    plt.title("Load Imbalance by Placement Strategy and Cluster Size")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(graph_filename)
+    plt.show()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Topic placement balance across strategies and cluster sizes")
+    parser.add_argument("--topics", type=int, default=2_000_000, help="Number of topic names to hash")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 3, 4, 5, 6, 7, 8, 16, 64], help="Cluster sizes to evaluate")
+    parser.add_argument("--strategies", nargs="+", default=["sha256-mod", "md5-mod", "hypercube-xor", "hypercube-partitioned"],
+                        help="Placement strategies to compare")
+    parser.add_argument("--names", choices=["sequential", "random"], default="sequential", help="How topic names are generated")
+    parser.add_argument("--partitions", type=int, default=4, help="Partitions per topic for hypercube-partitioned")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for random topic names")
+    parser.add_argument("--no-plot", action="store_true", help="Only print and write the CSV")
+    args = parser.parse_args()
+
+    results = run_analysis(args.topics, args.sizes, args.strategies, args.names, args.partitions, args.seed,
+                           "data/hash_distribution.csv")
+    if not args.no_plot:
+        plot_results(results, "graphs/hash_distribution_imbalance.png")
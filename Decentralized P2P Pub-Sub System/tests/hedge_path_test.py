@@ -0,0 +1,54 @@
+import os
+import sys
+
+# Ensure the tests can find the hypercube module and other project files
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from hypercube import ALL_NODES, dimension_orders, next_hops, route_in_order
+
+def follow(source, target, order, live_nodes=ALL_NODES):
+    """Nodes a request visits when every node forwards it to its first candidate, as relays do."""
+    path, current = [], source
+    while current != target:
+        current, order = next_hops(current, target, live_nodes, order)[0]
+        path.append(current)
+    return path
+
+def test_paths_are_disjoint():
+    """The paths of a request and its hedges share no node besides their ends."""
+    for source in ALL_NODES:
+        for target in ALL_NODES:
+            if source == target:
+                continue
+            paths = [route_in_order(source, order) for order in dimension_orders(source, target)]
+            for i, path in enumerate(paths):
+                assert path[-1] == target, f"{source} -> {target}: path {path} misses the target"
+                for other in paths[i + 1:]:
+                    shared = set(path[:-1]) & set(other[:-1])
+                    assert not shared, f"{source} -> {target}: {path} and {other} share {sorted(shared)}"
+    print("[LOG] Hedged paths are node-disjoint for every pair of nodes")
+
+def test_relays_keep_the_order():
+    """A relay continues along the dimension order the request arrived with."""
+    for source in ALL_NODES:
+        for target in ALL_NODES:
+            if source == target:
+                continue
+            for neighbor, order in next_hops(source, target, ALL_NODES):
+                if not order:
+                    continue  # The target itself, reached directly as a last resort
+                expected = route_in_order(source, order)
+                assert [neighbor] + follow(neighbor, target, order) == expected, \
+                    f"{source} -> {target} via {neighbor} left the path {expected}"
+    print("[LOG] Relays forward along the path chosen by the entry node")
+
+def test_example_paths():
+    paths = [route_in_order("000", order) for order in dimension_orders("000", "111")]
+    assert paths == [["100", "110", "111"], ["010", "011", "111"], ["001", "101", "111"]], paths
+    print(f"[LOG] Paths from 000 to 111: {paths}")
+
+if __name__ == "__main__":
+    test_paths_are_disjoint()
+    test_relays_keep_the_order()
+    test_example_paths()
@@ -0,0 +1,39 @@
+import asyncio
+import logging
+import os
+import sys
+import uuid
+
+# Ensure the tests can find the client API and other project files
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+
+from client_api import ClientAPI
+from cluster import running_cluster
+from wire import request
+
+BURST = 5
+
+async def publish_with_new_ids(count):
+    # Every PUBLISH claims to come from a different producer
+    statuses = []
+    for i in range(count):
+        response = await request("localhost", 8000, {"command": "PUBLISH", "topic": "flood", "message": f"message {i}",
+                                                     "producer_id": uuid.uuid4().hex, "seq": 1})
+        statuses.append(response.get("status"))
+    return statuses
+
+async def run_test():
+    await ClientAPI("000").create_topic("flood")
+    statuses = await publish_with_new_ids(4 * BURST)
+    limited = statuses.count("Rate limited")
+    print(f"[LOG] {limited} of {len(statuses)} PUBLISHes with changing producer IDs were rate limited")
+    assert limited >= 2 * BURST, "Changing the producer ID must not reset the client's rate limit"
+
+def test_rate_limit_ignores_producer_id():
+    with running_cluster(["000"], ("--client-rate", "1", "--client-burst", str(BURST))):
+        asyncio.run(run_test())
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    test_rate_limit_ignores_producer_id()
@@ -0,0 +1,491 @@
+import json
+import os
+import shutil
+import tempfile
+import weakref
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+KIND_TEXT = 0  # Payload is a UTF-8 string
+KIND_JSON = 1  # Payload is any other JSON value, stored encoded
+SEGMENT_MESSAGES = 1024         # A tiered log seals its tail segment after this many messages
+SEGMENT_BYTES = 256 * 1024      # ... or once it holds about this many bytes
+MESSAGE_OVERHEAD = 57           # Approximate bytes of a str object plus its list slot, beyond the payload
+
+class ArenaMessageLog:
+    """Append-only message list that keeps all payloads in one growable bytes arena.
+
+    A list of str costs a pointer plus a full Python object per message, which
+    is more than a typical 60-byte payload. Here each message costs its encoded
+    bytes plus 13 bytes of bookkeeping: an offset, a length and a kind. Messages
+    are decoded from memoryviews of the arena only when they are read.
+
+    Supports the parts of the list interface that PeerNode uses: len(), indexing,
+    slicing (returns a list), iteration, append, extend, slice insertion and deletion.
+    """
+
+    def __init__(self, messages=()):
+        self.arena = bytearray()
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.kinds = array('B')
+        self.extend(messages)
+
+    def append(self, message):
+        if isinstance(message, str):
+            data, kind = message.encode('utf-8'), KIND_TEXT
+        else:
+            data, kind = json.dumps(message).encode('utf-8'), KIND_JSON
+        self.offsets.append(len(self.arena))
+        self.lengths.append(len(data))
+        self.kinds.append(kind)
+        self.arena += data
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def copy(self):
+        """Independent copy made with a few buffer copies, without decoding any message."""
+        clone = ArenaMessageLog()
+        clone.arena = bytearray(self.arena)
+        clone.offsets = array('Q', self.offsets)
+        clone.lengths = array('I', self.lengths)
+        clone.kinds = array('B', self.kinds)
+        return clone
+
+    def view(self, index):
+        """Zero-copy view of one stored payload. Release it before the next append."""
+        offset = self.offsets[index]
+        return memoryview(self.arena)[offset:offset + self.lengths[index]]
+
+    def views(self, start=0, stop=None):
+        """Zero-copy views of the payloads in [start, stop). Release them before the next append."""
+        arena = memoryview(self.arena)
+        return [arena[self.offsets[i]:self.offsets[i] + self.lengths[i]] for i in range(*slice(start, stop).indices(len(self)))]
+
+    def decode(self, index, arena):
+        offset = self.offsets[index]
+        text = str(arena[offset:offset + self.lengths[index]], 'utf-8')
+        return text if self.kinds[index] == KIND_TEXT else json.loads(text)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        # The memoryview must be released before the arena can grow again
+        with memoryview(self.arena) as arena:
+            if isinstance(index, slice):
+                return [self.decode(i, arena) for i in range(*index.indices(len(self)))]
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("message index out of range")
+            return self.decode(index, arena)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __setitem__(self, index, messages):
+        """Slice assignment, used to insert handed-off messages ahead of newer ones.
+
+        Appending is an extend. Otherwise the bytes and arrays are spliced
+        around the replaced range, without decoding the messages kept.
+        """
+        if not isinstance(index, slice):
+            raise TypeError("ArenaMessageLog only supports slice assignment")
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            current = self[:]
+            current[index] = messages
+            self.__init__(current)
+            return
+        stop = max(start, stop)
+        if start == len(self):
+            self.extend(messages)
+            return
+        inserted = ArenaMessageLog(messages)
+        begin = self.offsets[start]
+        end = self.offsets[stop] if stop < len(self) else len(self.arena)
+        shift = begin + len(inserted.arena) - end
+        self.arena[begin:end] = inserted.arena
+        self.offsets = (self.offsets[:start] + array('Q', (offset + begin for offset in inserted.offsets))
+                        + array('Q', (offset + shift for offset in self.offsets[stop:])))
+        self.lengths[start:stop] = inserted.lengths
+        self.kinds[start:stop] = inserted.kinds
+
+    def __delitem__(self, index):
+        """Delete a slice. Dropping a prefix (expired messages) moves bytes without decoding anything."""
+        if not isinstance(index, slice):
+            raise TypeError("ArenaMessageLog only supports slice deletion")
+        start, stop, step = index.indices(len(self))
+        if start != 0 or step != 1:
+            current = self[:]
+            del current[index]
+            self.__init__(current)
+            return
+        if stop == 0:
+            return
+        shift = self.offsets[stop - 1] + self.lengths[stop - 1]
+        del self.arena[:shift]
+        self.offsets = array('Q', (offset - shift for offset in self.offsets[stop:]))
+        del self.lengths[:stop]
+        del self.kinds[:stop]
+
+    def nbytes(self):
+        """Bytes held by the arena and the bookkeeping arrays."""
+        return (len(self.arena) + self.offsets.itemsize * len(self.offsets)
+                + self.lengths.itemsize * len(self.lengths) + self.kinds.itemsize * len(self.kinds))
+
+def message_size(message):
+    """Approximate memory held by one stored message."""
+    if isinstance(message, str):
+        return len(message) + MESSAGE_OVERHEAD
+    return len(json.dumps(message)) + MESSAGE_OVERHEAD
+
+class Segment:
+    """A run of consecutive messages of a tiered log: in memory, on disk, or both."""
+
+    __slots__ = ("messages", "count", "nbytes", "path", "__weakref__")
+
+    def __init__(self, messages, nbytes):
+        self.messages = messages  # None while only on disk
+        self.count = len(messages)
+        self.nbytes = nbytes
+        self.path = None          # Spill file; sealed segments never change, so it stays valid
+
+    def frozen(self):
+        """Detached copy of where the messages are now, unaffected by later page-ins and page-outs."""
+        copy = Segment.__new__(Segment)
+        copy.messages, copy.count, copy.nbytes, copy.path = self.messages, self.count, self.nbytes, self.path
+        return copy
+
+class TieredStorage:
+    """Memory budget shared by all the tiered logs of a node.
+
+    The open tail segment of every log stays in memory. Sealed segments are
+    kept in LRU order of their last read. When the node uses more than `budget`
+    bytes, the least recently read sealed segments are spilled to files in
+    `directory` and dropped from memory. Reading one pages it back in. A
+    segment is written at most once, since sealed segments never change, so
+    evicting it again only drops the messages from memory.
+    """
+
+    def __init__(self, budget=None, directory=None):
+        self.budget = budget  # Bytes; None never spills
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="pubsub-spill-")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)  # Spill files do not outlive the process
+            os.makedirs(directory)
+        self.directory = directory
+        # Removes the directory on close(), or failing that when collected or at exit
+        self.cleanup = weakref.finalize(self, shutil.rmtree, directory, True)
+        self.resident = OrderedDict()  # Sealed segments held in memory, least recently read first
+        self.used = 0                  # Bytes of resident sealed segments and of all tails
+        self.next_file = 0
+        self.spilled = 0               # Sealed segments only on disk
+        self.frozen = weakref.WeakSet()  # Live snapshot views, which may still read spill files
+        self.graveyard = []            # Spill files to delete once no snapshot view needs them
+        self.stats = {"hits": 0, "misses": 0, "page_outs": 0, "bytes_written": 0, "bytes_read": 0}
+
+    def grow(self, nbytes):
+        self.used += nbytes
+        self.enforce()
+
+    def seal(self, segment):
+        self.resident[segment] = None
+        self.enforce()
+
+    def load(self, segment):
+        """Messages of a sealed segment, paging them in from disk if needed."""
+        if segment.messages is not None:
+            self.stats["hits"] += 1
+            self.resident.move_to_end(segment)
+            return segment.messages
+        self.stats["misses"] += 1
+        with open(segment.path, "rb") as f:
+            data = f.read()
+        self.stats["bytes_read"] += len(data)
+        segment.messages = json.loads(data)
+        self.spilled -= 1
+        self.resident[segment] = None
+        self.used += segment.nbytes
+        self.enforce(keep=segment)
+        return segment.messages
+
+    def enforce(self, keep=None):
+        self.collect()
+        if self.budget is None:
+            return
+        while self.used > self.budget and self.resident:
+            segment = next(iter(self.resident))
+            if segment is keep:
+                break
+            self.page_out(segment)
+
+    def page_out(self, segment):
+        if segment.path is None:
+            segment.path = os.path.join(self.directory, f"{self.next_file}.json")
+            self.next_file += 1
+            data = json.dumps(segment.messages, separators=(",", ":")).encode('utf-8')
+            with open(segment.path, "wb") as f:
+                f.write(data)
+            self.stats["bytes_written"] += len(data)
+        del self.resident[segment]
+        segment.messages = None
+        self.used -= segment.nbytes
+        self.spilled += 1
+        self.stats["page_outs"] += 1
+
+    def drop(self, segment):
+        """Forget a sealed segment whose messages were deleted."""
+        if segment.messages is not None:
+            del self.resident[segment]
+            self.used -= segment.nbytes
+        else:
+            self.spilled -= 1
+        if segment.path is not None:
+            self.graveyard.append(segment.path)
+            self.collect()
+
+    def collect(self):
+        # Delete spill files of dropped segments once no snapshot view can still read them
+        if self.graveyard and not self.frozen:
+            for path in self.graveyard:
+                os.remove(path)
+            self.graveyard = []
+
+    def close(self):
+        self.cleanup()
+
+    def report(self):
+        reads = self.stats["hits"] + self.stats["misses"]
+        return {
+            "budget_bytes": self.budget,
+            "resident_bytes": self.used,
+            "resident_segments": len(self.resident),
+            "spilled_segments": self.spilled,
+            "hit_ratio": round(self.stats["hits"] / reads, 4) if reads else None,
+            **self.stats,
+        }
+
+class TieredMessageLog:
+    """Message list split into segments that can be spilled to disk under a node-wide memory budget.
+
+    Messages are appended to an in-memory tail segment, which is sealed once it
+    holds SEGMENT_MESSAGES messages or SEGMENT_BYTES bytes. Sealed segments are
+    paged in and out by a TieredStorage. Supports the same parts of the list
+    interface as ArenaMessageLog. Dropping a prefix (expired messages) releases
+    whole segments without reading them back.
+    """
+
+    def __init__(self, messages=(), tier=None):
+        self.tier = tier if tier is not None else TieredStorage()
+        self.segments = []  # Sealed segments, oldest first
+        self.starts = []    # Index of the first message of each sealed segment
+        self.sealed = 0     # Messages in sealed segments
+        self.tail = []
+        self.tail_bytes = 0
+        self.extend(messages)
+
+    def append(self, message):
+        self.tail.append(message)
+        nbytes = message_size(message)
+        self.tail_bytes += nbytes
+        self.tier.grow(nbytes)
+        if len(self.tail) >= SEGMENT_MESSAGES or self.tail_bytes >= SEGMENT_BYTES:
+            self.seal()
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def pack(self, messages):
+        """Sealed segments holding `messages`, cut by the same limits as the tail."""
+        segments, chunk, nbytes = [], [], 0
+        for message in messages:
+            chunk.append(message)
+            nbytes += message_size(message)
+            if len(chunk) >= SEGMENT_MESSAGES or nbytes >= SEGMENT_BYTES:
+                segments.append(Segment(chunk, nbytes))
+                chunk, nbytes = [], 0
+        if chunk:
+            segments.append(Segment(chunk, nbytes))
+        for segment in segments:
+            self.tier.grow(segment.nbytes)
+            self.tier.seal(segment)
+        return segments
+
+    def seal(self):
+        segment = Segment(self.tail, self.tail_bytes)
+        self.segments.append(segment)
+        self.starts.append(self.sealed)
+        self.sealed += segment.count
+        self.tail, self.tail_bytes = [], 0
+        self.tier.seal(segment)
+
+    def __len__(self):
+        return self.sealed + len(self.tail)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return self[start:stop][::step] if start < stop else []
+            return self.read(start, stop, self.tier.load)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        if index >= self.sealed:
+            return self.tail[index - self.sealed]
+        i = bisect_right(self.starts, index) - 1
+        return self.tier.load(self.segments[i])[index - self.starts[i]]
+
+    def read(self, start, stop, load):
+        messages = []
+        i = max(bisect_right(self.starts, start) - 1, 0)
+        while i < len(self.segments) and self.starts[i] < stop:
+            first = self.starts[i]
+            if first + self.segments[i].count > start:
+                messages.extend(load(self.segments[i])[max(start - first, 0):stop - first])
+            i += 1
+        if stop > self.sealed:
+            messages.extend(self.tail[max(start - self.sealed, 0):stop - self.sealed])
+        return messages
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __setitem__(self, index, messages):
+        """Slice assignment, used to insert handed-off messages ahead of newer ones.
+
+        Appending is an extend. Otherwise only the segments overlapping the
+        slice are read and replaced; the others are neither paged in nor copied.
+        """
+        if not isinstance(index, slice):
+            raise TypeError("TieredMessageLog only supports slice assignment")
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            current = self[:]
+            current[index] = messages
+            self.clear()
+            self.extend(current)
+            return
+        stop = max(start, stop)
+        if start == len(self):
+            self.extend(messages)
+            return
+        # Segments from the one holding `start` to the one holding the last replaced message (or `start`)
+        first = bisect_right(self.starts, start) - 1 if start < self.sealed else len(self.segments)
+        last_index = max(stop - 1, start)
+        last = bisect_right(self.starts, last_index) - 1 if last_index < self.sealed else len(self.segments)
+        begin = self.starts[first] if first < len(self.segments) else self.sealed
+        with_tail = last == len(self.segments)
+        end = len(self) if with_tail else self.starts[last] + self.segments[last].count
+        current = self.read(begin, end, self.tier.load)
+        current[start - begin:stop - begin] = messages
+
+        for segment in self.segments[first:last + 1]:
+            self.tier.drop(segment)
+        if with_tail:
+            self.tier.grow(-self.tail_bytes)
+            self.tail, self.tail_bytes = [], 0
+            del self.segments[first:]
+        else:
+            self.segments[first:last + 1] = self.pack(current)
+        self.starts, self.sealed = [], 0
+        for segment in self.segments:
+            self.starts.append(self.sealed)
+            self.sealed += segment.count
+        if with_tail:
+            self.extend(current)
+
+    def __delitem__(self, index):
+        """Delete a slice. Dropping a prefix discards whole segments and their spill files unread."""
+        if not isinstance(index, slice):
+            raise TypeError("TieredMessageLog only supports slice deletion")
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            current = self[:]
+            del current[index]
+            self.clear()
+            self.extend(current)
+            return
+        if start != 0:
+            self[start:stop] = []
+            return
+        while self.segments and self.starts[0] + self.segments[0].count <= stop:
+            self.tier.drop(self.segments.pop(0))
+            self.starts.pop(0)
+        if self.segments and self.starts[0] < stop:
+            # Keep the rest of a partly deleted segment as a new one, so snapshot views of the old stay valid
+            old = self.segments[0]
+            rest = self.tier.load(old)[stop - self.starts[0]:]
+            self.tier.drop(old)
+            self.segments[0] = Segment(rest, sum(message_size(message) for message in rest))
+            self.tier.grow(self.segments[0].nbytes)
+            self.tier.seal(self.segments[0])
+        if stop > self.sealed:
+            self.tail = self.tail[stop - self.sealed:]
+            nbytes = sum(message_size(message) for message in self.tail)
+            self.tier.grow(nbytes - self.tail_bytes)
+            self.tail_bytes = nbytes
+        self.starts, self.sealed = [], 0
+        for segment in self.segments:
+            self.starts.append(self.sealed)
+            self.sealed += segment.count
+
+    def clear(self):
+        for segment in self.segments:
+            self.tier.drop(segment)
+        self.tier.grow(-self.tail_bytes)
+        self.segments, self.starts, self.sealed = [], [], 0
+        self.tail, self.tail_bytes = [], 0
+
+    def copy(self):
+        """Read-only view of the current messages for a snapshot thread; pages nothing in."""
+        view = FrozenLog(self)
+        self.tier.frozen.add(view)
+        return view
+
+    def nbytes(self):
+        """Approximate bytes held in memory by the tail and the resident segments."""
+        return self.tail_bytes + sum(segment.nbytes for segment in self.segments if segment.messages is not None)
+
+class FrozenLog:
+    """What a TieredMessageLog held when it was copied, readable from another thread.
+
+    Sealed segments never change and a log replaces its tail list instead of
+    editing it in place (appends aside), so the captured references stay valid.
+    Spilled segments are read straight from their files, bypassing the LRU.
+    """
+
+    def __init__(self, log):
+        self.segments = [segment.frozen() for segment in log.segments]
+        self.starts = list(log.starts)
+        self.sealed = log.sealed
+        self.tail = log.tail
+        self.length = len(log)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(self.length)
+        return TieredMessageLog.read(self, start, stop, FrozenLog.load)
+
+    @staticmethod
+    def load(segment):
+        if segment.messages is not None:
+            return segment.messages
+        with open(segment.path, "rb") as f:
+            return json.loads(f.read())
+
+STORES = {
+    "list": list,
+    "arena": ArenaMessageLog,
+    "tiered": TieredMessageLog,
+}
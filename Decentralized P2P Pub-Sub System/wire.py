@@ -0,0 +1,205 @@
+import asyncio
+import json
+import socket
+import struct
+import time
+import zlib
+
+# Every message is a frame: 4-byte big-endian body length, 1 byte of flags, then the body.
+# The body is a JSON payload, zlib-compressed when FLAG_COMPRESSED is set. With FLAG_ROUTED
+# the payload is preceded by a 2-byte length and a small uncompressed JSON routing header.
+FRAME_HEADER = struct.Struct("!IB")
+ROUTE_LENGTH = struct.Struct("!H")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+FLAG_COMPRESSED = 0x01           # Payload is zlib-compressed
+FLAG_ACCEPTS_COMPRESSED = 0x02   # Sender is willing to receive compressed frames
+FLAG_ROUTED = 0x04               # Body starts with a routing header
+FLAG_FORWARDED = 0x08            # Sent by a node, so the request did not enter the cluster at the receiver
+
+# Requests addressed to the owner of a key. Nodes that do not own the key read only the
+# routing header and relay the payload and the reply without decoding them.
+ROUTED_COMMANDS = ("CREATE", "PUBLISH", "DELETE", "SUBSCRIBE", "PULL", "DESCRIBE",
+                   "JOIN_GROUP", "HEARTBEAT", "LEAVE_GROUP", "FETCH", "COMMIT")
+
+# Request fields copied into the routing header: forwarding state, plus what the
+# entry node needs to rate-limit a PUBLISH or check that a topic exists without decoding its payload,
+# and how long a long-poll PULL may wait, which every hop adds to its forwarding timeout
+ROUTE_FIELDS = ("hops", "order", "ack", "seq", "producer_id", "topic", "partition", "wait_ms")
+
+def routing_header(message, key):
+    """What a forwarding node needs to know about a request, or None if it is not routed by key."""
+    if key is None or message.get("command") not in ROUTED_COMMANDS:
+        return None
+    route = {"command": message["command"], "key": key}
+    for field in ROUTE_FIELDS:
+        if field in message:
+            route[field] = message[field]
+    return route
+
+class FrameCodec:
+    """Encodes frames, compressing bodies above a size threshold.
+
+    Compression is negotiated: a frame is only compressed for a peer that has
+    advertised FLAG_ACCEPTS_COMPRESSED, either on the request we are answering
+    or on an earlier reply from that peer. Small control messages stay below
+    the threshold and are never compressed. A node's codec sets FLAG_FORWARDED
+    on every frame it sends.
+    """
+
+    def __init__(self, threshold=1024, level=1, enabled=True, forwarded=False):
+        self.threshold = threshold
+        self.level = level
+        self.enabled = enabled
+        self.forwarded = forwarded
+        self.peers_accepting = set()  # (host, port) of peers known to accept compressed requests
+        self.stats = {
+            "frames_sent": 0,
+            "frames_compressed": 0,
+            "bytes_raw": 0,         # Body bytes before compression, all frames sent
+            "bytes_wire": 0,        # Body bytes actually sent, all frames sent
+            "compressed_raw": 0,    # Before/after sizes of the frames that were compressed
+            "compressed_wire": 0,
+            "compress_seconds": 0.0,
+            "decompress_seconds": 0.0,
+        }
+
+    def encode(self, message, compress=False, route=None):
+        body = json.dumps(message).encode('utf-8')
+        raw_size = len(body)
+        flags = FLAG_ACCEPTS_COMPRESSED if self.enabled else 0
+        if self.forwarded:
+            flags |= FLAG_FORWARDED
+
+        if compress and self.enabled and raw_size >= self.threshold:
+            started = time.perf_counter()
+            packed = zlib.compress(body, self.level)
+            self.stats["compress_seconds"] += time.perf_counter() - started
+            if len(packed) < raw_size:
+                self.stats["frames_compressed"] += 1
+                self.stats["compressed_raw"] += raw_size
+                self.stats["compressed_wire"] += len(packed)
+                body = packed
+                flags |= FLAG_COMPRESSED
+
+        self.stats["frames_sent"] += 1
+        self.stats["bytes_raw"] += raw_size
+        self.stats["bytes_wire"] += len(body)
+        if route is not None:
+            return b"".join(routed_frame(flags, route, body))
+        return FRAME_HEADER.pack(len(body), flags) + body
+
+    def decode(self, flags, body):
+        route, payload = split_body(flags, body)
+        return self.decode_payload(flags, payload, route)
+
+    def decode_payload(self, flags, payload, route=None):
+        if flags & FLAG_COMPRESSED:
+            started = time.perf_counter()
+            # Bounded like an uncompressed frame, so a small frame cannot inflate without limit
+            decompressor = zlib.decompressobj()
+            payload = decompressor.decompress(payload, MAX_FRAME_SIZE)
+            if decompressor.unconsumed_tail:
+                raise ValueError(f"Frame decompresses to more than the {MAX_FRAME_SIZE} byte limit")
+            self.stats["decompress_seconds"] += time.perf_counter() - started
+        message = json.loads(bytes(payload))
+        # Relaying nodes only update the routing header, so it has the current hop count
+        if route is not None and "hops" in route:
+            message["hops"] = route["hops"]
+        return message
+
+    def report(self):
+        """Compression statistics, with the ratio of raw to wire bytes for compressed frames."""
+        report = dict(self.stats)
+        report["compress_seconds"] = round(report["compress_seconds"], 6)
+        report["decompress_seconds"] = round(report["decompress_seconds"], 6)
+        report["compression_ratio"] = round(self.stats["compressed_raw"] / self.stats["compressed_wire"], 3) if self.stats["compressed_wire"] else None
+        return report
+
+# Used when the caller has no codec of its own: never compresses, still decodes compressed frames
+PLAIN = FrameCodec(enabled=False)
+
+def split_body(flags, body):
+    """Split a frame body into (routing header or None, payload) without copying the payload."""
+    if not flags & FLAG_ROUTED:
+        return None, body
+    view = memoryview(body)
+    (route_length,) = ROUTE_LENGTH.unpack_from(view)
+    route_end = ROUTE_LENGTH.size + route_length
+    return json.loads(bytes(view[ROUTE_LENGTH.size:route_end])), view[route_end:]
+
+def routed_frame(flags, route, payload):
+    """Buffers of a frame carrying an already encoded payload behind a new routing header."""
+    encoded_route = json.dumps(route, separators=(",", ":")).encode('utf-8')
+    length = ROUTE_LENGTH.size + len(encoded_route) + len(payload)
+    return [FRAME_HEADER.pack(length, flags | FLAG_ROUTED), ROUTE_LENGTH.pack(len(encoded_route)), encoded_route, payload]
+
+async def read_body(reader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    length, flags = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return header, flags, await reader.readexactly(length)
+
+async def read_frame(reader):
+    """Read one frame and return (flags, routing header or None, payload), leaving the payload encoded."""
+    _, flags, body = await read_body(reader)
+    route, payload = split_body(flags, body)
+    return flags, route, payload
+
+async def read_message(reader, codec=PLAIN):
+    """Read one frame from a stream and return (message, flags)."""
+    _, flags, body = await read_body(reader)
+    return codec.decode(flags, body), flags
+
+def write_message(writer, message, codec=PLAIN, compress=False, route=None):
+    """Queue one frame on a stream; the caller drains."""
+    writer.write(codec.encode(message, compress, route))
+
+async def request(host, port, message, codec=PLAIN, key=None):
+    """Open a connection, send one message and return the single reply.
+
+    With the key a request is addressed to, the frame carries a routing header
+    so that nodes along the way can relay it without decoding it.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        write_message(writer, message, codec, compress=(host, port) in codec.peers_accepting,
+                      route=routing_header(message, key))
+        await writer.drain()
+        response, flags = await read_message(reader, codec)
+        if flags & FLAG_ACCEPTS_COMPRESSED:
+            codec.peers_accepting.add((host, port))
+        return response
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def relay(host, port, buffers):
+    """Send an encoded frame and return the reply frame as raw bytes, decoding neither."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.writelines(buffers)
+        await writer.drain()
+        header, _, body = await read_body(reader)
+        return header + body
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+def request_blocking(host, port, message, timeout=1.0):
+    """Blocking counterpart of request() for callers without an event loop."""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(PLAIN.encode(message))
+        length, flags = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+        return PLAIN.decode(flags, recv_exactly(sock, length))
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Connection closed mid-frame")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)